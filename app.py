@@ -4,13 +4,20 @@ import os
 sys.path.append(os.path.join(os.path.dirname(__file__), 'libs'))
 
 from flask import Flask, render_template, request, redirect, url_for, session, jsonify, send_from_directory, send_file, Response
+from werkzeug.http import is_resource_modified
+from werkzeug.security import safe_join
+import hashlib
 import json
+import mimetypes
+from datetime import date, datetime, timezone
 from functools import wraps
 from io import BytesIO
-from os_pdf import build_os_pdf
 import secrets
+import threading
+import time
+from collections import deque
 from db import (
-    create_tables,
+    start_db,
     get_site_content as db_get_site_content,
     save_site_content_section,
     get_admin_password,
@@ -20,48 +27,82 @@ from db import (
     save_repair,
     delete_repair as db_delete_repair,
     get_all_admin_users,
+    get_admin_users_page,
     get_admin_user,
     save_admin_user,
     delete_admin_user,
     get_all_technicians,
+    get_technicians_page,
     get_technician,
     save_technician,
     delete_technician,
     calculate_technician_quality_score,
     get_all_technician_quality_scores,
     get_all_customers,
+    iter_customers_for_export,
     get_customer,
     get_customer_by_doc,
     save_customer,
     delete_customer,
-    get_all_transactions,
     get_transaction,
     save_transaction,
     delete_transaction,
+    search_transactions,
+    get_transaction_categories,
+    iter_transactions_for_export,
+    parse_money,
     get_all_service_orders,
     get_service_order,
+    get_service_orders_for_export,
+    SERVICE_ORDER_EXPORT_MAX,
+    SERVICE_ORDER_MERGED_PDF_MAX,
+    iter_service_orders_for_export,
     get_service_order_by_public_token,
+    get_public_service_order_status,
     save_service_order,
     delete_service_order,
     save_equipment,
     get_business_hours,
     save_business_hours,
     is_business_open as db_is_business_open,
+    get_business_status,
+    get_site_content_section as db_get_site_content_section,
+    get_service_order_status_by_number,
+    hit_rate_limit,
+    get_all_suppliers,
+    get_supplier as db_get_supplier,
+    save_supplier,
+    delete_supplier as db_delete_supplier,
+    get_short_videos,
+    get_pool_stats,
+    get_supplier_cache_stats,
+    begin_request_transaction,
+    init_app as init_db_request_scope,
     get_all_videos,
+    get_videos_page,
     get_video as db_get_video,
+    get_product_photo,
+    PRODUCT_PHOTOS_DIR,
     save_video,
     delete_video as db_delete_video,
 )
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'sua-chave-secreta-mude-isso-em-producao')
+# Quantos proxies confiáveis ficam na frente do app (o Render usa um). O
+# ProxyFix usa o X-Forwarded-For escrito por eles como request.remote_addr;
+# entradas anteriores vêm do cliente e podem ser forjadas. 0 desliga.
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', '1'))
+if TRUSTED_PROXY_HOPS > 0:
+    from werkzeug.middleware.proxy_fix import ProxyFix
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS)
+# Uma conexão do pool por requisição, reutilizada por todos os helpers do db
+init_db_request_scope(app)
 
 # Inicializar banco de dados na inicialização do app
 print("🚀 Inicializando aplicação...")
 try:
-    from db import init_db
-    init_db()  # Inicializar pool primeiro
-    create_tables()  # Depois criar tabelas
+    start_db()  # Pool e schema (ou adiados para o primeiro uso com DB_STARTUP_MODE=lazy)
     print("✅ Banco de dados inicializado com sucesso!")
 except Exception as e:
     print(f"⚠️  Erro ao inicializar banco de dados: {e}")
@@ -81,32 +122,85 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# Limite de consultas públicas de OS por IP. Com banco a contagem fica na
+# tabela rate_limits (db.hit_rate_limit), compartilhada entre os workers; sem
+# banco (ou se ele falhar) vale a janela deslizante em memória do processo.
+OS_LOOKUP_RATE_LIMIT = int(os.environ.get('OS_LOOKUP_RATE_LIMIT', '10'))
+OS_LOOKUP_RATE_WINDOW = int(os.environ.get('OS_LOOKUP_RATE_WINDOW', '60'))
+
+_rate_limit_hits = {}
+_rate_limit_lock = threading.Lock()
+
+def _client_ip():
+    """IP do cliente (já corrigido pelo ProxyFix conforme TRUSTED_PROXY_HOPS)"""
+    return request.remote_addr or ''
+
+def _rate_limited(key, limit, window):
+    """Registra uma tentativa e indica se `key` passou de `limit` em `window` segundos"""
+    shared = hit_rate_limit(key, limit, window)
+    if shared is not None:
+        return shared
+    now = time.monotonic()
+    with _rate_limit_lock:
+        hits = _rate_limit_hits.get(key)
+        if hits is None:
+            if len(_rate_limit_hits) > 10000:
+                # Descarta chaves sem tentativas recentes para não crescer sem limite
+                for k in [k for k, v in _rate_limit_hits.items() if not v or v[-1] <= now - window]:
+                    del _rate_limit_hits[k]
+            hits = _rate_limit_hits[key] = deque()
+        while hits and hits[0] <= now - window:
+            hits.popleft()
+        if len(hits) >= limit:
+            return True
+        hits.append(now)
+        return False
+
+_STATUS_LABELS = {
+    'aberta': 'Aberta',
+    'aguardando': 'Aguardando',
+    'em_analise': 'Em análise',
+    'orcamento': 'Orçamento',
+    'aguardando_aprovacao': 'Aguardando aprovação',
+    'aprovado': 'Aprovado',
+    'em_manutencao': 'Em manutenção',
+    'em_reparo': 'Em reparo',
+    'aguardando_peca': 'Aguardando peça',
+    'concluido': 'Finalizado',
+    'concluida': 'Finalizada',
+    'finalizado': 'Finalizado',
+    'entregue': 'Entregue',
+    'cancelado': 'Cancelado',
+    'cancelada': 'Cancelada',
+}
+
+def _status_label(status):
+    status = (status or '').strip()
+    if not status:
+        return 'N/A'
+    return _STATUS_LABELS.get(status.lower(), status.replace('_', ' ').capitalize())
+
 @app.route('/')
 def index():
-    site_content = get_site_content()
+    site_content = db_get_site_content()
     is_open = db_is_business_open()
-    from db import get_all_videos
-    
-    # Pegar apenas os últimos 4 vídeos marcados como shorts
-    all_videos = get_all_videos()
-    shorts = [v for v in all_videos if v.get('is_short')]
-    shorts = shorts[:4]
+    # Apenas os últimos 4 vídeos marcados como shorts
+    shorts = get_short_videos(4)
     
     os_query = (request.args.get('os', '') or '').strip()
     os_lookup = None
     os_lookup_error = None
+    status_code = 200
     if os_query:
         digits = _clean_digits(os_query)
-        if digits:
+        if not digits:
+            os_lookup_error = 'Informe somente números.'
+        elif _rate_limited(f'os:{_client_ip()}', OS_LOOKUP_RATE_LIMIT, OS_LOOKUP_RATE_WINDOW):
+            os_lookup_error = 'Muitas consultas em pouco tempo. Aguarde um instante e tente novamente.'
+            status_code = 429
+        else:
             try:
-                os_number = int(digits)
-                found = None
-                for o in get_all_service_orders():
-                    if not isinstance(o, dict):
-                        continue
-                    if o.get('os_number') == os_number:
-                        found = o
-                        break
+                found = get_service_order_status_by_number(int(digits))
                 if not found:
                     os_lookup_error = 'OS não encontrada.'
                 else:
@@ -123,8 +217,6 @@ def index():
                     }
             except Exception:
                 os_lookup_error = 'Número de OS inválido.'
-        else:
-            os_lookup_error = 'Informe somente números.'
 
     return render_template(
         'index.html',
@@ -136,7 +228,82 @@ def index():
         os_lookup_error=os_lookup_error,
         page=None,
         page_title=None,
-    )
+    ), status_code
+
+def _as_datetime(value):
+    """Converte datetime/date/ISO (banco ou config.json) em datetime UTC.
+
+    Colunas DATE (opened_at, concluded_at, delivered_at) chegam como date e
+    viram meia-noite UTC, sem deslocar o dia.
+    """
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    elif isinstance(value, date) and not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day, tzinfo=timezone.utc)
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+def _format_os_date(value):
+    parsed = _as_datetime(value)
+    if parsed is not None:
+        return parsed.strftime('%d/%m/%Y')
+    return (str(value).strip() if value else '') or None
+
+# Acompanhamento da OS pelo link/QR do cliente. A projeção vem do cache curto
+# do db.py; o ETag deriva de updated_at, então a página recarregada sem
+# alteração responde 304 sem renderizar nada.
+@app.route('/os/<public_token>')
+def service_order_public_status(public_token):
+    found = get_public_service_order_status(public_token)
+    if not found:
+        if _rate_limited(f'os-token:{_client_ip()}', OS_LOOKUP_RATE_LIMIT, OS_LOOKUP_RATE_WINDOW):
+            return "Muitas consultas em pouco tempo. Aguarde um instante e tente novamente.", 429
+        return "OS não encontrada", 404
+
+    # O equipamento fica em outra tabela: a versão da página cobre os campos
+    # exibidos dele e o updated_at dele, além do updated_at da OS
+    updated_at = _as_datetime(found.get('updated_at'))
+    equipment_updated_at = _as_datetime(found.get('equipment_updated_at'))
+    version = ':'.join(str(v) for v in (
+        found.get('os_number'), found.get('status'),
+        updated_at.isoformat() if updated_at else found.get('updated_at'),
+        found.get('equipment_type'), found.get('equipment_brand'), found.get('equipment_model'),
+        equipment_updated_at.isoformat() if equipment_updated_at else found.get('equipment_updated_at'),
+    ))
+    etag = hashlib.sha256(version.encode('utf-8')).hexdigest()[:32]
+    last_modified = max((d for d in (updated_at, equipment_updated_at) if d is not None), default=None)
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified, ignore_if_range=True):
+        response = Response(status=304)
+    else:
+        equipment = ' '.join(
+            p for p in (found.get('equipment_type'), found.get('equipment_brand'), found.get('equipment_model')) if p
+        )
+        response = Response(render_template(
+            'os_status.html',
+            order={
+                'os_number': found.get('os_number'),
+                'status_label': _status_label(found.get('status')),
+                'equipment': equipment or None,
+                'opened_at': _format_os_date(found.get('opened_at')),
+                'concluded_at': _format_os_date(found.get('concluded_at')),
+                'delivered_at': _format_os_date(found.get('delivered_at')),
+                'updated_at': _format_os_date(found.get('updated_at')),
+            },
+        ), mimetype='text/html')
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.headers['X-Robots-Tag'] = 'noindex'
+    return response
 
 def _render_site_page(page, page_title):
     site_content = get_site_content()
@@ -214,7 +381,7 @@ def admin_logout():
 @app.route('/admin')
 @login_required
 def admin_dashboard():
-    return render_template('admin/dashboard.html')
+    return render_template('admin/dashboard.html', supplier_cache_stats=get_supplier_cache_stats())
 
 @app.route('/admin/hero', methods=['GET', 'POST'])
 @login_required
@@ -379,13 +546,13 @@ def admin_videos():
         
         return redirect(url_for('admin_videos'))
     
-    videos = get_all_videos()
-    return render_template('admin/videos.html', videos=videos)
+    cursor = request.args.get('cursor', '').strip() or None
+    page = get_videos_page(cursor)
+    return render_template('admin/videos.html', videos=page['items'], cursor=cursor, list_page=page)
 
 @app.route('/api/contact-info')
 def api_contact_info():
-    site_content = db_get_site_content()
-    contact = site_content.get('contact', {})
+    contact = db_get_site_content_section('contact') or {}
     return jsonify({
         'whatsapp': contact.get('whatsapp', ''),
         'phone': contact.get('phone', ''),
@@ -400,6 +567,8 @@ def admin_contact():
     business_hours = get_business_hours()
     
     if request.method == 'POST':
+        # Contato e horários são salvos juntos ou nenhum dos dois
+        begin_request_transaction()
         contact['cnpj'] = request.form.get('cnpj', '')
         contact['phone'] = request.form.get('phone', '')
         contact['email'] = request.form.get('email', '')
@@ -482,8 +651,9 @@ def admin_nfse():
 @login_required
 def admin_users():
     """Lista todos os usuários do admin"""
-    users = get_all_admin_users()
-    return render_template('admin/users.html', users=users)
+    cursor = request.args.get('cursor', '').strip() or None
+    page = get_admin_users_page(cursor)
+    return render_template('admin/users.html', users=page['items'], cursor=cursor, list_page=page)
 
 @app.route('/admin/users/new', methods=['GET', 'POST'])
 @login_required
@@ -564,8 +734,9 @@ def admin_delete_user(user_id):
 @login_required
 def admin_technicians():
     """Lista todos os técnicos"""
-    technicians = get_all_technicians()
-    return render_template('admin/technicians.html', technicians=technicians)
+    cursor = request.args.get('cursor', '').strip() or None
+    page = get_technicians_page(cursor)
+    return render_template('admin/technicians.html', technicians=page['items'], cursor=cursor, list_page=page)
 
 @app.route('/admin/technicians/new', methods=['GET', 'POST'])
 @login_required
@@ -626,19 +797,57 @@ def _clean_digits(value):
     import re
     return re.sub(r'\D', '', (value or '').strip())
 
-def _parse_money(value):
-    value = (value or '').strip()
-    if not value:
-        return 0.0
-    cleaned = value.replace('R$', '').replace(' ', '')
-    if ',' in cleaned and '.' in cleaned:
-        cleaned = cleaned.replace('.', '').replace(',', '.')
-    elif ',' in cleaned and '.' not in cleaned:
-        cleaned = cleaned.replace(',', '.')
-    try:
-        return float(cleaned)
-    except Exception:
-        return 0.0
+# Planilhas (CSV/XLSX) geradas em streaming: as linhas saem do cursor do
+# banco direto para a resposta, sem montar a lista inteira na memória
+# Sem charset aqui: o Werkzeug acrescenta '; charset=utf-8' aos tipos text/*
+_SPREADSHEET_MIMETYPES = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+def _spreadsheet_response(rows, columns, basename, export_format, sheet_name):
+    import exports
+    if export_format not in _SPREADSHEET_MIMETYPES:
+        return "Formato inválido (use csv ou xlsx)", 400
+    if export_format == 'xlsx' and not exports.XLSX_AVAILABLE:
+        return "XlsxWriter não está instalado no ambiente; use format=csv", 500
+    if export_format == 'csv':
+        body = exports.stream_csv(rows, columns)
+    else:
+        body = exports.stream_xlsx(rows, columns, sheet_name)
+    response = Response(body, mimetype=_SPREADSHEET_MIMETYPES[export_format])
+    response.headers['Content-Disposition'] = f'attachment; filename="{basename}.{export_format}"'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/admin/financeiro/export', methods=['GET'])
+@login_required
+def admin_financeiro_export():
+    """Extrato do financeiro com os mesmos filtros da listagem"""
+    q = request.args.get('q', '').strip()
+    tx_type = request.args.get('type', '').strip()
+    category = request.args.get('category', '').strip()
+    start_date = request.args.get('start_date', '').strip()
+    end_date = request.args.get('end_date', '').strip()
+    export_format = request.args.get('format', 'csv').strip().lower()
+
+    import exports
+    rows = iter_transactions_for_export(
+        q=q,
+        tx_type=tx_type,
+        category=category,
+        start_date=start_date,
+        end_date=end_date,
+    )
+    label = '_'.join(p for p in (start_date, end_date) if p) or 'completo'
+    return _spreadsheet_response(rows, exports.TRANSACTION_COLUMNS, f"financeiro-{label}", export_format, 'Financeiro')
+
+@app.route('/admin/customers/export', methods=['GET'])
+@login_required
+def admin_customers_export():
+    export_format = request.args.get('format', 'csv').strip().lower()
+    import exports
+    return _spreadsheet_response(iter_customers_for_export(), exports.CUSTOMER_COLUMNS, 'clientes', export_format, 'Clientes')
 
 @app.route('/admin/financeiro', methods=['GET'])
 @login_required
@@ -649,59 +858,36 @@ def admin_financeiro():
     start_date = request.args.get('start_date', '').strip()
     end_date = request.args.get('end_date', '').strip()
 
-    transactions = get_all_transactions()
-    normalized = []
-    for t in transactions:
-        if not isinstance(t, dict):
-            continue
-        tx = t.copy()
-        tx_id = tx.get('id')
-        if not tx_id:
-            continue
-        tx['type'] = (tx.get('type') or '').strip()
-        tx['category'] = (tx.get('category') or '').strip()
-        tx['description'] = (tx.get('description') or '').strip()
-        tx['payment_method'] = (tx.get('payment_method') or '').strip()
-        tx['date'] = (tx.get('date') or '').strip()
-        tx['amount'] = tx.get('amount', 0)
-        try:
-            tx['amount'] = float(tx['amount'])
-        except Exception:
-            tx['amount'] = _parse_money(str(tx['amount']))
-        normalized.append(tx)
-
-    filtered = []
-    ql = q.lower()
-    for tx in normalized:
-        if tx_type and tx.get('type') != tx_type:
-            continue
-        if category and tx.get('category') != category:
-            continue
-        d = tx.get('date') or ''
-        if start_date and d and d < start_date:
-            continue
-        if end_date and d and d > end_date:
-            continue
-        if q:
-            if ql not in (tx.get('description') or '').lower() and ql not in (tx.get('category') or '').lower() and ql not in (tx.get('payment_method') or '').lower():
-                continue
-        filtered.append(tx)
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+    except ValueError:
+        page = 1
 
-    total_income = sum(t.get('amount', 0.0) for t in filtered if t.get('type') == 'entrada')
-    total_expense = sum(t.get('amount', 0.0) for t in filtered if t.get('type') == 'saida')
+    result = search_transactions(
+        q=q,
+        tx_type=tx_type,
+        category=category,
+        start_date=start_date,
+        end_date=end_date,
+        page=page,
+    )
+    total_income = result['total_income']
+    total_expense = result['total_expense']
     balance = total_income - total_expense
-
-    categories = sorted({(t.get('category') or '').strip() for t in normalized if (t.get('category') or '').strip()})
+    total_pages = max((result['total_count'] + result['per_page'] - 1) // result['per_page'], 1)
 
     return render_template(
         'admin/financeiro.html',
-        transactions=filtered,
+        transactions=result['items'],
+        page=result['page'],
+        total_pages=total_pages,
+        total_count=result['total_count'],
         q=q,
         type=tx_type,
         category=category,
         start_date=start_date,
         end_date=end_date,
-        categories=categories,
+        categories=get_transaction_categories(),
         total_income=total_income,
         total_expense=total_expense,
         balance=balance
@@ -723,7 +909,7 @@ def admin_new_transaction():
         tx = {
             'id': tx_id,
             'type': tx_type,
-            'amount': _parse_money(request.form.get('amount', '')),
+            'amount': parse_money(request.form.get('amount', '')),
             'description': (request.form.get('description', '') or '').strip(),
             'category': (request.form.get('category', '') or '').strip(),
             'payment_method': (request.form.get('payment_method', '') or '').strip(),
@@ -762,7 +948,7 @@ def admin_edit_transaction(transaction_id):
         updated = {
             'id': transaction_id,
             'type': tx_type,
-            'amount': _parse_money(request.form.get('amount', '')),
+            'amount': parse_money(request.form.get('amount', '')),
             'description': (request.form.get('description', '') or '').strip(),
             'category': (request.form.get('category', '') or '').strip(),
             'payment_method': (request.form.get('payment_method', '') or '').strip(),
@@ -882,16 +1068,17 @@ def admin_view_supplier(supplier_id):
 @login_required
 def admin_search_suppliers():
     """Busca produtos nos sites dos fornecedores"""
-    from supplier_scraper import search_product_in_suppliers
+    from supplier_scraper import cached_search
     
     query = request.args.get('query', '').strip()
     results = []
     error = None
+    cache_info = None
     
     if query:
         try:
             suppliers = get_all_suppliers()
-            results = search_product_in_suppliers(suppliers, query)
+            results, cache_info = cached_search(suppliers, query)
         except Exception as e:
             error = f"Erro ao buscar nos fornecedores: {str(e)}"
             print(f"Erro na busca de fornecedores: {e}")
@@ -899,7 +1086,51 @@ def admin_search_suppliers():
     return render_template('admin/dashboard.html', 
                          supplier_results=results,
                          search_query=query,
-                         search_error=error)
+                         search_error=error,
+                         search_cache=cache_info,
+                         supplier_cache_stats=get_supplier_cache_stats())
+
+# Busca em segundo plano: o formulário do dashboard cria o job e acompanha os
+# fornecedores concluídos consultando o estado a cada segundo (polling curto,
+# sem prender uma thread do gthread por busca).
+
+@app.route('/admin/search-suppliers/jobs', methods=['POST'])
+@login_required
+def admin_search_suppliers_start():
+    """Inicia a busca e retorna o id do job"""
+    from supplier_scraper import start_search_job
+
+    query = (request.form.get('query') or (request.get_json(silent=True) or {}).get('query') or '').strip()
+    if not query:
+        return jsonify({'error': 'Informe o produto a buscar'}), 400
+    try:
+        suppliers = get_all_suppliers()
+        job = start_search_job(suppliers, query)
+    except Exception as e:
+        print(f"Erro na busca de fornecedores: {e}")
+        return jsonify({'error': f"Erro ao buscar nos fornecedores: {str(e)}"}), 500
+    return jsonify(job), 202
+
+@app.route('/admin/search-suppliers/jobs/<job_id>', methods=['GET'])
+@login_required
+def admin_search_suppliers_job(job_id):
+    """Estado atual do job (polling)"""
+    from supplier_scraper import get_search_job
+
+    job = get_search_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Busca não encontrada'}), 404
+    return jsonify(job)
+
+@app.route('/admin/search-suppliers/jobs/<job_id>/cancel', methods=['POST'])
+@login_required
+def admin_search_suppliers_cancel(job_id):
+    """Cancela a busca; o que já foi encontrado continua disponível"""
+    from supplier_scraper import cancel_search_job
+
+    if not cancel_search_job(job_id):
+        return jsonify({'error': 'Busca não encontrada'}), 404
+    return jsonify({'success': True})
 
 # ========== ROTAS PÚBLICAS DA LOJA REMOVIDAS ==========
 
@@ -982,128 +1213,336 @@ def calculate_shipping():
 
 
 
+def _service_order_public_url(order):
+    """URL do QR da OS: página do token quando existir, senão a consulta pelo número"""
+    if order.get('public_token'):
+        return url_for('service_order_public_status', public_token=order['public_token'], _external=True)
+    if order.get('os_number'):
+        return url_for('index', os=order['os_number'], _external=True)
+    return None
+
+# PDF da OS (gerado uma vez por versão da OS e servido com ETag)
+@app.route('/admin/service-orders/<order_id>/pdf')
+@login_required
+def admin_service_order_pdf(order_id):
+    order = get_service_order(order_id)
+    if not order:
+        return "OS não encontrada", 404
+
+    company = (db_get_site_content() or {}).get('contact') or {}
+    logo_path = os.path.join(app.root_path, 'static', 'images', 'logopdf.png')
+    public_url = _service_order_public_url(order)
+
+    from os_pdf import get_os_pdf, os_pdf_etag
+    etag = os_pdf_etag(order, company, logo_path, public_url)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        try:
+            pdf, etag = get_os_pdf(order, company, logo_path, public_url)
+        except RuntimeError as e:
+            return str(e), 500
+        response = Response(pdf, mimetype='application/pdf')
+        os_number = order.get('os_number')
+        filename = f"OS-{int(os_number):06d}.pdf" if os_number not in [None, ''] else f"OS-{order_id}.pdf"
+        response.headers['Content-Disposition'] = f'inline; filename="{filename}"'
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+# Exportação em lote: várias OS em um PDF único ou em um ZIP, ou a planilha
+# das OS do filtro (CSV/XLSX), enviados em streaming
+@app.route('/admin/service-orders/export')
+@login_required
+def admin_service_orders_export():
+    start_date = request.args.get('start_date', '').strip() or None
+    end_date = request.args.get('end_date', '').strip() or None
+    status = request.args.get('status', '').strip() or None
+    export_format = request.args.get('format', 'zip').strip().lower()
+
+    if export_format in _SPREADSHEET_MIMETYPES:
+        import exports
+        rows = iter_service_orders_for_export(start_date=start_date, end_date=end_date, status=status)
+        label = '_'.join(p for p in (start_date, end_date, status) if p) or 'todas'
+        return _spreadsheet_response(rows, exports.SERVICE_ORDER_COLUMNS, f"OS-{label}", export_format, 'Ordens de serviço')
+    if export_format not in ('zip', 'pdf'):
+        return "Formato inválido (use pdf, zip, csv ou xlsx)", 400
+    import os_pdf
+    if not os_pdf.REPORTLAB_AVAILABLE:
+        return "ReportLab não está instalado no ambiente", 500
+    if export_format == 'pdf' and not os_pdf.can_merge_pdfs():
+        return "pypdf não está instalado no ambiente; use format=zip", 500
+
+    limit = SERVICE_ORDER_MERGED_PDF_MAX if export_format == 'pdf' else SERVICE_ORDER_EXPORT_MAX
+    orders = get_service_orders_for_export(start_date=start_date, end_date=end_date, status=status, limit=limit)
+    if not orders:
+        return "Nenhuma OS encontrada para o filtro", 404
+    if len(orders) > limit:
+        hint = "use format=zip ou " if export_format == 'pdf' and limit < SERVICE_ORDER_EXPORT_MAX else ""
+        return f"O filtro tem mais de {limit} OS; {hint}reduza o período", 400
+
+    company = (db_get_site_content() or {}).get('contact') or {}
+    logo_path = os.path.join(app.root_path, 'static', 'images', 'logopdf.png')
+    # As URLs são montadas aqui: o corpo é gerado depois, fora do contexto da requisição
+    public_urls = {order.get('id'): _service_order_public_url(order) for order in orders}
+
+    def _public_url(order):
+        return public_urls.get(order.get('id'))
+
+    label = '_'.join(p for p in (start_date, end_date, status) if p) or 'todas'
+    if export_format == 'pdf':
+        body = os_pdf.stream_os_pdfs_merged(orders, company, logo_path, _public_url)
+        mimetype = 'application/pdf'
+        filename = f"OS-{label}.pdf"
+    else:
+        body = os_pdf.stream_os_pdfs_zip(orders, company, logo_path, _public_url)
+        mimetype = 'application/zip'
+        filename = f"OS-{label}.zip"
+
+    response = Response(body, mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# Fotos de produtos: nomes endereçados pelo conteúdo, então a resposta é imutável.
+# Arquivos antigos em disco (nome livre) são revalidados pelo ETag.
+PRODUCT_PHOTO_MAX_AGE = 31536000
+_photo_file_hashes = {}
+_photo_file_hashes_lock = threading.Lock()
+
+def _photo_file_hash(path):
+    """sha256 do arquivo, recalculado só quando mtime/tamanho mudam"""
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    with _photo_file_hashes_lock:
+        cached = _photo_file_hashes.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(256 * 1024), b''):
+            digest.update(chunk)
+    content_hash = digest.hexdigest()
+    with _photo_file_hashes_lock:
+        _photo_file_hashes[path] = (key, content_hash)
+    return content_hash
+
+def _photo_response(response, content_hash, immutable):
+    response.set_etag(content_hash)
+    response.cache_control.public = True
+    if immutable:
+        response.cache_control.max_age = PRODUCT_PHOTO_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
 @app.route('/static/product_photos/<path:filename>')
 def serve_product_photo(filename):
-    """Serve fotos de produtos do banco de dados"""
-    import base64
-    from flask import Response
-    
-    # Buscar em todos os produtos
-    products = get_all_products()
-    
-    for product in products:
-        photos = product.get('photos', [])
-        for photo_path in photos:
-            if isinstance(photo_path, str) and filename in photo_path:
-                # Verificar se há dados base64 salvos
-                photo_data = product.get('_photo_data', {})
-                if photo_data:
-                    for stored_filename, stored_data in photo_data.items():
-                        if filename in stored_filename or stored_filename in filename:
-                            try:
-                                img_data = base64.b64decode(stored_data)
-                                # Detectar tipo MIME
-                                mimetype = 'image/png'
-                                if filename.lower().endswith('.jpg') or filename.lower().endswith('.jpeg'):
-                                    mimetype = 'image/jpeg'
-                                elif filename.lower().endswith('.png'):
-                                    mimetype = 'image/png'
-                                return Response(img_data, mimetype=mimetype)
-                            except Exception as e:
-                                print(f"Erro ao decodificar imagem {filename}: {e}")
-    
+    """Serve fotos de produtos (tabela product_photos, com fallback para o disco)"""
+    known_hashes = request.if_none_match.as_set(include_weak=True)
+    photo = get_product_photo(filename, known_hashes)
+    if photo:
+        if photo['data'] is None:
+            return _photo_response(Response(status=304), photo['content_hash'], immutable=True)
+        return _photo_response(Response(photo['data'], mimetype=photo['mimetype']), photo['content_hash'], immutable=True)
+
     # Se não encontrou no banco, tentar do disco (fallback)
-    photo_path = os.path.join('static', 'product_photos', filename)
-    if os.path.exists(photo_path):
-        try:
-            with open(photo_path, 'rb') as f:
-                img_data = f.read()
-                mimetype = 'image/png'
-                if filename.lower().endswith('.jpg') or filename.lower().endswith('.jpeg'):
-                    mimetype = 'image/jpeg'
-                return Response(img_data, mimetype=mimetype)
-        except Exception as e:
-            print(f"Erro ao ler arquivo {photo_path}: {e}")
-    
-    return "Imagem não encontrada", 404
+    photo_path = safe_join(PRODUCT_PHOTOS_DIR, filename)
+    if not photo_path or not os.path.isfile(photo_path):
+        return "Imagem não encontrada", 404
+    content_hash = _photo_file_hash(photo_path)
+    stem = os.path.splitext(os.path.basename(photo_path))[0]
+    immutable = len(stem) == 32 and content_hash.startswith(stem)
+    if content_hash in known_hashes:
+        return _photo_response(Response(status=304), content_hash, immutable)
+    mimetype = mimetypes.guess_type(photo_path)[0] or 'image/jpeg'
+    return _photo_response(send_file(photo_path, mimetype=mimetype, conditional=False, etag=False, max_age=PRODUCT_PHOTO_MAX_AGE if immutable else None), content_hash, immutable)
+
+# Vídeos: o corpo nunca passa pela memória do Python. Intervalos únicos e
+# respostas completas saem pelo wsgi.file_wrapper (os.sendfile no gunicorn), com
+# o arquivo já posicionado no início do intervalo e Content-Length limitando o envio.
+# Com um proxy na frente, VIDEO_SENDFILE_MODE entrega o arquivo ao proxy:
+#   x-accel    -> X-Accel-Redirect: VIDEO_ACCEL_PREFIX + arquivo (nginx, location internal)
+#   x-sendfile -> X-Sendfile: caminho absoluto (Apache mod_xsendfile, lighttpd)
+VIDEO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'videos')
+VIDEO_SENDFILE_MODE = os.environ.get('VIDEO_SENDFILE_MODE', '').strip().lower()
+VIDEO_ACCEL_PREFIX = os.environ.get('VIDEO_ACCEL_PREFIX', '/internal/videos/')
+VIDEO_MAX_RANGES = 16
+VIDEO_CACHE_MAX_AGE = 86400
+
+def _parse_byte_ranges(range_header, file_size):
+    """Converte o header Range em intervalos [início, fim) ordenados e mesclados.
+
+    Aceita intervalos fechados (0-99), abertos (100-) e sufixos (-500).
+    Retorna None quando o header deve ser ignorado (sintaxe inválida ou
+    intervalos demais) e [] quando nenhum intervalo é satisfatível (416).
+    """
+    units, _, spec = (range_header or '').partition('=')
+    if units.strip().lower() != 'bytes' or not spec.strip():
+        return None
+    parts = [part.strip() for part in spec.split(',') if part.strip()]
+    if not parts or len(parts) > VIDEO_MAX_RANGES:
+        return None
+    ranges = []
+    for part in parts:
+        first, dash, last = part.partition('-')
+        first, last = first.strip(), last.strip()
+        if not dash or not (first.isdigit() or last.isdigit()) or (first and not first.isdigit()) or (last and not last.isdigit()):
+            return None
+        if not first:
+            # Sufixo (bytes=-N): os últimos N bytes
+            start, stop = max(file_size - int(last), 0), file_size
+        else:
+            start = int(first)
+            if last and int(last) < start:
+                return None
+            stop = min(int(last) + 1, file_size) if last else file_size
+        if start < stop:
+            ranges.append([start, stop])
+    ranges.sort()
+    merged = []
+    for start, stop in ranges:
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], stop)
+        else:
+            merged.append([start, stop])
+    return [tuple(r) for r in merged]
+
+def _if_range_matches(etag, last_modified):
+    """If-Range: o Range só vale se o arquivo ainda for a versão que o cliente tem"""
+    header = request.headers.get('If-Range')
+    if not header:
+        return True
+    if header.strip().startswith('W/'):
+        # ETag fraco não serve para If-Range
+        return False
+    if_range = request.if_range
+    if if_range.etag is not None:
+        return if_range.etag == etag
+    if if_range.date is not None:
+        return if_range.date == last_modified
+    return False
+
+def _read_file_range(f, length):
+    remaining = length
+    while remaining > 0:
+        chunk = f.read(min(256 * 1024, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+def _video_file_response(video_path, offset=0, length=None, status=200, mimetype='video/mp4'):
+    """Resposta com o arquivo entregue pelo servidor WSGI (sendfile), sem ler os bytes aqui"""
+    f = open(video_path, 'rb')
+    if offset:
+        f.seek(offset)
+    if length is None:
+        length = os.fstat(f.fileno()).st_size - offset
+    if 'wsgi.file_wrapper' in request.environ:
+        # O gunicorn envia a partir da posição atual do arquivo e nunca além do Content-Length
+        body = request.environ['wsgi.file_wrapper'](f)
+    else:
+        # Servidor de desenvolvimento: sem sendfile, lê em blocos
+        body = _read_file_range(f, length)
+    response = Response(body, status=status, mimetype=mimetype, direct_passthrough=True)
+    response.content_length = length
+    # HEAD e 304 não consomem o iterável; o arquivo precisa ser fechado mesmo assim
+    response.call_on_close(f.close)
+    return response
+
+def _multipart_byteranges(video_path, ranges, file_size, mimetype, boundary):
+    """Corpo multipart/byteranges para pedidos com vários intervalos"""
+    with open(video_path, 'rb') as f:
+        for start, stop in ranges:
+            yield (
+                f'\r\n--{boundary}\r\n'
+                f'Content-Type: {mimetype}\r\n'
+                f'Content-Range: bytes {start}-{stop - 1}/{file_size}\r\n\r\n'
+            ).encode('ascii')
+            f.seek(start)
+            yield from _read_file_range(f, stop - start)
+        yield f'\r\n--{boundary}--\r\n'.encode('ascii')
+
+def _multipart_length(ranges, file_size, mimetype, boundary):
+    length = len(f'\r\n--{boundary}--\r\n')
+    for start, stop in ranges:
+        length += len(
+            f'\r\n--{boundary}\r\n'
+            f'Content-Type: {mimetype}\r\n'
+            f'Content-Range: bytes {start}-{stop - 1}/{file_size}\r\n\r\n'
+        ) + (stop - start)
+    return length
 
-# Rota para servir vídeos com streaming adequado (evita timeout)
 @app.route('/static/videos/<path:filename>')
 def serve_video(filename):
-    """Serve vídeos com range requests para streaming adequado e eficiente"""
-    from flask import Response, request
-    import os
-    
-    video_path = os.path.join('static', 'videos', filename)
-    if not os.path.exists(video_path):
+    """Serve vídeos com range requests (inclusive múltiplos) e requisições condicionais"""
+    video_path = safe_join(VIDEO_DIR, filename)
+    if not video_path or not os.path.isfile(video_path):
         return "Vídeo não encontrado", 404
-    
-    file_size = os.path.getsize(video_path)
-    
-    # Suportar range requests para streaming
-    range_header = request.headers.get('Range', None)
-    
-    if not range_header:
-        # Se não há range request, retornar apenas headers para o navegador fazer range request
-        return Response(
-            status=200,
-            mimetype='video/mp4',
-            headers={
-                'Accept-Ranges': 'bytes',
-                'Content-Length': str(file_size),
-                'Content-Type': 'video/mp4'
-            }
-        )
-    
-    # Processar range request
+
+    mimetype = mimetypes.guess_type(video_path)[0] or 'video/mp4'
+
+    if VIDEO_SENDFILE_MODE == 'x-accel':
+        # O nginx cuida de Range, ETag e 304
+        response = Response(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = VIDEO_ACCEL_PREFIX.rstrip('/') + '/' + filename.lstrip('/')
+        return response
+    if VIDEO_SENDFILE_MODE == 'x-sendfile':
+        response = Response(mimetype=mimetype)
+        response.headers['X-Sendfile'] = video_path
+        return response
+
+    stat = os.stat(video_path)
+    file_size = stat.st_size
+    etag = f'{stat.st_mtime_ns:x}-{file_size:x}'
+    last_modified = datetime.fromtimestamp(int(stat.st_mtime), timezone.utc)
+
+    def _with_validators(response):
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.headers['Accept-Ranges'] = 'bytes'
+        response.cache_control.public = True
+        response.cache_control.max_age = VIDEO_CACHE_MAX_AGE
+        return response
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified, ignore_if_range=True):
+        return _with_validators(Response(status=304))
+
+    ranges = None
+    range_header = request.headers.get('Range')
+    if range_header and _if_range_matches(etag, last_modified):
+        ranges = _parse_byte_ranges(range_header, file_size)
+
     try:
-        byte_start = 0
-        byte_end = file_size - 1
-        
-        # Parse do range header (ex: "bytes=0-1023")
-        range_match = range_header.replace('bytes=', '').split('-')
-        if range_match[0]:
-            byte_start = int(range_match[0])
-        if len(range_match) > 1 and range_match[1]:
-            byte_end = int(range_match[1])
-        else:
-            # Se não especificou fim, servir até o final
-            byte_end = file_size - 1
-        
-        # Limitar chunk size para evitar carregar muito na memória
-        max_chunk_size = 10 * 1024 * 1024  # 10MB por chunk
-        content_length = min(byte_end - byte_start + 1, max_chunk_size)
-        byte_end = byte_start + content_length - 1
-        
-        # Usar generator para streaming eficiente
-        def generate():
-            with open(video_path, 'rb') as f:
-                f.seek(byte_start)
-                remaining = content_length
-                chunk_size = 1024 * 1024  # 1MB chunks
-                while remaining > 0:
-                    read_size = min(chunk_size, remaining)
-                    chunk = f.read(read_size)
-                    if not chunk:
-                        break
-                    remaining -= len(chunk)
-                    yield chunk
-        
-        return Response(
-            generate(),
-            status=206,  # Partial Content
-            mimetype='video/mp4',
-            headers={
-                'Content-Range': f'bytes {byte_start}-{byte_end}/{file_size}',
-                'Accept-Ranges': 'bytes',
-                'Content-Length': str(content_length),
-                'Content-Type': 'video/mp4'
-            }
+        if ranges is None:
+            return _with_validators(_video_file_response(video_path, mimetype=mimetype))
+
+        if not ranges:
+            response = Response('Intervalo inválido', status=416)
+            response.headers['Content-Range'] = f'bytes */{file_size}'
+            return _with_validators(response)
+
+        if len(ranges) == 1:
+            start, stop = ranges[0]
+            response = _video_file_response(video_path, offset=start, length=stop - start, status=206, mimetype=mimetype)
+            response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{file_size}'
+            return _with_validators(response)
+
+        # Vários intervalos: raro em players de vídeo, montado em blocos
+        boundary = secrets.token_hex(16)
+        response = Response(
+            _multipart_byteranges(video_path, ranges, file_size, mimetype, boundary),
+            status=206,
+            mimetype=f'multipart/byteranges; boundary={boundary}',
+            direct_passthrough=True,
         )
-    except Exception as e:
-        print(f"Erro ao processar range request para {filename}: {e}")
-        import traceback
-        traceback.print_exc()
+        response.content_length = _multipart_length(ranges, file_size, mimetype, boundary)
+        return _with_validators(response)
+    except OSError as e:
+        print(f"Erro ao servir vídeo {filename}: {e}")
         return "Erro ao processar vídeo", 500
 
 # Rota para sitemap.xml (SEO)
@@ -1195,33 +1634,37 @@ Sitemap: {url_root}/sitemap.xml
     return Response(robots_content, mimetype='text/plain')
 
 # API: Status do negócio (aberto/fechado)
+# Limite do max-age para que uma alteração de horário no admin apareça logo
+BUSINESS_STATUS_MAX_AGE = int(os.environ.get('BUSINESS_STATUS_MAX_AGE', '900'))
+
 @app.route('/api/business-status', methods=['GET'])
 def api_business_status():
     """Retorna o status atual do negócio (aberto ou fechado)"""
     try:
-        is_open = db_is_business_open()
-        business_hours = get_business_hours()
-        from datetime import datetime, timedelta
-        
-        # Usar timezone do Brasil (UTC-3)
-        now_utc = datetime.utcnow()
-        now = now_utc - timedelta(hours=3)
-        current_day = now.weekday()
+        status = get_business_status()
+        schedule = status['schedule']
+        now = schedule.now()
         days_map = {0: 'monday', 1: 'tuesday', 2: 'wednesday', 3: 'thursday', 4: 'friday', 5: 'saturday', 6: 'sunday'}
-        day_name = days_map[current_day]
-        day_config = business_hours.get(day_name, {})
-        
-        return jsonify({
+        day_name = days_map[now.weekday()]
+        next_change = status['next_change']
+        seconds = status['seconds_to_change']
+
+        response = jsonify({
             'success': True,
-            'is_open': is_open,
+            'is_open': status['is_open'],
+            'next_change': next_change.isoformat() if next_change else None,
             'debug': {
-                'current_time_utc': datetime.utcnow().strftime('%H:%M'),
+                'current_time_utc': now.astimezone(timezone.utc).strftime('%H:%M'),
                 'current_time_brasil': now.strftime('%H:%M'),
                 'current_day': day_name,
-                'day_config': day_config,
-                'business_hours': business_hours
+                'day_config': schedule.business_hours.get(day_name, {}),
+                'business_hours': schedule.business_hours
             }
         })
+        # Pode ser cacheado até a próxima abertura/fechamento
+        max_age = BUSINESS_STATUS_MAX_AGE if seconds is None else min(seconds, BUSINESS_STATUS_MAX_AGE)
+        response.headers['Cache-Control'] = f'public, max-age={max_age}'
+        return response
     except Exception as e:
         import traceback
         return jsonify({
@@ -1230,6 +1673,21 @@ def api_business_status():
             'traceback': traceback.format_exc()
         }), 500
 
+# API: Estatísticas do pool de conexões (tempo de espera no checkout)
+@app.route('/admin/api/db-stats', methods=['GET'])
+@login_required
+def admin_db_stats():
+    """Retorna as estatísticas do pool de conexões deste worker"""
+    return jsonify(get_pool_stats())
+
+# API: Reuso de conexões HTTP da busca em fornecedores
+@app.route('/admin/api/supplier-http-stats', methods=['GET'])
+@login_required
+def admin_supplier_http_stats():
+    """Requisições e conexões abertas pelas sessões HTTP do scraper neste worker"""
+    from supplier_scraper import get_http_stats
+    return jsonify(get_http_stats())
+
 # Rota para o Web App (PWA) / Mobile App
 @app.route('/mobile_app/')
 @app.route('/mobile_app/<path:path>')
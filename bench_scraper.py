@@ -0,0 +1,152 @@
+"""
+Micro-benchmark da leitura de HTML do supplier_scraper (CPU por página).
+
+Uso:
+    python bench_scraper.py                      # páginas geradas (produto e busca)
+    python bench_scraper.py salvas/ pagina.html  # páginas de fornecedores salvas
+    python bench_scraper.py --repeat 50
+
+Para cada página compara o caminho antigo (BeautifulSoup com html.parser na
+página inteira, JSON-LD lido da árvore) com o atual do supplier_scraper:
+
+- detalhe: JSON-LD direto do texto; a árvore só é montada se não houver
+  Product no JSON-LD (fetch de página de produto);
+- árvore: parse_html() (sem scripts/estilos, lxml se instalado) contra a
+  árvore completa com html.parser, como na página de busca interna.
+
+Também confere que o caminho atual acha pelo menos os produtos do antigo no
+JSON-LD (ele também lê @graph) e os mesmos preços no texto visível.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import sys
+import time
+# Adicionar diretório local de bibliotecas ao path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'libs'))
+
+from bs4 import BeautifulSoup
+
+import supplier_scraper
+
+PRICE_RE = re.compile(r'R\$\s*\d+')
+
+def _old_json_ld(soup):
+    items = []
+    for script in soup.find_all('script', type='application/ld+json'):
+        try:
+            data = json.loads(script.string)
+        except (TypeError, ValueError):
+            continue
+        items.extend(data if isinstance(data, list) else [data])
+    return items
+
+def _product_names(items):
+    return sorted(i.get('name', '') for i in items if isinstance(i, dict) and i.get('@type') == 'Product')
+
+def old_detail(html):
+    soup = BeautifulSoup(html, 'html.parser')
+    return _product_names(_old_json_ld(soup))
+
+def new_detail(html):
+    names = _product_names(supplier_scraper.json_ld_items(html))
+    if not names:
+        supplier_scraper.parse_html(html)
+    return names
+
+def _visible_prices(soup):
+    return sorted(s.strip() for s in soup.find_all(string=PRICE_RE)
+                  if s.parent is not None and s.parent.name not in ('script', 'style'))
+
+def old_tree(html):
+    return _visible_prices(BeautifulSoup(html, 'html.parser'))
+
+def new_tree(html):
+    return _visible_prices(supplier_scraper.parse_html(html))
+
+def _cpu_ms(func, html, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.process_time()
+        func(html)
+        samples.append((time.process_time() - started) * 1000)
+    return statistics.median(samples)
+
+def _generated_pages():
+    """Páginas no formato de lojas WooCommerce/Nuvemshop (cabeçalho, menus, scripts)"""
+    script = "<script>" + "window.dataLayer=window.dataLayer||[];function gtag(){dataLayer.push(arguments)}" * 400 + "</script>"
+    style = "<style>" + ".menu-item a{color:#333;padding:4px 8px}" * 600 + "</style>"
+    svg = "<svg viewBox='0 0 24 24'>" + "<path d='M12 2L2 7l10 5 10-5-10-5z'/>" * 40 + "</svg>"
+    menu = "".join(f"<li class='menu-item'><a href='/categoria/{i}'>Categoria {i}</a>{svg if i % 10 == 0 else ''}</li>" for i in range(150))
+    header = f"<header><nav><ul>{menu}</ul></nav><div class='mini-cart'>R$ 0,00</div></header>"
+    footer = "<footer>" + "".join(f"<p><a href='/pagina/{i}'>Página institucional {i}</a></p>" for i in range(60)) + "</footer>"
+    product = {
+        '@context': 'https://schema.org', '@type': 'Product', 'name': 'Tela Frontal iPhone 11 Incell',
+        'offers': {'@type': 'Offer', 'price': '189.90', 'priceCurrency': 'BRL', 'url': 'https://loja.exemplo/produto/tela-iphone-11'},
+    }
+    graph = {'@context': 'https://schema.org', '@graph': [{'@type': 'WebPage', 'name': 'Tela'}, {'@type': 'Organization', 'name': 'Loja'}]}
+    detail = (
+        f"<html><head>{script}{style}<script type='application/ld+json'>{json.dumps(graph)}</script>"
+        f"<script type='application/ld+json'>{json.dumps(product)}</script></head><body>{header}"
+        f"<main><h1 class='product_title'>Tela Frontal iPhone 11 Incell</h1><p class='price'>R$ 189,90</p>"
+        f"<div class='description'>{'<p>Compatível com iPhone 11 (A2111, A2221, A2223).</p>' * 30}</div></main>"
+        f"{script}{footer}</body></html>"
+    )
+    cards = "".join(
+        f"<li class='product'><a href='/produto/tela-iphone-11-{i}'><img src='/img/{i}.webp' alt='Tela iPhone 11 modelo {i}'>"
+        f"<h2 class='product-title'>Tela iPhone 11 modelo {i}</h2></a>{svg}<span class='price'>R$ {150 + i},90</span></li>"
+        for i in range(24)
+    )
+    search = f"<html><head>{script}{style}</head><body>{header}<main><ul class='products'>{cards}</ul></main>{script}{footer}</body></html>"
+    return [('gerada: página de produto', detail), ('gerada: busca interna', search)]
+
+def _saved_pages(paths):
+    pages = []
+    for path in paths:
+        files = [path]
+        if os.path.isdir(path):
+            files = sorted(os.path.join(path, name) for name in os.listdir(path) if name.lower().endswith(('.html', '.htm')))
+        for file_path in files:
+            with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+                pages.append((file_path, f.read()))
+    return pages
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CPU por página da leitura de HTML do supplier_scraper")
+    parser.add_argument('paths', nargs='*', help="arquivos .html ou pastas com páginas salvas")
+    parser.add_argument('--repeat', type=int, default=20, help="repetições por página; padrão 20")
+    args = parser.parse_args(argv)
+
+    pages = _saved_pages(args.paths) if args.paths else _generated_pages()
+    if not pages:
+        print("❌ Nenhuma página .html encontrada")
+        return 1
+
+    print(f"Parser: {supplier_scraper.HTML_PARSER} · {max(args.repeat, 1)} repetições (mediana de CPU por página)\n")
+    print(f"{'página':<40} {'KB':>6} {'detalhe antes':>14} {'depois':>8} {'árvore antes':>13} {'depois':>8}")
+    mismatches = 0
+    totals = {'old_detail': 0.0, 'new_detail': 0.0, 'old_tree': 0.0, 'new_tree': 0.0}
+    for name, html in pages:
+        row = {key: _cpu_ms(globals()[key], html, max(args.repeat, 1)) for key in totals}
+        for key, value in row.items():
+            totals[key] += value
+        if not set(old_detail(html)) <= set(new_detail(html)) or old_tree(html) != new_tree(html):
+            mismatches += 1
+            print(f"⚠️  {name}: resultado diferente entre os caminhos")
+        print(f"{name[-40:]:<40} {len(html) / 1024:>6.0f} {row['old_detail']:>11.2f} ms {row['new_detail']:>5.2f} ms"
+              f" {row['old_tree']:>10.2f} ms {row['new_tree']:>5.2f} ms")
+
+    print(f"\nDetalhe: {totals['old_detail']:.1f} ms → {totals['new_detail']:.1f} ms "
+          f"({totals['old_detail'] / max(totals['new_detail'], 0.001):.1f}x)")
+    print(f"Árvore:  {totals['old_tree']:.1f} ms → {totals['new_tree']:.1f} ms "
+          f"({totals['old_tree'] / max(totals['new_tree'], 0.001):.1f}x)")
+    if mismatches:
+        print(f"❌ {mismatches} página(s) com resultado diferente")
+        return 1
+    print("✅ Produtos do JSON-LD e preços visíveis preservados no caminho atual")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""
+Benchmark do tempo de import do app (cold start) com `python -X importtime`.
+
+Uso:
+    python bench_startup.py                 # 5 execuções, DB_STARTUP_MODE=lazy, sem banco
+    python bench_startup.py --runs 10 --max-ms 900
+    python bench_startup.py --with-db       # mantém DATABASE_URL do ambiente
+
+Cada execução importa `app` em um processo novo e lê o relatório do
+-X importtime (stderr). Mostra a mediana do tempo acumulado do import de `app`
+e os módulos mais caros. Sai com código 1 se algum módulo pesado que deveria
+ser carregado só no primeiro uso (ReportLab, PIL, BeautifulSoup, pypdf,
+XlsxWriter, supplier_scraper) entrar no import, ou se a mediana passar de
+--max-ms: serve de teste de regressão do startup.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Módulos que não podem ser importados durante o startup
+DEFERRED_MODULES = (
+    'reportlab',
+    'PIL',
+    'bs4',
+    'pypdf',
+    'xlsxwriter',
+    'supplier_scraper',
+    'os_pdf',
+    'exports',
+)
+
+def _parse_importtime(stderr):
+    """{módulo: (self_us, cumulative_us)} a partir da saída do -X importtime"""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3:
+            continue
+        try:
+            self_us = int(parts[0].strip())
+            cumulative_us = int(parts[1].strip())
+        except ValueError:
+            continue
+        modules[parts[2].strip()] = (self_us, cumulative_us)
+    return modules
+
+def run_once(with_db=False):
+    env = dict(os.environ)
+    env.setdefault('DB_STARTUP_MODE', 'lazy')
+    if not with_db:
+        env.pop('DATABASE_URL', None)
+        for var in ('PGHOST', 'PGUSER', 'PGPASSWORD', 'PGDATABASE'):
+            env.pop(var, None)
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import app'],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    if result.returncode != 0:
+        tail = '\n'.join(result.stderr.splitlines()[-20:])
+        raise RuntimeError(f"import app falhou (código {result.returncode}):\n{tail}")
+    return _parse_importtime(result.stderr)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mede o tempo de import do app (python -X importtime)")
+    parser.add_argument('--runs', type=int, default=5, help="execuções (processos novos); padrão 5")
+    parser.add_argument('--top', type=int, default=15, help="módulos mais caros a listar; padrão 15")
+    parser.add_argument('--max-ms', type=float, default=None, help="falha se a mediana passar deste valor")
+    parser.add_argument('--with-db', action='store_true', help="mantém DATABASE_URL (mede também o driver/pool)")
+    args = parser.parse_args(argv)
+
+    totals = []
+    modules = {}
+    for _ in range(max(args.runs, 1)):
+        modules = run_once(with_db=args.with_db)
+        if 'app' not in modules:
+            print("❌ Saída do -X importtime sem o módulo app")
+            return 1
+        totals.append(modules['app'][1] / 1000)
+
+    median = statistics.median(totals)
+    print(f"import app: mediana {median:.1f} ms (mín {min(totals):.1f}, máx {max(totals):.1f}, {len(totals)} execuções)")
+    print(f"\nMódulos mais caros (acumulado, última execução):")
+    ranked = sorted(modules.items(), key=lambda item: item[1][1], reverse=True)
+    for name, (self_us, cumulative_us) in ranked[:args.top]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {self_us / 1000:7.1f} ms  {name}")
+
+    failed = False
+    loaded = sorted(name for name in modules if name.split('.')[0] in DEFERRED_MODULES)
+    if loaded:
+        roots = sorted({name.split('.')[0] for name in loaded})
+        print(f"\n❌ Módulos que deveriam carregar só no primeiro uso: {', '.join(roots)}")
+        failed = True
+    else:
+        print("\n✅ Nenhum módulo pesado carregado no startup")
+    if args.max_ms is not None and median > args.max_ms:
+        print(f"❌ Mediana {median:.1f} ms acima do limite de {args.max_ms:.1f} ms")
+        failed = True
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
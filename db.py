@@ -4,7 +4,14 @@ Compatível com Python 3.13 usando psycopg (psycopg3)
 """
 import os
 import json
+import copy
+import base64
+import hashlib
+import time
+import threading
+from bisect import bisect_right
 from contextlib import contextmanager
+from datetime import datetime as _datetime, timedelta as _timedelta, timezone as _timezone
 from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 
 # Usar psycopg (psycopg3) que é compatível com Python 3.13
@@ -16,43 +23,12 @@ dict_row = None
 try:
     import psycopg
     from psycopg.rows import dict_row
-    
-    # Tentar diferentes formas de importar ConnectionPool
-    ConnectionPool = None
-    import_error_msg = None
-    
-    # Tentativa 1: psycopg_pool (pacote separado)
     try:
         from psycopg_pool import ConnectionPool
-        print("psycopg_pool.ConnectionPool importado com sucesso!")
-    except ImportError as e1:
-        import_error_msg = str(e1)
-        # Tentativa 2: psycopg.pool
-        try:
-            from psycopg.pool import ConnectionPool
-            print("psycopg.pool.ConnectionPool importado com sucesso!")
-        except ImportError as e2:
-            # Tentativa 3: psycopg import pool
-            try:
-                import psycopg.pool as pool_module
-                ConnectionPool = pool_module.ConnectionPool
-                print("psycopg.pool.ConnectionPool importado via modulo!")
-            except (ImportError, AttributeError) as e3:
-                # Tentativa 4: verificar se está no psycopg diretamente
-                if hasattr(psycopg, 'pool'):
-                    ConnectionPool = getattr(psycopg.pool, 'ConnectionPool', None)
-                    if ConnectionPool:
-                        print("ConnectionPool encontrado em psycopg.pool!")
-                    else:
-                        raise ImportError(f"ConnectionPool nao encontrado. Erros: {e1}, {e2}, {e3}")
-                else:
-                    raise ImportError(f"ConnectionPool nao encontrado. Erros: {e1}, {e2}, {e3}")
-    
-    if ConnectionPool is None:
-        raise ImportError("ConnectionPool nao pode ser importado")
-    
+    except ImportError:
+        # Versões antigas expunham o pool dentro do próprio psycopg
+        from psycopg.pool import ConnectionPool
     PSYCOPG_VERSION = 3
-    print("psycopg e ConnectionPool importados com sucesso!")
 except ImportError as e:
     USE_DATABASE = False
     ConnectionPool = None
@@ -91,6 +67,13 @@ def _redact_database_url(database_url):
     except Exception:
         return '***'
 
+def _with_sslmode(database_url):
+    """Adiciona sslmode=require à URL se nenhum sslmode foi informado"""
+    parts = urlsplit(database_url)
+    query = dict(parse_qsl(parts.query, keep_blank_values=True))
+    query.setdefault('sslmode', 'require')
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(query), parts.fragment))
+
 DATABASE_URL = _get_database_url()
 if DATABASE_URL:
     redacted = _redact_database_url(DATABASE_URL)
@@ -110,6 +93,101 @@ else:
 # Pool de conexões
 pool = None
 
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+def _env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+# Dimensionamento e política de saúde do pool (configuráveis pelo ambiente).
+# A validade das conexões é responsabilidade do pool: max_lifetime recicla
+# conexões antigas, max_idle fecha as ociosas e uma thread em segundo plano
+# chama pool.check() a cada DB_POOL_CHECK_INTERVAL segundos. Entre duas
+# verificações o servidor ainda pode derrubar uma conexão ociosa (restart,
+# failover, proxy); por isso o checkout também confere a conexão com uma query
+# vazia (ConnectionPool.check_connection) e troca a quebrada antes de entregá-
+# la. Como a conexão é reaproveitada durante a requisição, isso custa uma ida
+# ao banco por requisição, não por consulta. DB_POOL_CHECK_ON_CHECKOUT=0 desliga.
+POOL_MIN_SIZE = _env_int('DB_POOL_MIN_SIZE', 1)
+POOL_MAX_SIZE = _env_int('DB_POOL_MAX_SIZE', 10)
+POOL_TIMEOUT = _env_float('DB_POOL_TIMEOUT', 10)  # espera máxima por uma conexão livre
+POOL_MAX_WAITING = _env_int('DB_POOL_MAX_WAITING', 10)
+POOL_MAX_IDLE = _env_float('DB_POOL_MAX_IDLE', 300)
+POOL_MAX_LIFETIME = _env_float('DB_POOL_MAX_LIFETIME', 1800)
+POOL_RECONNECT_TIMEOUT = _env_float('DB_POOL_RECONNECT_TIMEOUT', 10)
+POOL_CHECK_INTERVAL = _env_float('DB_POOL_CHECK_INTERVAL', 60)  # 0 desativa
+POOL_CHECK_ON_CHECKOUT = os.environ.get('DB_POOL_CHECK_ON_CHECKOUT', '1').lower() in ('1', 'true', 'yes')
+POOL_SLOW_CHECKOUT_MS = _env_float('DB_POOL_SLOW_CHECKOUT_MS', 200)
+
+_pool_stats = {
+    'checkouts': 0,
+    'checkout_failures': 0,
+    'wait_ms_total': 0.0,
+    'wait_ms_max': 0.0,
+    'slow_checkouts': 0,
+    'broken_connections': 0,
+}
+_pool_stats_lock = threading.Lock()
+_pool_health_thread = None
+_pool_health_wakeup = threading.Event()
+
+def _record_checkout(wait_ms):
+    with _pool_stats_lock:
+        if wait_ms is None:
+            _pool_stats['checkout_failures'] += 1
+            return
+        _pool_stats['checkouts'] += 1
+        _pool_stats['wait_ms_total'] += wait_ms
+        if wait_ms > _pool_stats['wait_ms_max']:
+            _pool_stats['wait_ms_max'] = wait_ms
+        if wait_ms >= POOL_SLOW_CHECKOUT_MS:
+            _pool_stats['slow_checkouts'] += 1
+    if wait_ms >= POOL_SLOW_CHECKOUT_MS:
+        print(f"⚠️  Espera de {wait_ms:.0f} ms para obter conexão do pool")
+
+def get_pool_stats():
+    """Estatísticas do pool: tempo de espera no checkout e números do psycopg_pool"""
+    with _pool_stats_lock:
+        stats = dict(_pool_stats)
+    checkouts = stats['checkouts']
+    stats['wait_ms_avg'] = round(stats['wait_ms_total'] / checkouts, 2) if checkouts else 0.0
+    stats['wait_ms_total'] = round(stats['wait_ms_total'], 2)
+    stats['wait_ms_max'] = round(stats['wait_ms_max'], 2)
+    if pool is not None and hasattr(pool, 'get_stats'):
+        try:
+            stats['pool'] = pool.get_stats()
+        except Exception:
+            pass
+    return stats
+
+def _pool_health_loop():
+    """Verifica periodicamente as conexões ociosas e substitui as quebradas"""
+    while True:
+        _pool_health_wakeup.wait(POOL_CHECK_INTERVAL)
+        _pool_health_wakeup.clear()
+        current = pool
+        if current is None or not hasattr(current, 'check'):
+            continue
+        try:
+            current.check()
+        except Exception as e:
+            print(f"⚠️  Falha na verificação de saúde do pool: {e}")
+
+def _start_pool_health_checker():
+    global _pool_health_thread
+    if POOL_CHECK_INTERVAL <= 0:
+        return
+    if _pool_health_thread is not None and _pool_health_thread.is_alive():
+        return
+    _pool_health_thread = threading.Thread(target=_pool_health_loop, name='db-pool-health', daemon=True)
+    _pool_health_thread.start()
+
 def _load_config_file():
     """Carrega config.json como fallback"""
     if os.path.exists(CONFIG_FILE):
@@ -138,48 +216,42 @@ def init_db():
             
             # Garantir SSL na string de conexão
             if DATABASE_URL:
-                parts = urlsplit(DATABASE_URL)
-                query = dict(parse_qsl(parts.query, keep_blank_values=True))
-                query.setdefault('sslmode', 'require')
-                DATABASE_URL = urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(query), parts.fragment))
+                DATABASE_URL = _with_sslmode(DATABASE_URL)
                     
             if DATABASE_URL:
                 print(f"DATABASE_URL: {_redact_database_url(DATABASE_URL)}")
             
-            # Configurar pool com timeout maior e parâmetros otimizados
-            # psycopg_pool ConnectionPool aceita: min_size, max_size, timeout, max_waiting, max_idle, reconnect_timeout
+            pool_kwargs = dict(
+                min_size=POOL_MIN_SIZE,
+                max_size=max(POOL_MAX_SIZE, POOL_MIN_SIZE),
+                timeout=POOL_TIMEOUT,
+                max_waiting=POOL_MAX_WAITING,
+                max_idle=POOL_MAX_IDLE,
+                max_lifetime=POOL_MAX_LIFETIME,
+                reconnect_timeout=POOL_RECONNECT_TIMEOUT,
+                open=True,
+            )
+            if POOL_CHECK_ON_CHECKOUT and hasattr(ConnectionPool, 'check_connection'):
+                pool_kwargs['check'] = ConnectionPool.check_connection
             try:
-                pool = ConnectionPool(
-                    DATABASE_URL,
-                    min_size=1,
-                    max_size=10,  # Reduzir max_size para evitar esgotamento
-                    timeout=60,  # Aumentar timeout para 60 segundos
-                    max_waiting=10,  # Limitar número de requisições esperando
-                    max_idle=300,  # Fechar conexões idle após 5 minutos
-                    reconnect_timeout=10  # Timeout para reconexão
-                )
+                pool = ConnectionPool(DATABASE_URL, **pool_kwargs)
             except TypeError:
                 # Se alguns parâmetros não forem suportados, usar apenas os básicos
                 print("Usando configuracao basica do pool (alguns parametros nao suportados)")
                 pool = ConnectionPool(
                     DATABASE_URL,
-                    min_size=1,
-                    max_size=10,
-                    timeout=60
+                    min_size=POOL_MIN_SIZE,
+                    max_size=max(POOL_MAX_SIZE, POOL_MIN_SIZE),
+                    timeout=POOL_TIMEOUT
                 )
-            print("Pool de conexoes criado com sucesso!")
-            # Testar conexão criando uma conexão direta primeiro
-            test_conn = pool.getconn(timeout=10)  # Timeout de 10s para teste
+            print(f"Pool de conexoes criado com sucesso! (min={POOL_MIN_SIZE}, max={max(POOL_MAX_SIZE, POOL_MIN_SIZE)})")
+            # Aguardar as conexões mínimas ficarem prontas (testa a conexão sem query extra)
             try:
-                test_cur = test_conn.cursor()
-                test_cur.execute("SELECT 1")
-                test_cur.fetchone()
+                pool.wait(timeout=10)
                 print("Conexao com banco de dados estabelecida!")
             except Exception as e:
                 print(f"Falha ao testar conexao: {e}")
-            finally:
-                if 'test_conn' in locals() and test_conn:
-                    pool.putconn(test_conn)
+            _start_pool_health_checker()
         except Exception as e:
             error_msg = str(e)
             print(f"Erro ao conectar ao banco de dados: {error_msg}")
@@ -194,118 +266,267 @@ def init_db():
             return None
     return pool
 
+# Inicialização do banco. 'eager' (padrão): o app abre o pool e confere o
+# schema ao ser importado. 'lazy': as duas coisas ficam para o primeiro uso do
+# banco (get_db_connection), e o cold start não espera a conexão.
+DB_STARTUP_MODE = os.environ.get('DB_STARTUP_MODE', 'eager').strip().lower()
+
+_startup_lock = threading.RLock()
+_db_ready = False
+_db_starting = False
+
+def ensure_db_ready():
+    """Abre o pool e aplica migrações pendentes, uma única vez por processo"""
+    global _db_ready, _db_starting
+    if _db_ready:
+        return
+    with _startup_lock:
+        # _db_starting: chamada reentrante (create_tables usa get_db_connection)
+        if _db_ready or _db_starting:
+            return
+        _db_starting = True
+        try:
+            init_db()
+            create_tables()
+        finally:
+            _db_starting = False
+            _db_ready = True
+
+def start_db():
+    """Inicialização do banco chamada pelo app, conforme DB_STARTUP_MODE"""
+    if DB_STARTUP_MODE == 'lazy':
+        print("Banco de dados: inicialização adiada para o primeiro uso (DB_STARTUP_MODE=lazy)")
+        return
+    ensure_db_ready()
+
+# Pools herdados do master ficam referenciados aqui para que o __del__ do
+# psycopg_pool não rode no worker (esperaria por threads que não existem)
+_inherited_pools = []
+
+def reset_after_fork():
+    """Descarta o pool herdado do master (hook post_fork do gunicorn).
+
+    Os sockets do pool pertencem ao processo master: o worker não pode usá-los
+    nem fechá-los. O pool é só esquecido e o próximo ensure_db_ready() abre um
+    pool novo dentro do worker.
+    """
+    global pool, _db_ready, _db_starting, _pool_health_thread, _startup_lock
+    if pool is not None:
+        _inherited_pools.append(pool)
+        pool = None
+    _pool_health_thread = None
+    _pool_health_wakeup.clear()
+    _startup_lock = threading.RLock()
+    _db_ready = False
+    _db_starting = False
+
+# ========== CONEXÃO POR REQUISIÇÃO ==========
+# Com init_app(app), cada requisição Flask usa uma única conexão do pool,
+# guardada em flask.g e devolvida no teardown_appcontext. Todos os helpers
+# deste módulo a reutilizam sem mudar de assinatura. Opcionalmente a
+# requisição inteira vira uma única transação (begin_request_transaction ou
+# DB_REQUEST_TRANSACTION=1): o commit acontece só no teardown, e um erro em
+# qualquer helper desfaz todas as escritas da requisição.
+REQUEST_TRANSACTION_DEFAULT = os.environ.get('DB_REQUEST_TRANSACTION', '').lower() in ('1', 'true', 'yes')
+
+_request_scope_enabled = False
+
+def _request_scope():
+    """flask.g da requisição atual, se o escopo por requisição estiver ativo"""
+    if not _request_scope_enabled:
+        return None
+    from flask import g, has_app_context
+    return g if has_app_context() else None
+
+def init_app(app):
+    """Ativa a conexão por requisição para a aplicação Flask"""
+    global _request_scope_enabled
+    _request_scope_enabled = True
+    app.after_request(_commit_request_transaction)
+    app.teardown_appcontext(release_request_connection)
+    from flask import got_request_exception
+    got_request_exception.connect(_mark_request_failed, app, weak=False)
+
+def _mark_request_failed(sender, exception=None, **extra):
+    """Exceção não tratada na view: a transação da requisição não pode ser efetivada"""
+    scope = _request_scope()
+    if scope is not None:
+        scope._db_failed = True
+
+def begin_request_transaction():
+    """Faz com que todas as escritas desta requisição sejam uma única transação"""
+    scope = _request_scope()
+    if scope is not None:
+        scope._db_transaction = True
+
+def _in_request_transaction(scope):
+    return getattr(scope, '_db_transaction', REQUEST_TRANSACTION_DEFAULT)
+
+def _after_commit(callback):
+    """Executa `callback` depois que as escritas atuais forem efetivadas"""
+    scope = _request_scope()
+    if scope is not None and _in_request_transaction(scope) and getattr(scope, '_db_conn', None) is not None:
+        scope._db_after_commit = getattr(scope, '_db_after_commit', [])
+        scope._db_after_commit.append(callback)
+        return
+    callback()
+
+def _run_after_commit_callbacks(callbacks):
+    for callback in callbacks:
+        try:
+            callback()
+        except Exception as e:
+            print(f"⚠️  Erro em callback pós-commit: {e}")
+
+def _commit_request_transaction(response):
+    """Efetiva a transação da requisição antes de a resposta sair.
+
+    Assim uma falha no commit vira erro 500 em vez de um redirect de sucesso.
+    """
+    scope = _request_scope()
+    if scope is None or not _in_request_transaction(scope):
+        return response
+    if response.status_code >= 500:
+        # Página de erro da view (ou de uma exceção não tratada, cujo 500 também
+        # passa por after_request): nada é efetivado, a teardown faz o rollback
+        scope._db_failed = True
+        return response
+    if getattr(scope, '_db_failed', False):
+        # Uma escrita falhou e os helpers caíram no config.json: o restante da
+        # transação será desfeito em release_request_connection, então a
+        # resposta não pode anunciar sucesso.
+        from flask import current_app
+        return current_app.response_class('Erro ao salvar as alterações. Tente novamente.', status=500)
+    conn = getattr(scope, '_db_conn', None)
+    if conn is None:
+        return response
+    try:
+        conn.commit()
+    except Exception as e:
+        scope._db_failed = True
+        _handle_connection_error(conn, e)
+        from flask import current_app
+        return current_app.response_class('Erro ao salvar as alterações. Tente novamente.', status=500)
+    callbacks = getattr(scope, '_db_after_commit', [])
+    scope._db_after_commit = []
+    _run_after_commit_callbacks(callbacks)
+    return response
+
+def release_request_connection(exc=None):
+    """Devolve ao pool a conexão da requisição (commit ou rollback da transação)"""
+    scope = _request_scope()
+    if scope is None:
+        return
+    conn = getattr(scope, '_db_conn', None)
+    callbacks = getattr(scope, '_db_after_commit', [])
+    scope._db_conn = None
+    scope._db_after_commit = []
+    if conn is None:
+        return
+    committed = False
+    try:
+        if _in_request_transaction(scope) and exc is None and not getattr(scope, '_db_failed', False):
+            committed = True
+        else:
+            conn.rollback()
+    except Exception as e:
+        print(f"⚠️  Erro ao finalizar transação da requisição: {e}")
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+    finally:
+        _release_connection(conn)
+    if committed:
+        _run_after_commit_callbacks(callbacks)
+
+def _checkout_connection():
+    started = time.perf_counter()
+    try:
+        conn = pool.getconn(timeout=POOL_TIMEOUT)
+    except Exception as e:
+        _record_checkout(None)
+        print(f"⚠️  Não foi possível obter conexão do pool em {POOL_TIMEOUT:.0f}s: {e}")
+        raise
+    _record_checkout((time.perf_counter() - started) * 1000)
+    return conn
+
+def _release_connection(conn):
+    try:
+        pool.putconn(conn)
+    except Exception:
+        pass
+
+def _handle_connection_error(conn, error):
+    """Rollback após erro; retorna True se a conexão ficou inutilizável"""
+    try:
+        conn.rollback()
+    except Exception:
+        pass
+    if getattr(conn, 'broken', False) or getattr(conn, 'closed', False):
+        with _pool_stats_lock:
+            _pool_stats['broken_connections'] += 1
+        print(f"⚠️  Conexão perdida ({error}); o pool vai substituí-la")
+        _pool_health_wakeup.set()
+        return True
+    print(f"⚠️  Erro na transação: {error}")
+    return False
+
 @contextmanager
 def get_db_connection():
-    """Context manager para obter conexão do pool com retry automático"""
+    """Context manager para obter conexão do pool.
+
+    O pool confere a conexão no checkout (DB_POOL_CHECK_ON_CHECKOUT). Se uma
+    conexão quebrar durante o uso, ela é descartada pelo pool ao ser devolvida
+    e a verificação em segundo plano é antecipada para renovar as demais.
+    Dentro de uma requisição Flask (ver init_app) a conexão da requisição é
+    reutilizada.
+    """
     if not USE_DATABASE:
         yield None
         return
     
-    # Garantir que o pool está inicializado
-    global pool
+    # Garantir que o pool está inicializado (e o schema, no modo lazy)
+    if not _db_ready:
+        ensure_db_ready()
     if pool is None:
-        init_db()
-        if pool is None:
-            yield None
-            return
-    
-    conn = None
-    max_retries = 2
-    for attempt in range(max_retries):
-        try:
-            # Obter conexão com timeout reduzido
-            try:
-                conn = pool.getconn(timeout=10)  # Timeout de 10s para obter conexão
-            except Exception as getconn_error:
-                error_msg = str(getconn_error).lower()
-                if 'timeout' in error_msg or "couldn't get a connection" in error_msg:
-                    print(f"⚠️  Timeout ao obter conexão do pool (tentativa {attempt + 1}/{max_retries})")
-                    if attempt < max_retries - 1:
-                        # Tentar reinicializar o pool
-                        try:
-                            if pool:
-                                pool.close()
-                        except:
-                            pass
-                        pool = None
-                        init_db()
-                        if pool is None:
-                            yield None
-                            return
-                        continue
-                    else:
-                        raise
-                else:
-                    raise
-            
-            # Verificar se a conexão está válida
+        yield None
+        return
+
+    scope = _request_scope()
+    if scope is not None:
+        transactional = _in_request_transaction(scope)
+        conn = getattr(scope, '_db_conn', None)
+        if conn is None:
             try:
-                test_cur = conn.cursor()
-                test_cur.execute("SELECT 1")
-                test_cur.fetchone()
-                test_cur.close()
-            except Exception as conn_check_error:
-                # Conexão inválida, descartar e tentar novamente
-                if conn:
-                    try:
-                        pool.putconn(conn, close=True)  # Fechar conexão inválida
-                    except:
-                        pass
-                conn = None
-                if attempt < max_retries - 1:
-                    print(f"⚠️  Conexão inválida detectada, tentando reconectar... (tentativa {attempt + 1}/{max_retries})")
-                    continue
-                else:
-                    raise
-            
-            # Conexão válida, usar normalmente
+                conn = _checkout_connection()
+            except Exception:
+                if transactional:
+                    scope._db_failed = True
+                raise
+            scope._db_conn = conn
+        try:
             yield conn
-            if conn:
+            if not transactional:
                 conn.commit()
-            break  # Sucesso, sair do loop
         except Exception as e:
-            error_msg = str(e).lower()
-            # Verificar se é erro de conexão perdida
-            if conn:
-                try:
-                    conn.rollback()
-                except:
-                    pass
-                try:
-                    # Tentar retornar conexão ao pool, mas fechar se estiver ruim
-                    if 'connection is lost' in error_msg or 'connection' in error_msg and 'lost' in error_msg:
-                        pool.putconn(conn, close=True)
-                    else:
-                        pool.putconn(conn)
-                except:
-                    pass
-                conn = None
-            
-            # Se for erro de conexão e ainda temos tentativas, tentar reconectar
-            if ('connection' in error_msg and ('lost' in error_msg or 'closed' in error_msg or 'timeout' in error_msg)) and attempt < max_retries - 1:
-                print(f"⚠️  Erro de conexão detectado: {e}, tentando reconectar... (tentativa {attempt + 1}/{max_retries})")
-                # Tentar reinicializar o pool se necessário
-                try:
-                    if pool:
-                        pool.close()
-                except:
-                    pass
-                pool = None
-                init_db()
-                if pool is None:
-                    yield None
-                    return
-                continue
-            else:
-                print(f"⚠️  Erro na transação: {e}")
-                if attempt == max_retries - 1:
-                    raise
-        finally:
-            if conn and attempt == max_retries - 1:
-                try:
-                    pool.putconn(conn)
-                except:
-                    pass
+            if transactional:
+                scope._db_failed = True
+            if _handle_connection_error(conn, e):
+                scope._db_conn = None
+                _release_connection(conn)
+            raise
+        return
+
+    conn = _checkout_connection()
+    try:
+        yield conn
+        conn.commit()
+    except Exception as e:
+        _handle_connection_error(conn, e)
+        raise
+    finally:
+        _release_connection(conn)
 
 def _get_cursor(conn, dict_cursor=False):
     """Helper para obter cursor"""
@@ -317,8 +538,7 @@ def _get_cursor(conn, dict_cursor=False):
         return conn.cursor()
 
 def create_tables():
-    """Cria as tabelas necessárias no banco de dados"""
-    global USE_DATABASE, pool
+    """Leva o schema do banco à versão atual (migrações em migrations.py)"""
     if not USE_DATABASE:
         print("⚠️  create_tables: Banco desabilitado, pulando criação de tabelas")
         return
@@ -329,314 +549,118 @@ def create_tables():
         if pool is None:
             print("⚠️  create_tables: Pool não disponível")
             return
-    
-    # Usar conexão direta para garantir que as tabelas sejam criadas
-    conn = None
-    try:
-        print("📋 Criando tabelas no banco de dados...")
-        
-        # Obter DATABASE_URL
-        database_url = os.getenv('DATABASE_URL')
-        if not database_url:
-            print("⚠️  create_tables: DATABASE_URL não configurada")
-            return
-        
-        # Criar conexão direta (não do pool) para criação de tabelas
-        import psycopg
-        try:
-            conn = psycopg.connect(database_url, autocommit=True, connect_timeout=10)
-        except Exception as conn_error:
-            print(f"❌ create_tables: Erro ao conectar diretamente: {conn_error}")
-            return
-        cur = conn.cursor()
-        
-        # Tabela para conteúdo do site (hero, serviços, sobre, etc.)
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS site_content (
-                id SERIAL PRIMARY KEY,
-                section VARCHAR(50) UNIQUE NOT NULL,
-                data JSONB NOT NULL,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # Tabela para configurações do admin
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS admin_settings (
-                key VARCHAR(100) PRIMARY KEY,
-                value TEXT NOT NULL,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # Tabela para reparos
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS repairs (
-                id VARCHAR(50) PRIMARY KEY,
-                data JSONB NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
 
-        
-        # Tabela para transações financeiras (Fluxo de Caixa)
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS transactions (
-                id VARCHAR(50) PRIMARY KEY,
-                data JSONB NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS customers (
-                id VARCHAR(50) PRIMARY KEY,
-                doc_type VARCHAR(10) NOT NULL,
-                doc_number VARCHAR(14) UNIQUE NOT NULL,
-                data JSONB NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
+    import migrations
+    try:
+        migrations.migrate()
+    except Exception as e:
+        print(f"❌ Erro ao aplicar migrações do banco: {e}")
+        import traceback
+        traceback.print_exc()
+        return
 
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS equipments (
-                id VARCHAR(50) PRIMARY KEY,
-                customer_id VARCHAR(50) NOT NULL,
-                data JSONB NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
+    try:
+        _sync_technician_repair_stats()
+    except Exception as e:
+        print(f"⚠️  Erro ao reconstruir contagens dos técnicos: {e}")
 
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS service_orders (
-                id VARCHAR(50) PRIMARY KEY,
-                os_number SERIAL UNIQUE,
-                customer_id VARCHAR(50) NOT NULL,
-                technician_id VARCHAR(50),
-                equipment_id VARCHAR(50),
-                status VARCHAR(30) NOT NULL,
-                labor_value NUMERIC(12,2) DEFAULT 0,
-                parts_value NUMERIC(12,2) DEFAULT 0,
-                total_value NUMERIC(12,2) DEFAULT 0,
-                budget_date DATE,
-                authorized BOOLEAN DEFAULT FALSE,
-                opened_at DATE,
-                concluded_at DATE,
-                delivered_at DATE,
-                data JSONB NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
+# ========== FUNÇÕES DE SITE CONTENT ==========
 
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS service_order_parts (
-                id SERIAL PRIMARY KEY,
-                service_order_id VARCHAR(50) NOT NULL,
-                part VARCHAR(300) NOT NULL,
-                quantity INTEGER NOT NULL,
-                value NUMERIC(12,2) NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
+# Cache em memória (por worker) do conteúdo do site.
+# O conteúdo muda poucas vezes por mês, então cada worker guarda o JSON já
+# decodificado e só volta ao banco quando a versão (max(updated_at) + count)
+# muda. A versão é conferida no máximo uma vez a cada SITE_CONTENT_CACHE_TTL
+# segundos; dentro dessa janela a renderização das páginas não faz nenhuma query.
+# As funções de escrita invalidam o cache local na hora; os outros workers
+# enxergam a alteração na próxima verificação de versão.
+SITE_CONTENT_CACHE_TTL = float(os.environ.get('SITE_CONTENT_CACHE_TTL', '30'))
+
+_site_content_cache = {'data': None, 'version': None, 'checked_at': 0.0, 'generation': 0}
+_site_content_lock = threading.Lock()
+
+def invalidate_site_content_cache():
+    """Descarta o cache de conteúdo do site deste worker"""
+    with _site_content_lock:
+        _site_content_cache['data'] = None
+        _site_content_cache['version'] = None
+        _site_content_cache['checked_at'] = 0.0
+        _site_content_cache['generation'] += 1
+
+def _get_site_content_version(cur):
+    """Versão barata do conteúdo: não decodifica nenhum JSONB"""
+    cur.execute("SELECT max(updated_at) AS updated_at, count(*) AS total FROM site_content")
+    row = cur.fetchone()
+    return (row['updated_at'], row['total']) if row else (None, 0)
+
+def _peek_site_content_cache():
+    """Retorna (conteúdo em cache, geração, ainda dentro do TTL)"""
+    with _site_content_lock:
+        cached = _site_content_cache['data']
+        fresh = cached is not None and time.monotonic() - _site_content_cache['checked_at'] < SITE_CONTENT_CACHE_TTL
+        return cached, _site_content_cache['generation'], fresh
+
+def _confirm_site_content_cache(version):
+    """Renova o TTL se a versão no banco não mudou; retorna o conteúdo ou None"""
+    with _site_content_lock:
+        if _site_content_cache['data'] is not None and _site_content_cache['version'] == version:
+            _site_content_cache['checked_at'] = time.monotonic()
+            return _site_content_cache['data']
+    return None
 
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS service_order_history (
-                id SERIAL PRIMARY KEY,
-                service_order_id VARCHAR(50) NOT NULL,
-                message TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # Tabela para vídeos do youtube
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS videos (
-                id VARCHAR(50) PRIMARY KEY,
-                data JSONB NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_repairs_repair_id ON repairs(id)")
-
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_customers_doc_number ON customers(doc_number)")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_customers_created_at ON customers(created_at)")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_equipments_customer_id ON equipments(customer_id)")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_service_orders_customer_id ON service_orders(customer_id)")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_service_orders_status ON service_orders(status)")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_service_orders_public_token ON service_orders ((data->>'public_token'))")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_service_order_parts_os_id ON service_order_parts(service_order_id)")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_service_order_history_os_id ON service_order_history(service_order_id)")
-        
-            
-        # Tabela para usuários do admin
-        try:
-            print("📋 Criando tabela admin_users...")
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS admin_users (
-                    id VARCHAR(50) PRIMARY KEY,
-                    username VARCHAR(100) UNIQUE NOT NULL,
-                    password_hash TEXT NOT NULL,
-                    name VARCHAR(200) NOT NULL,
-                    email VARCHAR(200),
-                    phone VARCHAR(20),
-                    permissions JSONB DEFAULT '{}',
-                    is_active BOOLEAN DEFAULT TRUE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            print("✅ Tabela admin_users criada/verificada")
-        except Exception as e:
-            print(f"⚠️  Erro ao criar tabela admin_users: {e}")
-            import traceback
-            traceback.print_exc()
-        
-        # Tabela para técnicos
-        try:
-            print("📋 Criando tabela technicians...")
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS technicians (
-                    id VARCHAR(50) PRIMARY KEY,
-                    name VARCHAR(200) NOT NULL,
-                    cpf VARCHAR(11) UNIQUE,
-                    email VARCHAR(200),
-                    phone VARCHAR(20),
-                    address TEXT,
-                    specialties JSONB DEFAULT '[]',
-                    is_active BOOLEAN DEFAULT TRUE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            print("✅ Tabela technicians criada/verificada")
-        except Exception as e:
-            print(f"⚠️  Erro ao criar tabela technicians: {e}")
-            import traceback
-            traceback.print_exc()
-        
-        # Índices
-        try:
-            print("📋 Criando índices para admin_users e technicians...")
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_admin_users_username ON admin_users(username)")
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_admin_users_active ON admin_users(is_active)")
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_technicians_cpf ON technicians(cpf)")
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_technicians_active ON technicians(is_active)")
-            print("✅ Índices criados/verificados")
-        except Exception as e:
-            print(f"⚠️  Erro ao criar índices: {e}")
-            import traceback
-            traceback.print_exc()
-        
-        # Com autocommit=True, as tabelas já foram criadas automaticamente
-        # Verificar se as tabelas foram criadas
-        try:
-            cur.execute("SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_schema = 'public' AND table_name = 'admin_users')")
-            admin_users_exists = cur.fetchone()[0]
-            cur.execute("SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_schema = 'public' AND table_name = 'technicians')")
-            technicians_exists = cur.fetchone()[0]
-            print(f"✅ Verificação: admin_users existe = {admin_users_exists}, technicians existe = {technicians_exists}")
-            
-            if not admin_users_exists:
-                print("⚠️  ATENÇÃO: admin_users não existe! Criando novamente...")
-                cur.execute("""
-                    CREATE TABLE admin_users (
-                        id VARCHAR(50) PRIMARY KEY,
-                        username VARCHAR(100) UNIQUE NOT NULL,
-                        password_hash TEXT NOT NULL,
-                        name VARCHAR(200) NOT NULL,
-                        email VARCHAR(200),
-                        phone VARCHAR(20),
-                        permissions JSONB DEFAULT '{}',
-                        is_active BOOLEAN DEFAULT TRUE,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
-                print("✅ Tabela admin_users criada!")
-            
-            if not technicians_exists:
-                print("⚠️  ATENÇÃO: technicians não existe! Criando novamente...")
-                cur.execute("""
-                    CREATE TABLE technicians (
-                        id VARCHAR(50) PRIMARY KEY,
-                        name VARCHAR(200) NOT NULL,
-                        cpf VARCHAR(11) UNIQUE,
-                        email VARCHAR(200),
-                        phone VARCHAR(20),
-                        address TEXT,
-                        specialties JSONB DEFAULT '[]',
-                        is_active BOOLEAN DEFAULT TRUE,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
-                print("✅ Tabela technicians criada!")
-            
-            # Verificar novamente
-            cur.execute("SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_schema = 'public' AND table_name = 'admin_users')")
-            admin_users_exists = cur.fetchone()[0]
-            cur.execute("SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_schema = 'public' AND table_name = 'technicians')")
-            technicians_exists = cur.fetchone()[0]
-            print(f"✅ Verificação final: admin_users existe = {admin_users_exists}, technicians existe = {technicians_exists}")
-            
-        except Exception as e:
-            print(f"⚠️  Erro ao verificar/criar tabelas: {e}")
-            import traceback
-            traceback.print_exc()
-        
-        print("✅ Tabelas criadas/verificadas com sucesso!")
-        
-        # Fechar cursor
-        cur.close()
-        
-    except Exception as e:
-        print(f"❌ Erro ao criar tabelas: {e}")
-        import traceback
-        traceback.print_exc()
-    finally:
-        # Fechar conexão direta
-        if conn:
-            try:
-                conn.close()
-                print("✅ Conexão fechada")
-            except Exception as e:
-                print(f"⚠️  Erro ao fechar conexão: {e}")
+def _store_site_content_cache(content, version, generation):
+    with _site_content_lock:
+        # Não sobrescrever uma invalidação feita durante a leitura
+        if _site_content_cache['generation'] != generation:
+            return
+        _site_content_cache['data'] = content
+        _site_content_cache['version'] = version
+        _site_content_cache['checked_at'] = time.monotonic()
 
-# ========== FUNÇÕES DE SITE CONTENT ==========
+def _get_cached_site_content():
+    """Retorna o conteúdo do site decodificado (compartilhado, não modificar)"""
+    cached, generation, fresh = _peek_site_content_cache()
+    if fresh:
+        return cached
 
-def get_site_content():
-    """Obtém todo o conteúdo do site"""
-    if not USE_DATABASE:
-        config = _load_config_file()
-        return config.get('site_content', {})
-    
     try:
         with get_db_connection() as conn:
             if not conn:
+                if cached is not None:
+                    return cached
                 config = _load_config_file()
                 return config.get('site_content', {})
             cur = _get_cursor(conn, dict_cursor=True)
+            version = _get_site_content_version(cur)
+            confirmed = _confirm_site_content_cache(version)
+            if confirmed is not None:
+                return confirmed
+
             cur.execute("SELECT section, data FROM site_content")
             rows = cur.fetchall()
-            
+
             content = {}
             for row in rows:
                 content[row['section']] = row['data']
-            
+
+            _store_site_content_cache(content, version, generation)
             return content
     except Exception as e:
+        if cached is not None:
+            print(f"⚠️  Erro ao ler do banco, usando conteúdo em cache: {e}")
+            return cached
         print(f"⚠️  Erro ao ler do banco, usando config.json: {e}")
         config = _load_config_file()
         return config.get('site_content', {})
 
+def get_site_content():
+    """Obtém todo o conteúdo do site"""
+    if not USE_DATABASE:
+        config = _load_config_file()
+        return config.get('site_content', {})
+
+    # Cópia para que as rotas do admin possam alterar o dict sem sujar o cache
+    return copy.deepcopy(_get_cached_site_content())
+
 def save_site_content_section(section, data):
     """Salva uma seção do conteúdo do site"""
     if not USE_DATABASE:
@@ -664,7 +688,7 @@ def save_site_content_section(section, data):
                 ON CONFLICT (section) 
                 DO UPDATE SET data = %s::jsonb, updated_at = CURRENT_TIMESTAMP
             """, (section, data_json, data_json))
-            conn.commit()
+        _after_commit(invalidate_site_content_cache)
     except Exception as e:
         print(f"⚠️  Erro ao salvar no banco, usando config.json: {e}")
         config = _load_config_file()
@@ -696,8 +720,8 @@ def save_nfse_config(nfse_config):
                 ON CONFLICT (section) 
                 DO UPDATE SET data = %s::jsonb, updated_at = CURRENT_TIMESTAMP
             """, (data_json, data_json))
-            conn.commit()
             print("✅ Configuração NFS-e salva com sucesso!")
+        _after_commit(invalidate_site_content_cache)
     except Exception as e:
         print(f"⚠️  Erro ao salvar configuração NFS-e no banco: {e}")
         config = _load_config_file()
@@ -709,22 +733,9 @@ def get_nfse_config():
     if not USE_DATABASE:
         config = _load_config_file()
         return config.get('nfse_config', {})
-    
-    try:
-        with get_db_connection() as conn:
-            if not conn:
-                config = _load_config_file()
-                return config.get('nfse_config', {})
-            cur = _get_cursor(conn, dict_cursor=True)
-            cur.execute("SELECT data FROM site_content WHERE section = 'nfse_config'")
-            row = cur.fetchone()
-            if row:
-                return row['data']
-            return {}
-    except Exception as e:
-        print(f"⚠️  Erro ao ler configuração NFS-e do banco: {e}")
-        config = _load_config_file()
-        return config.get('nfse_config', {})
+
+    nfse_config = _get_cached_site_content().get('nfse_config')
+    return copy.deepcopy(nfse_config) if nfse_config else {}
 
 def get_site_content_section(section):
     """Obtém uma seção específica do conteúdo do site"""
@@ -732,22 +743,8 @@ def get_site_content_section(section):
         config = _load_config_file()
         site_content = config.get('site_content', {})
         return site_content.get(section)
-    
-    try:
-        with get_db_connection() as conn:
-            if not conn:
-                config = _load_config_file()
-                site_content = config.get('site_content', {})
-                return site_content.get(section)
-            cur = _get_cursor(conn, dict_cursor=True)
-            cur.execute("SELECT data FROM site_content WHERE section = %s", (section,))
-            row = cur.fetchone()
-            return row['data'] if row else None
-    except Exception as e:
-        print(f"⚠️  Erro ao ler do banco, usando config.json: {e}")
-        config = _load_config_file()
-        site_content = config.get('site_content', {})
-        return site_content.get(section)
+
+    return copy.deepcopy(_get_cached_site_content().get(section))
 
 # ========== FUNÇÕES DE ADMIN SETTINGS ==========
 
@@ -793,7 +790,6 @@ def save_admin_password(password):
                 ON CONFLICT (key) 
                 DO UPDATE SET value = %s, updated_at = CURRENT_TIMESTAMP
             """, (password, password))
-            conn.commit()
     except Exception as e:
         print(f"⚠️  Erro ao salvar no banco, usando config.json: {e}")
         config = _load_config_file()
@@ -802,62 +798,40 @@ def save_admin_password(password):
 
 # ========== FUNÇÕES DE HORÁRIOS DE FUNCIONAMENTO ==========
 
+def _default_business_hours():
+    return {
+        'monday': {'open': '09:00', 'close': '18:00', 'enabled': True},
+        'tuesday': {'open': '09:00', 'close': '18:00', 'enabled': True},
+        'wednesday': {'open': '09:00', 'close': '18:00', 'enabled': True},
+        'thursday': {'open': '09:00', 'close': '18:00', 'enabled': True},
+        'friday': {'open': '09:00', 'close': '18:00', 'enabled': True},
+        'saturday': {'open': '09:00', 'close': '18:00', 'enabled': True},
+        'sunday': {'open': '09:00', 'close': '18:00', 'enabled': False}
+    }
+
 def get_business_hours():
     """Obtém os horários de funcionamento"""
     if not USE_DATABASE:
         config = _load_config_file()
-        return config.get('business_hours', {
-            'monday': {'open': '09:00', 'close': '18:00', 'enabled': True},
-            'tuesday': {'open': '09:00', 'close': '18:00', 'enabled': True},
-            'wednesday': {'open': '09:00', 'close': '18:00', 'enabled': True},
-            'thursday': {'open': '09:00', 'close': '18:00', 'enabled': True},
-            'friday': {'open': '09:00', 'close': '18:00', 'enabled': True},
-            'saturday': {'open': '09:00', 'close': '18:00', 'enabled': True},
-            'sunday': {'open': '09:00', 'close': '18:00', 'enabled': False}
-        })
+        return config.get('business_hours', _default_business_hours())
     
     try:
         with get_db_connection() as conn:
             if not conn:
                 config = _load_config_file()
-                return config.get('business_hours', {
-                    'monday': {'open': '09:00', 'close': '18:00', 'enabled': True},
-                    'tuesday': {'open': '09:00', 'close': '18:00', 'enabled': True},
-                    'wednesday': {'open': '09:00', 'close': '18:00', 'enabled': True},
-                    'thursday': {'open': '09:00', 'close': '18:00', 'enabled': True},
-                    'friday': {'open': '09:00', 'close': '18:00', 'enabled': True},
-                    'saturday': {'open': '09:00', 'close': '18:00', 'enabled': True},
-                    'sunday': {'open': '09:00', 'close': '18:00', 'enabled': False}
-                })
+                return config.get('business_hours', _default_business_hours())
             cur = _get_cursor(conn, dict_cursor=True)
             cur.execute("SELECT value FROM admin_settings WHERE key = 'business_hours'")
             row = cur.fetchone()
             if row:
-                import json
                 return json.loads(row['value'])
             else:
                 # Retornar padrão
-                return {
-                    'monday': {'open': '09:00', 'close': '18:00', 'enabled': True},
-                    'tuesday': {'open': '09:00', 'close': '18:00', 'enabled': True},
-                    'wednesday': {'open': '09:00', 'close': '18:00', 'enabled': True},
-                    'thursday': {'open': '09:00', 'close': '18:00', 'enabled': True},
-                    'friday': {'open': '09:00', 'close': '18:00', 'enabled': True},
-                    'saturday': {'open': '09:00', 'close': '18:00', 'enabled': True},
-                    'sunday': {'open': '09:00', 'close': '18:00', 'enabled': False}
-                }
+                return _default_business_hours()
     except Exception as e:
         print(f"⚠️  Erro ao ler horários do banco: {e}")
         config = _load_config_file()
-        return config.get('business_hours', {
-            'monday': {'open': '09:00', 'close': '18:00', 'enabled': True},
-            'tuesday': {'open': '09:00', 'close': '18:00', 'enabled': True},
-            'wednesday': {'open': '09:00', 'close': '18:00', 'enabled': True},
-            'thursday': {'open': '09:00', 'close': '18:00', 'enabled': True},
-            'friday': {'open': '09:00', 'close': '18:00', 'enabled': True},
-            'saturday': {'open': '09:00', 'close': '18:00', 'enabled': True},
-            'sunday': {'open': '09:00', 'close': '18:00', 'enabled': False}
-        })
+        return config.get('business_hours', _default_business_hours())
 
 def save_business_hours(business_hours):
     """Salva os horários de funcionamento"""
@@ -865,6 +839,7 @@ def save_business_hours(business_hours):
         config = _load_config_file()
         config['business_hours'] = business_hours
         _save_config_file(config)
+        invalidate_business_schedule()
         return
     
     try:
@@ -873,9 +848,9 @@ def save_business_hours(business_hours):
                 config = _load_config_file()
                 config['business_hours'] = business_hours
                 _save_config_file(config)
+                invalidate_business_schedule()
                 return
             cur = _get_cursor(conn)
-            import json
             hours_json = json.dumps(business_hours)
             cur.execute("""
                 INSERT INTO admin_settings (key, value, updated_at)
@@ -883,73 +858,368 @@ def save_business_hours(business_hours):
                 ON CONFLICT (key) 
                 DO UPDATE SET value = %s, updated_at = CURRENT_TIMESTAMP
             """, (hours_json, hours_json))
-            conn.commit()
+        _after_commit(invalidate_business_schedule)
     except Exception as e:
         print(f"⚠️  Erro ao salvar horários no banco: {e}")
         config = _load_config_file()
         config['business_hours'] = business_hours
         _save_config_file(config)
+        invalidate_business_schedule()
+
+# Fuso horário da loja. zoneinfo já trata mudanças de offset (horário de verão);
+# o offset fixo UTC-3 só é usado se a base de fusos não estiver disponível.
+try:
+    from zoneinfo import ZoneInfo
+    BUSINESS_TIMEZONE = ZoneInfo(os.environ.get('BUSINESS_TIMEZONE', 'America/Sao_Paulo'))
+except Exception:
+    BUSINESS_TIMEZONE = _timezone(_timedelta(hours=-3))
+
+# Intervalo máximo (segundos) entre verificações de alteração dos horários
+# feitas por outro worker. Salvamentos neste worker recarregam na hora.
+BUSINESS_HOURS_CACHE_TTL = float(os.environ.get('BUSINESS_HOURS_CACHE_TTL', '60'))
+
+_WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+_MINUTES_PER_DAY = 24 * 60
+_MINUTES_PER_WEEK = 7 * _MINUTES_PER_DAY
+
+def _parse_hhmm(value):
+    """Converte 'HH:MM' em minutos desde 00:00 (None se inválido)"""
+    if not isinstance(value, str) or len(value) != 5 or value[2] != ':':
+        return None
+    try:
+        hours, minutes = int(value[:2]), int(value[3:])
+    except ValueError:
+        return None
+    total = hours * 60 + minutes
+    if minutes > 59 or total > _MINUTES_PER_DAY:
+        return None
+    return total
+
+class BusinessSchedule:
+    """Horário semanal pré-compilado.
+
+    Os horários viram uma lista ordenada de transições em minutos desde
+    segunda-feira 00:00 (abre, fecha, abre, fecha...). Responder "está aberto?"
+    e "quando muda?" é uma busca binária em no máximo 14 pontos.
+    """
+
+    def __init__(self, business_hours, tz=None):
+        self.business_hours = business_hours or {}
+        self.tz = tz or BUSINESS_TIMEZONE
+        transitions = []
+        for day_index, day_name in enumerate(_WEEKDAYS):
+            day_config = self.business_hours.get(day_name) or {}
+            if not day_config.get('enabled', False):
+                continue
+            open_minute = _parse_hhmm(day_config.get('open', '09:00'))
+            close_minute = _parse_hhmm(day_config.get('close', '18:00'))
+            # Mesmo critério de antes: abre se open <= agora < close
+            if open_minute is None or close_minute is None or open_minute >= close_minute:
+                continue
+            start = day_index * _MINUTES_PER_DAY + open_minute
+            end = day_index * _MINUTES_PER_DAY + close_minute
+            if transitions and transitions[-1] == start:
+                # Fecha 24:00 e reabre 00:00 no dia seguinte: um único período
+                transitions[-1] = end
+            else:
+                transitions.extend((start, end))
+
+        # Período que atravessa domingo 24:00 -> segunda 00:00 (se for o único
+        # período, a loja fica sempre aberta e não há transições)
+        self._open_at_week_start = False
+        if len(transitions) >= 2 and transitions[0] == 0 and transitions[-1] == _MINUTES_PER_WEEK:
+            transitions = transitions[1:-1]
+            self._open_at_week_start = True
+        self._transitions = transitions
+
+    def now(self):
+        return _datetime.now(self.tz)
+
+    def _localize(self, now):
+        if now is None:
+            return self.now()
+        if now.tzinfo is None:
+            return now.replace(tzinfo=self.tz)
+        return now.astimezone(self.tz)
+
+    def _minute_of_week(self, now):
+        return now.weekday() * _MINUTES_PER_DAY + now.hour * 60 + now.minute
+
+    def is_open(self, now=None):
+        """Indica se a loja está aberta em `now` (padrão: agora)"""
+        if not self._transitions:
+            return self._open_at_week_start
+        now = self._localize(now)
+        passed = bisect_right(self._transitions, self._minute_of_week(now))
+        return (passed % 2 == 1) != self._open_at_week_start
+
+    def next_transition(self, now=None):
+        """Próximo instante (datetime com fuso) em que a loja abre ou fecha"""
+        if not self._transitions:
+            return None
+        now = self._localize(now)
+        minute = self._minute_of_week(now)
+        index = bisect_right(self._transitions, minute)
+        if index < len(self._transitions):
+            target = self._transitions[index]
+        else:
+            target = self._transitions[0] + _MINUTES_PER_WEEK
+        week_start = _datetime(now.year, now.month, now.day) - _timedelta(days=now.weekday())
+        return (week_start + _timedelta(minutes=target)).replace(tzinfo=self.tz)
+
+    def status(self, now=None):
+        """Retorna (aberto, próxima transição, segundos até a transição)"""
+        now = self._localize(now)
+        is_open = self.is_open(now)
+        next_change = self.next_transition(now)
+        seconds = None
+        if next_change is not None:
+            delta = next_change.astimezone(_timezone.utc) - now.astimezone(_timezone.utc)
+            seconds = max(0, int(delta.total_seconds()))
+        return is_open, next_change, seconds
+
+_business_schedule_cache = {'schedule': None, 'version': None, 'checked_at': 0.0, 'generation': 0}
+_business_schedule_lock = threading.Lock()
+
+def invalidate_business_schedule():
+    """Força a recompilação do horário na próxima consulta"""
+    with _business_schedule_lock:
+        _business_schedule_cache['schedule'] = None
+        _business_schedule_cache['version'] = None
+        _business_schedule_cache['checked_at'] = 0.0
+        _business_schedule_cache['generation'] += 1
+
+def _get_business_hours_version():
+    if not USE_DATABASE:
+        return None
+    with get_db_connection() as conn:
+        if not conn:
+            return None
+        cur = _get_cursor(conn, dict_cursor=True)
+        cur.execute("SELECT updated_at FROM admin_settings WHERE key = 'business_hours'")
+        row = cur.fetchone()
+        return row['updated_at'] if row else None
+
+def _peek_business_schedule():
+    """Retorna (horário em cache, geração, dispensa verificar a versão)"""
+    with _business_schedule_lock:
+        schedule = _business_schedule_cache['schedule']
+        fresh = schedule is not None and (not USE_DATABASE or time.monotonic() - _business_schedule_cache['checked_at'] < BUSINESS_HOURS_CACHE_TTL)
+        return schedule, _business_schedule_cache['generation'], fresh
+
+def _confirm_business_schedule(version):
+    """Renova o TTL se os horários não mudaram; retorna o horário ou None"""
+    with _business_schedule_lock:
+        schedule = _business_schedule_cache['schedule']
+        if schedule is not None and version == _business_schedule_cache['version']:
+            _business_schedule_cache['checked_at'] = time.monotonic()
+            return schedule
+    return None
+
+def _store_business_schedule(schedule, version, generation):
+    with _business_schedule_lock:
+        if _business_schedule_cache['generation'] != generation:
+            return
+        _business_schedule_cache['schedule'] = schedule
+        _business_schedule_cache['version'] = version
+        _business_schedule_cache['checked_at'] = time.monotonic()
+
+def get_business_schedule():
+    """Obtém o horário semanal compilado (carregado uma vez por worker)"""
+    schedule, generation, fresh = _peek_business_schedule()
+    if fresh:
+        return schedule
+
+    try:
+        version = _get_business_hours_version()
+    except Exception as e:
+        print(f"⚠️  Erro ao verificar versão dos horários: {e}")
+        version = _business_schedule_cache['version']
+
+    confirmed = _confirm_business_schedule(version)
+    if confirmed is not None:
+        return confirmed
+
+    schedule = BusinessSchedule(get_business_hours())
+    _store_business_schedule(schedule, version, generation)
+    return schedule
+
+def get_business_status():
+    """Retorna o status atual: aberto, próxima mudança e segundos até ela"""
+    schedule = get_business_schedule()
+    is_open, next_change, seconds = schedule.status()
+    return {
+        'is_open': is_open,
+        'next_change': next_change,
+        'seconds_to_change': seconds,
+        'schedule': schedule,
+    }
 
 def is_business_open():
     """Verifica se o estabelecimento está aberto no momento atual"""
-    from datetime import datetime, timedelta
-    
     try:
-        business_hours = get_business_hours()
-        
-        # Usar timezone do Brasil (UTC-3)
-        # Converter UTC para horário de Brasília (UTC-3)
-        now_utc = datetime.utcnow()
-        now = now_utc - timedelta(hours=3)
-        
-        # Obter dia da semana atual (0 = segunda, 6 = domingo)
-        current_day = now.weekday()
-        
-        # Mapear número do dia para nome
-        days_map = {
-            0: 'monday',
-            1: 'tuesday',
-            2: 'wednesday',
-            3: 'thursday',
-            4: 'friday',
-            5: 'saturday',
-            6: 'sunday'
-        }
-        
-        day_name = days_map[current_day]
-        day_config = business_hours.get(day_name, {})
-        
-        # Debug: imprimir informações
-        print(f"🔍 Verificando status: Dia={day_name}, Config={day_config}")
-        
-        # Se o dia está desabilitado, está fechado
-        if not day_config.get('enabled', False):
-            print(f"❌ Dia {day_name} está desabilitado")
-            return False
-        
-        # Obter horário atual no timezone do Brasil
-        current_time = now.strftime('%H:%M')
-        
-        # Obter horários de abertura e fechamento
-        open_time = day_config.get('open', '09:00')
-        close_time = day_config.get('close', '18:00')
-        
-        # Garantir formato correto (HH:MM)
-        if len(open_time) == 5 and len(close_time) == 5:
-            # Comparar horários (formato HH:MM como string funciona porque é lexicográfico)
-            is_open = open_time <= current_time < close_time
-            print(f"⏰ Horário atual (Brasil): {current_time}, Abertura: {open_time}, Fechamento: {close_time}, Status: {'ABERTO' if is_open else 'FECHADO'}")
-            return is_open
-        else:
-            print(f"⚠️  Formato de horário inválido: open={open_time}, close={close_time}")
-            return False
-            
+        return get_business_schedule().is_open()
     except Exception as e:
         print(f"❌ Erro ao verificar status: {e}")
         import traceback
         traceback.print_exc()
         return False
 
+# ========== PAGINAÇÃO DAS LISTAS (KEYSET) ==========
+
+# As telas de listagem buscam uma página por vez. O cursor guarda a chave da
+# última linha exibida ((created_at, id) ou os_number) e a próxima página
+# continua a partir dela pelo índice, sem OFFSET: o custo de cada página não
+# cresce com o histórico. Para o cliente o cursor é uma string opaca.
+LIST_PAGE_SIZE = _env_int('LIST_PAGE_SIZE', 50)
+LIST_PAGE_SIZE_MAX = 200
+# Tabelas com estimativa (pg_class.reltuples) abaixo disso são contadas com
+# count(*); acima, o total exibido é a estimativa do planner.
+LIST_EXACT_COUNT_MAX = _env_int('LIST_EXACT_COUNT_MAX', 10000)
+
+def _encode_cursor(values):
+    values = [v.isoformat() if isinstance(v, _datetime) else v for v in values]
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def _decode_cursor(cursor, kind):
+    """Valores do cursor conforme o tipo da chave, ou None se ausente/inválido"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+        if kind == 'created_at':
+            # created_at pode ser NULL em linhas antigas (coluna sem NOT NULL)
+            created_at, item_id = values
+            return [_datetime.fromisoformat(created_at) if created_at is not None else None, str(item_id)]
+        if kind == 'os_number':
+            (os_number,) = values
+            return [int(os_number)]
+        if kind == 'offset':
+            (offset,) = values
+            return [max(int(offset), 0)]
+    except (ValueError, TypeError, UnicodeError):
+        pass
+    return None
+
+def _page_size(per_page):
+    try:
+        per_page = int(per_page or LIST_PAGE_SIZE)
+    except (TypeError, ValueError):
+        per_page = LIST_PAGE_SIZE
+    return min(max(per_page, 1), LIST_PAGE_SIZE_MAX)
+
+def _count_rows(cur, table):
+    """(total, exato?) sem varrer tabelas grandes"""
+    cur.execute("SELECT reltuples::bigint AS estimate FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+    row = cur.fetchone()
+    estimate = (row['estimate'] if isinstance(row, dict) else row[0]) if row else -1
+    if estimate is not None and estimate > LIST_EXACT_COUNT_MAX:
+        return int(estimate), False
+    cur.execute(f"SELECT count(*) AS total FROM {table}")
+    row = cur.fetchone()
+    return int(row['total'] if isinstance(row, dict) else row[0]), True
+
+def _empty_page(per_page):
+    return {'items': [], 'next_cursor': None, 'total_count': 0, 'total_is_estimate': False, 'per_page': per_page}
+
+def _paginate_in_memory(items, cursor, per_page):
+    """Mesma interface da paginação do banco para as listas do config.json"""
+    start = (_decode_cursor(cursor, 'offset') or [0])[0]
+    page = items[start:start + per_page]
+    has_more = start + per_page < len(items)
+    return {
+        'items': page,
+        'next_cursor': _encode_cursor([start + per_page]) if has_more else None,
+        'total_count': len(items),
+        'total_is_estimate': False,
+        'per_page': per_page,
+    }
+
+def _keyset_page(table, select_sql, cursor, per_page, key='created_at', prefix='', row_mapper=None):
+    """Uma página de `select_sql` (SELECT ... FROM ... sem WHERE/ORDER) pela chave `key`.
+
+    key='created_at' ordena por (created_at, id) DESC; key='os_number' por
+    os_number DESC. `prefix` é o alias da tabela nas colunas da chave.
+    Linhas com created_at NULL vêm primeiro (DESC põe NULLs no início, a
+    mesma ordem do índice lido de trás para frente), ordenadas por id.
+    Retorna items, next_cursor (None na última página), total_count,
+    total_is_estimate e per_page.
+    """
+    values = _decode_cursor(cursor, key)
+    if key == 'os_number':
+        order_by = f"{prefix}os_number DESC"
+        where = f"WHERE {prefix}os_number < %s" if values else ""
+    else:
+        order_by = f"{prefix}created_at DESC, {prefix}id DESC"
+        if values and values[0] is None:
+            # Ainda no bloco de created_at NULL: o resto dele e depois todas as datas
+            where = f"WHERE ({prefix}created_at IS NULL AND {prefix}id < %s) OR {prefix}created_at IS NOT NULL"
+            values = values[1:]
+        else:
+            where = f"WHERE ({prefix}created_at, {prefix}id) < (%s, %s)" if values else ""
+
+    with get_db_connection() as conn:
+        if not conn:
+            return None
+        cur = _get_cursor(conn, dict_cursor=True)
+        # Uma linha a mais indica se existe próxima página
+        cur.execute(f"{select_sql} {where} ORDER BY {order_by} LIMIT %s", (values or []) + [per_page + 1])
+        rows = cur.fetchall()
+        total_count, exact = _count_rows(cur, table)
+
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    next_cursor = None
+    if has_more:
+        last = rows[-1]
+        next_cursor = _encode_cursor([last['os_number']] if key == 'os_number' else [last['created_at'], last['id']])
+    return {
+        'items': [row_mapper(row) if row_mapper else row for row in rows],
+        'next_cursor': next_cursor,
+        'total_count': total_count,
+        'total_is_estimate': not exact,
+        'per_page': per_page,
+    }
+
+def _row_data(row):
+    return row['data']
+
+# ========== EXPORTAÇÃO EM STREAMING ==========
+
+# As exportações (CSV/XLSX) leem por um cursor nomeado: o PostgreSQL mantém o
+# resultado e o worker busca EXPORT_FETCH_SIZE linhas por vez, então a memória
+# não depende do tamanho do período exportado.
+EXPORT_FETCH_SIZE = _env_int('EXPORT_FETCH_SIZE', 2000)
+
+def _stream_rows(sql, params=()):
+    """Gera as linhas (dicts) de `sql` por um cursor no servidor.
+
+    Usa uma conexão própria do pool, e não a da requisição: o corpo da
+    resposta é gerado depois que a requisição terminou. A conexão volta ao
+    pool quando o gerador termina ou é fechado (cliente desconectou).
+    """
+    ensure_db_ready()
+    if pool is None:
+        raise RuntimeError("Pool de conexões indisponível")
+    conn = _checkout_connection()
+    try:
+        with conn.cursor(name='export_rows', row_factory=dict_row) as cur:
+            cur.itersize = EXPORT_FETCH_SIZE
+            cur.execute(sql, params)
+            for row in cur:
+                yield row
+    except Exception as e:
+        _handle_connection_error(conn, e)
+        raise
+    finally:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        _release_connection(conn)
+
 # ========== FUNÇÕES DE REPAIRS ==========
 
 def get_all_repairs():
@@ -972,6 +1242,19 @@ def get_all_repairs():
         config = _load_config_file()
         return config.get('repairs', [])
 
+def get_repairs_page(cursor=None, per_page=None):
+    """Uma página de reparos, mais recentes primeiro (ver _keyset_page)"""
+    per_page = _page_size(per_page)
+    if USE_DATABASE:
+        try:
+            page = _keyset_page('repairs', "SELECT id, created_at, data FROM repairs", cursor, per_page, row_mapper=_row_data)
+            if page is not None:
+                return page
+        except Exception as e:
+            print(f"⚠️  Erro ao paginar reparos no banco, usando config.json: {e}")
+    config = _load_config_file()
+    return _paginate_in_memory(config.get('repairs', []), cursor, per_page)
+
 def get_repair(repair_id):
     """Obtém um reparo específico"""
     if not USE_DATABASE:
@@ -1044,6 +1327,10 @@ def save_repair(repair_id, repair_data):
                 _save_config_file(config)
                 return
             cur = _get_cursor(conn)
+            if TECHNICIAN_STATS_TABLE:
+                cur.execute("SELECT data FROM repairs WHERE id = %s FOR UPDATE", (repair_id,))
+                row = cur.fetchone()
+                _apply_repair_stats_delta(cur, row[0] if row else None, repair_data)
             data_json = json.dumps(repair_data)
             cur.execute("""
                 INSERT INTO repairs (id, data, updated_at)
@@ -1087,7 +1374,12 @@ def delete_repair(repair_id):
                 _save_config_file(config)
                 return
             cur = _get_cursor(conn)
-            cur.execute("DELETE FROM repairs WHERE id = %s", (repair_id,))
+            if TECHNICIAN_STATS_TABLE:
+                cur.execute("DELETE FROM repairs WHERE id = %s RETURNING data", (repair_id,))
+                row = cur.fetchone()
+                _apply_repair_stats_delta(cur, row[0] if row else None, None)
+            else:
+                cur.execute("DELETE FROM repairs WHERE id = %s", (repair_id,))
     except Exception as e:
         print(f"⚠️  Erro ao deletar do banco, usando config.json: {e}")
         config = _load_config_file()
@@ -1097,6 +1389,238 @@ def delete_repair(repair_id):
 
 # ========== FUNÇÕES DE TRANSAÇÕES (FLUXO DE CAIXA) ==========
 
+# Tamanho padrão da página na tela do financeiro
+TRANSACTIONS_PAGE_SIZE = _env_int('TRANSACTIONS_PAGE_SIZE', 50)
+
+# Texto pesquisado pela busca do financeiro (descrição, categoria e forma de pagamento).
+# Deve ser idêntico à expressão do índice trigram (migração 0002) para que ele seja usado.
+_TRANSACTION_SEARCH_EXPR = (
+    "lower(coalesce(description, '') || ' ' || coalesce(category, '') || ' ' || coalesce(payment_method, ''))"
+)
+
+def parse_money(value):
+    """Converte um valor em reais (número ou texto como 'R$ 1.234,56') em float; 0.0 se inválido"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    value = str(value or '').strip()
+    if not value:
+        return 0.0
+    cleaned = value.replace('R$', '').replace(' ', '')
+    if ',' in cleaned and '.' in cleaned:
+        cleaned = cleaned.replace('.', '').replace(',', '.')
+    elif ',' in cleaned:
+        cleaned = cleaned.replace(',', '.')
+    try:
+        return float(cleaned)
+    except ValueError:
+        return 0.0
+
+def _parse_date(value):
+    try:
+        return _datetime.strptime(str(value or '').strip()[:10], '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+def _normalize_transaction(data):
+    """Cópia da transação com os campos de texto limpos e o valor em float"""
+    tx = dict(data)
+    for field in ('type', 'category', 'description', 'payment_method', 'date'):
+        tx[field] = (tx.get(field) or '').strip()
+    tx['amount'] = parse_money(tx.get('amount', 0))
+    return tx
+
+def _transaction_columns(data):
+    """Valores das colunas tipadas de transactions a partir do JSON"""
+    tx = _normalize_transaction(data)
+    return (
+        tx['type'][:10],
+        tx['category'][:100],
+        tx['description'],
+        tx['payment_method'][:50],
+        round(tx['amount'], 2),
+        _parse_date(tx['date']),
+    )
+
+def _backfill_transaction_columns(cur):
+    """Preenche as colunas tipadas das transações gravadas antes delas existirem"""
+    cur.execute("SELECT id, data FROM transactions WHERE amount IS NULL")
+    rows = cur.fetchall()
+    if not rows:
+        return
+    cur.executemany("""
+        UPDATE transactions
+        SET type = %s, category = %s, description = %s, payment_method = %s, amount = %s, date = %s
+        WHERE id = %s
+    """, [_transaction_columns(data) + (tx_id,) for tx_id, data in rows])
+    print(f"✅ {len(rows)} transações com colunas preenchidas")
+
+def _filter_transactions_in_memory(transactions, q='', tx_type='', category='', start_date='', end_date=''):
+    """Filtros do financeiro sobre a lista do config.json (modo sem banco)"""
+    ql = q.lower()
+    filtered = []
+    for t in transactions:
+        if not isinstance(t, dict) or not t.get('id'):
+            continue
+        tx = _normalize_transaction(t)
+        if tx_type and tx['type'] != tx_type:
+            continue
+        if category and tx['category'] != category:
+            continue
+        d = tx['date']
+        if start_date and d and d < start_date:
+            continue
+        if end_date and d and d > end_date:
+            continue
+        if ql and ql not in tx['description'].lower() and ql not in tx['category'].lower() and ql not in tx['payment_method'].lower():
+            continue
+        filtered.append(tx)
+    return filtered
+
+def _search_transactions_in_config(q, tx_type, category, start_date, end_date, page, per_page):
+    config = _load_config_file()
+    filtered = _filter_transactions_in_memory(config.get('transactions', []), q, tx_type, category, start_date, end_date)
+    filtered.sort(key=lambda t: (t['date'], t.get('created_at') or ''), reverse=True)
+    offset = (page - 1) * per_page
+    return {
+        'items': filtered[offset:offset + per_page],
+        'total_count': len(filtered),
+        'total_income': sum(t['amount'] for t in filtered if t['type'] == 'entrada'),
+        'total_expense': sum(t['amount'] for t in filtered if t['type'] == 'saida'),
+        'page': page,
+        'per_page': per_page,
+    }
+
+def _transaction_where(q, tx_type, category, start_date, end_date):
+    """WHERE (e parâmetros) dos filtros do financeiro sobre as colunas tipadas"""
+    conditions = []
+    params = []
+    if tx_type:
+        conditions.append("type = %s")
+        params.append(tx_type)
+    if category:
+        conditions.append("category = %s")
+        params.append(category)
+    start = _parse_date(start_date) if start_date else None
+    if start:
+        conditions.append("(date IS NULL OR date >= %s)")
+        params.append(start)
+    end = _parse_date(end_date) if end_date else None
+    if end:
+        conditions.append("(date IS NULL OR date <= %s)")
+        params.append(end)
+    if q:
+        escaped = q.lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        conditions.append(f"{_TRANSACTION_SEARCH_EXPR} LIKE %s")
+        params.append(f"%{escaped}%")
+    where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+    return where, params
+
+def search_transactions(q='', tx_type='', category='', start_date='', end_date='', page=1, per_page=None):
+    """Página de transações filtradas e os totais do filtro inteiro.
+
+    Filtros, ordenação, paginação e somas rodam no banco, em uma única query,
+    sobre as colunas tipadas. Retorna um dict com items, total_count,
+    total_income, total_expense, page e per_page.
+    """
+    per_page = per_page or TRANSACTIONS_PAGE_SIZE
+    page = max(int(page or 1), 1)
+    if not USE_DATABASE:
+        return _search_transactions_in_config(q, tx_type, category, start_date, end_date, page, per_page)
+
+    where, params = _transaction_where(q, tx_type, category, start_date, end_date)
+    try:
+        with get_db_connection() as conn:
+            if not conn:
+                return _search_transactions_in_config(q, tx_type, category, start_date, end_date, page, per_page)
+            cur = _get_cursor(conn, dict_cursor=True)
+            cur.execute(f"""
+                WITH filtered AS (
+                    SELECT data, type, category, description, payment_method, amount, date, created_at
+                    FROM transactions
+                    {where}
+                ),
+                totals AS (
+                    SELECT count(*) AS total_count,
+                           coalesce(sum(amount) FILTER (WHERE type = 'entrada'), 0) AS total_income,
+                           coalesce(sum(amount) FILTER (WHERE type = 'saida'), 0) AS total_expense
+                    FROM filtered
+                ),
+                page AS (
+                    SELECT * FROM filtered
+                    ORDER BY date DESC NULLS LAST, created_at DESC
+                    LIMIT %s OFFSET %s
+                )
+                SELECT totals.*, page.*
+                FROM totals LEFT JOIN page ON TRUE
+                ORDER BY page.date DESC NULLS LAST, page.created_at DESC
+            """, params + [per_page, (page - 1) * per_page])
+            rows = cur.fetchall()
+    except Exception as e:
+        print(f"⚠️  Erro ao filtrar transações no banco, usando config.json: {e}")
+        return _search_transactions_in_config(q, tx_type, category, start_date, end_date, page, per_page)
+
+    items = []
+    for row in rows:
+        if row['data'] is None:
+            continue
+        tx = dict(row['data'])
+        tx['type'] = row['type'] or ''
+        tx['category'] = row['category'] or ''
+        tx['description'] = row['description'] or ''
+        tx['payment_method'] = row['payment_method'] or ''
+        tx['amount'] = float(row['amount'] or 0)
+        tx['date'] = row['date'].isoformat() if row['date'] else ''
+        items.append(tx)
+    totals = rows[0] if rows else {}
+    return {
+        'items': items,
+        'total_count': totals.get('total_count', 0),
+        'total_income': float(totals.get('total_income') or 0),
+        'total_expense': float(totals.get('total_expense') or 0),
+        'page': page,
+        'per_page': per_page,
+    }
+
+def get_transaction_categories():
+    """Lista ordenada das categorias já usadas nas transações"""
+    if not USE_DATABASE:
+        config = _load_config_file()
+        transactions = _filter_transactions_in_memory(config.get('transactions', []))
+        return sorted({t['category'] for t in transactions if t['category']})
+    try:
+        with get_db_connection() as conn:
+            if not conn:
+                return []
+            cur = _get_cursor(conn)
+            cur.execute("SELECT DISTINCT category FROM transactions WHERE category <> '' ORDER BY category")
+            return [row[0] for row in cur.fetchall()]
+    except Exception as e:
+        print(f"⚠️  Erro ao ler categorias do banco: {e}")
+        return []
+
+def iter_transactions_for_export(q='', tx_type='', category='', start_date='', end_date=''):
+    """Transações do filtro do financeiro em ordem cronológica, uma a uma.
+
+    Cada item tem id, date, type, category, description, payment_method e
+    amount (float). Sem banco, filtra a lista do config.json.
+    """
+    if not USE_DATABASE:
+        config = _load_config_file()
+        filtered = _filter_transactions_in_memory(config.get('transactions', []), q, tx_type, category, start_date, end_date)
+        filtered.sort(key=lambda t: (t['date'], t.get('created_at') or ''))
+        yield from filtered
+        return
+
+    where, params = _transaction_where(q, tx_type, category, start_date, end_date)
+    for row in _stream_rows(f"""
+        SELECT id, date, type, category, description, payment_method, amount
+        FROM transactions
+        {where}
+        ORDER BY date ASC NULLS FIRST, created_at ASC
+    """, params):
+        row['amount'] = float(row['amount'] or 0)
+        yield row
+
 def get_all_transactions():
     """Obtém todas as transações"""
     if not USE_DATABASE:
@@ -1117,6 +1641,19 @@ def get_all_transactions():
         config = _load_config_file()
         return config.get('transactions', [])
 
+def get_transactions_page(cursor=None, per_page=None):
+    """Uma página de transações, mais recentes primeiro (ver _keyset_page)"""
+    per_page = _page_size(per_page)
+    if USE_DATABASE:
+        try:
+            page = _keyset_page('transactions', "SELECT id, created_at, data FROM transactions", cursor, per_page, row_mapper=_row_data)
+            if page is not None:
+                return page
+        except Exception as e:
+            print(f"⚠️  Erro ao paginar transações no banco, usando config.json: {e}")
+    config = _load_config_file()
+    return _paginate_in_memory(config.get('transactions', []), cursor, per_page)
+
 def get_transaction(transaction_id):
     """Obtém uma transação específica"""
     if not USE_DATABASE:
@@ -1186,12 +1723,15 @@ def save_transaction(transaction_id, transaction_data):
                 return
             cur = _get_cursor(conn)
             data_json = json.dumps(transaction_data)
+            columns = _transaction_columns(transaction_data)
             cur.execute("""
-                INSERT INTO transactions (id, data, updated_at)
-                VALUES (%s, %s::jsonb, CURRENT_TIMESTAMP)
+                INSERT INTO transactions (id, data, type, category, description, payment_method, amount, date, updated_at)
+                VALUES (%s, %s::jsonb, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
                 ON CONFLICT (id) 
-                DO UPDATE SET data = %s::jsonb, updated_at = CURRENT_TIMESTAMP
-            """, (transaction_id, data_json, data_json))
+                DO UPDATE SET data = EXCLUDED.data, type = EXCLUDED.type, category = EXCLUDED.category,
+                    description = EXCLUDED.description, payment_method = EXCLUDED.payment_method,
+                    amount = EXCLUDED.amount, date = EXCLUDED.date, updated_at = CURRENT_TIMESTAMP
+            """, (transaction_id, data_json) + columns)
     except Exception as e:
         print(f"⚠️  Erro ao salvar no banco, usando config.json: {e}")
         config = _load_config_file()
@@ -1238,6 +1778,17 @@ def delete_transaction(transaction_id):
 
 # ========== FUNÇÕES DE CLIENTES ==========
 
+CUSTOMER_LIST_SQL = "SELECT id, doc_type, doc_number, data, created_at, updated_at FROM customers"
+
+def _customer_from_row(row):
+    data = row['data'] if row and row.get('data') else {}
+    data['id'] = row['id']
+    data['doc_type'] = row['doc_type']
+    data['doc_number'] = row['doc_number']
+    data['created_at'] = row['created_at']
+    data['updated_at'] = row['updated_at']
+    return data
+
 def get_all_customers():
     """Obtém todos os clientes"""
     if not USE_DATABASE:
@@ -1249,23 +1800,50 @@ def get_all_customers():
                 config = _load_config_file()
                 return config.get('customers', [])
             cur = _get_cursor(conn, dict_cursor=True)
-            cur.execute("SELECT id, doc_type, doc_number, data, created_at, updated_at FROM customers ORDER BY created_at DESC")
-            rows = cur.fetchall()
-            customers = []
-            for row in rows:
-                data = row['data'] if row and row.get('data') else {}
-                data['id'] = row['id']
-                data['doc_type'] = row['doc_type']
-                data['doc_number'] = row['doc_number']
-                data['created_at'] = row['created_at']
-                data['updated_at'] = row['updated_at']
-                customers.append(data)
-            return customers
+            cur.execute(f"{CUSTOMER_LIST_SQL} ORDER BY created_at DESC")
+            return [_customer_from_row(row) for row in cur.fetchall()]
     except Exception as e:
         print(f"⚠️  Erro ao obter clientes: {e}")
         config = _load_config_file()
         return config.get('customers', [])
 
+def get_customers_page(cursor=None, per_page=None):
+    """Uma página de clientes, mais recentes primeiro (ver _keyset_page)"""
+    per_page = _page_size(per_page)
+    if USE_DATABASE:
+        try:
+            page = _keyset_page('customers', CUSTOMER_LIST_SQL, cursor, per_page, row_mapper=_customer_from_row)
+            if page is not None:
+                return page
+        except Exception as e:
+            print(f"⚠️  Erro ao paginar clientes: {e}")
+    config = _load_config_file()
+    return _paginate_in_memory(config.get('customers', []), cursor, per_page)
+
+def iter_customers_for_export():
+    """Clientes (id, nome, documento, contato, cadastro) em ordem de cadastro, um a um"""
+    if not USE_DATABASE:
+        config = _load_config_file()
+        for c in config.get('customers', []):
+            if isinstance(c, dict):
+                yield {
+                    'id': c.get('id'),
+                    'full_name': c.get('full_name'),
+                    'doc_type': c.get('doc_type'),
+                    'doc_number': c.get('doc_number'),
+                    'phone': c.get('phone'),
+                    'email': c.get('email'),
+                    'created_at': c.get('created_at'),
+                }
+        return
+
+    yield from _stream_rows("""
+        SELECT id, data->>'full_name' AS full_name, doc_type, doc_number,
+               data->>'phone' AS phone, data->>'email' AS email, created_at
+        FROM customers
+        ORDER BY created_at ASC, id ASC
+    """)
+
 def get_customer(customer_id):
     """Obtém um cliente específico"""
     if not USE_DATABASE:
@@ -1538,6 +2116,30 @@ def delete_equipment(equipment_id):
         print(f"⚠️  Erro ao deletar equipamento: {e}")
         raise
 
+SERVICE_ORDER_LIST_SQL = """
+    SELECT
+        so.id,
+        so.os_number,
+        so.customer_id,
+        so.technician_id,
+        so.equipment_id,
+        so.status,
+        so.labor_value,
+        so.parts_value,
+        so.total_value,
+        so.opened_at,
+        so.concluded_at,
+        so.delivered_at,
+        so.created_at,
+        so.updated_at,
+        c.data->>'full_name' AS customer_name,
+        c.doc_number AS customer_doc,
+        t.name AS technician_name
+    FROM service_orders so
+    LEFT JOIN customers c ON c.id = so.customer_id
+    LEFT JOIN technicians t ON t.id = so.technician_id
+"""
+
 def get_all_service_orders():
     if not USE_DATABASE:
         config = _load_config_file()
@@ -1548,40 +2150,119 @@ def get_all_service_orders():
                 config = _load_config_file()
                 return config.get('service_orders', [])
             cur = _get_cursor(conn, dict_cursor=True)
-            cur.execute("""
-                SELECT 
-                    so.id,
-                    so.os_number,
-                    so.customer_id,
-                    so.technician_id,
-                    so.equipment_id,
-                    so.status,
-                    so.labor_value,
-                    so.parts_value,
-                    so.total_value,
-                    so.opened_at,
-                    so.concluded_at,
-                    so.delivered_at,
-                    so.created_at,
-                    so.updated_at,
-                    c.data->>'full_name' AS customer_name,
-                    c.doc_number AS customer_doc,
-                    t.name AS technician_name
-                FROM service_orders so
-                LEFT JOIN customers c ON c.id = so.customer_id
-                LEFT JOIN technicians t ON t.id = so.technician_id
-                ORDER BY so.os_number DESC
-            """)
-            rows = cur.fetchall()
-            result = []
-            for row in rows:
-                result.append(row)
-            return result
+            cur.execute(f"{SERVICE_ORDER_LIST_SQL} ORDER BY so.os_number DESC")
+            return cur.fetchall()
     except Exception as e:
         print(f"⚠️  Erro ao obter OS: {e}")
         config = _load_config_file()
         return config.get('service_orders', [])
 
+def get_service_orders_page(cursor=None, per_page=None):
+    """Uma página da lista de OS, da mais recente para a mais antiga (cursor em os_number)"""
+    per_page = _page_size(per_page)
+    if USE_DATABASE:
+        try:
+            page = _keyset_page('service_orders', SERVICE_ORDER_LIST_SQL, cursor, per_page, key='os_number', prefix='so.')
+            if page is not None:
+                return page
+        except Exception as e:
+            print(f"⚠️  Erro ao paginar OS: {e}")
+    config = _load_config_file()
+    return _paginate_in_memory(config.get('service_orders', []), cursor, per_page)
+
+# OS completa (cliente, técnico, equipamento, peças e histórico) em uma única
+# query: JOINs para as relações 1:1 e json_agg para as listas. {where} e
+# {suffix} recebem o filtro e a ordenação/limite de cada função.
+_SERVICE_ORDER_AGGREGATE_SQL = """
+    SELECT
+        so.id, so.os_number, so.customer_id, so.technician_id, so.equipment_id, so.status,
+        so.labor_value, so.parts_value, so.total_value, so.budget_date, so.authorized,
+        so.opened_at, so.concluded_at, so.delivered_at, so.data, so.created_at, so.updated_at,
+        CASE WHEN c.id IS NULL THEN NULL ELSE
+            jsonb_build_object('id', c.id, 'doc_type', c.doc_type, 'doc_number', c.doc_number, 'data', c.data)
+        END AS customer,
+        CASE WHEN t.id IS NULL THEN NULL ELSE
+            jsonb_build_object('id', t.id, 'name', t.name, 'cpf', t.cpf, 'email', t.email, 'phone', t.phone,
+                               'address', t.address, 'specialties', t.specialties, 'is_active', t.is_active)
+        END AS technician,
+        CASE WHEN e.id IS NULL THEN NULL ELSE
+            jsonb_build_object('id', e.id, 'customer_id', e.customer_id, 'data', e.data)
+        END AS equipment,
+        COALESCE((
+            SELECT json_agg(json_build_object('part', p.part, 'quantity', p.quantity, 'value', p.value) ORDER BY p.id)
+            FROM service_order_parts p WHERE p.service_order_id = so.id
+        ), '[]'::json) AS parts,
+        COALESCE((
+            SELECT json_agg(json_build_object('message', h.message, 'created_at', h.created_at) ORDER BY h.created_at)
+            FROM service_order_history h WHERE h.service_order_id = so.id
+        ), '[]'::json) AS history
+    FROM service_orders so
+    LEFT JOIN customers c ON c.id = so.customer_id
+    LEFT JOIN technicians t ON t.id = so.technician_id
+    LEFT JOIN equipments e ON e.id = so.equipment_id
+    {where}
+    {suffix}
+"""
+
+def _service_order_from_row(row):
+    """Monta o dict da OS (mesmo formato de sempre) a partir de uma linha da query agregada"""
+    data = row['data'] if row.get('data') else {}
+    data['id'] = row['id']
+    data['os_number'] = row['os_number']
+    data['customer_id'] = row['customer_id']
+    data['technician_id'] = row['technician_id']
+    data['equipment_id'] = row['equipment_id']
+    data['status'] = row['status']
+    data['labor_value'] = float(row['labor_value'] or 0)
+    data['parts_value'] = float(row['parts_value'] or 0)
+    data['total_value'] = float(row['total_value'] or 0)
+    data['budget_date'] = row['budget_date']
+    data['authorized'] = row['authorized']
+    data['opened_at'] = row['opened_at']
+    data['concluded_at'] = row['concluded_at']
+    data['delivered_at'] = row['delivered_at']
+    data['created_at'] = row['created_at']
+    data['updated_at'] = row['updated_at']
+
+    customer = row.get('customer')
+    if customer:
+        customer_data = customer.get('data') or {}
+        customer_data['id'] = customer['id']
+        customer_data['doc_type'] = customer['doc_type']
+        customer_data['doc_number'] = customer['doc_number']
+        data['customer'] = customer_data
+
+    if row.get('technician'):
+        data['technician'] = row['technician']
+
+    equipment = row.get('equipment')
+    if equipment:
+        eq_data = equipment.get('data') or {}
+        eq_data['id'] = equipment['id']
+        eq_data['customer_id'] = equipment['customer_id']
+        data['equipment'] = eq_data
+
+    data['parts'] = row.get('parts') or []
+    history = row.get('history') or []
+    for entry in history:
+        # json_agg devolve datas como texto ISO
+        if isinstance(entry.get('created_at'), str):
+            try:
+                entry['created_at'] = _datetime.fromisoformat(entry['created_at'])
+            except ValueError:
+                pass
+    data['history'] = history
+    return data
+
+def _query_service_orders(where='', params=(), suffix=''):
+    """Executa a query agregada de OS; retorna a lista de OS completas"""
+    with get_db_connection() as conn:
+        if not conn:
+            return []
+        cur = _get_cursor(conn, dict_cursor=True)
+        cur.execute(_SERVICE_ORDER_AGGREGATE_SQL.format(where=where, suffix=suffix), tuple(params))
+        return [_service_order_from_row(row) for row in cur.fetchall()]
+
 def get_service_order(service_order_id):
     if not USE_DATABASE:
         config = _load_config_file()
@@ -1591,88 +2272,203 @@ def get_service_order(service_order_id):
                 return o
         return None
     try:
-        with get_db_connection() as conn:
-            if not conn:
-                return None
-            cur = _get_cursor(conn, dict_cursor=True)
-            cur.execute("""
-                SELECT 
-                    id,
-                    os_number,
-                    customer_id,
-                    technician_id,
-                    equipment_id,
-                    status,
-                    labor_value,
-                    parts_value,
-                    total_value,
-                    budget_date,
-                    authorized,
-                    opened_at,
-                    concluded_at,
-                    delivered_at,
-                    data,
-                    created_at,
-                    updated_at
-                FROM service_orders
-                WHERE id = %s
-            """, (service_order_id,))
-            row = cur.fetchone()
-            if not row:
-                return None
-            data = row['data'] if row.get('data') else {}
-            data['id'] = row['id']
-            data['os_number'] = row['os_number']
-            data['customer_id'] = row['customer_id']
-            data['technician_id'] = row['technician_id']
-            data['equipment_id'] = row['equipment_id']
-            data['status'] = row['status']
-            data['labor_value'] = float(row['labor_value'] or 0)
-            data['parts_value'] = float(row['parts_value'] or 0)
-            data['total_value'] = float(row['total_value'] or 0)
-            data['budget_date'] = row['budget_date']
-            data['authorized'] = row['authorized']
-            data['opened_at'] = row['opened_at']
-            data['concluded_at'] = row['concluded_at']
-            data['delivered_at'] = row['delivered_at']
-            data['created_at'] = row['created_at']
-            data['updated_at'] = row['updated_at']
+        orders = _query_service_orders("WHERE so.id = %s", (service_order_id,))
+        return orders[0] if orders else None
+    except Exception as e:
+        print(f"⚠️  Erro ao obter OS: {e}")
+        return None
+
+def get_service_orders(service_order_ids):
+    """Várias OS completas em uma query, na ordem dos ids pedidos (ids inexistentes são ignorados)"""
+    ids = [i for i in dict.fromkeys(service_order_ids or []) if i]
+    if not ids:
+        return []
+    if not USE_DATABASE:
+        config = _load_config_file()
+        by_id = {o.get('id'): o for o in config.get('service_orders', []) if isinstance(o, dict)}
+        return [by_id[i] for i in ids if i in by_id]
+    try:
+        by_id = {o['id']: o for o in _query_service_orders("WHERE so.id = ANY(%s)", (ids,))}
+        return [by_id[i] for i in ids if i in by_id]
+    except Exception as e:
+        print(f"⚠️  Erro ao obter OS: {e}")
+        return []
+
+# Limites de OS por exportação em lote. Acima deles a exportação é recusada
+# (em vez de sair cortada): o ZIP é gerado em streaming, mas o PDF único é
+# montado inteiro antes do envio, então o limite dele é bem menor.
+SERVICE_ORDER_EXPORT_MAX = _env_int('SERVICE_ORDER_EXPORT_MAX', 500)
+SERVICE_ORDER_MERGED_PDF_MAX = _env_int('SERVICE_ORDER_MERGED_PDF_MAX', 50)
+
+def _service_order_export_where(start_date, end_date, status):
+    conditions = []
+    params = []
+    if start_date:
+        conditions.append("so.opened_at >= %s")
+        params.append(start_date)
+    if end_date:
+        conditions.append("so.opened_at <= %s")
+        params.append(end_date)
+    if status:
+        conditions.append("so.status = %s")
+        params.append(status)
+    return ("WHERE " + " AND ".join(conditions)) if conditions else "", params
+
+def _service_order_in_period(o, start_date, end_date, status):
+    opened_at = str(o.get('opened_at') or '')[:10]
+    if start_date and (not opened_at or opened_at < str(start_date)):
+        return False
+    if end_date and (not opened_at or opened_at > str(end_date)):
+        return False
+    if status and o.get('status') != status:
+        return False
+    return True
 
-            cur.execute("SELECT id, customer_id, doc_type, doc_number, data FROM customers WHERE id = %s", (row['customer_id'],))
-            customer_row = cur.fetchone()
-            if customer_row:
-                customer_data = customer_row['data'] if customer_row.get('data') else {}
-                customer_data['id'] = customer_row['id']
-                customer_data['doc_type'] = customer_row['doc_type']
-                customer_data['doc_number'] = customer_row['doc_number']
-                data['customer'] = customer_data
-
-            if row['technician_id']:
-                cur.execute("SELECT id, name, cpf, email, phone, address, specialties, is_active FROM technicians WHERE id = %s", (row['technician_id'],))
-                tech_row = cur.fetchone()
-                if tech_row:
-                    data['technician'] = tech_row
-
-            if row['equipment_id']:
-                cur.execute("SELECT id, customer_id, data FROM equipments WHERE id = %s", (row['equipment_id'],))
-                eq_row = cur.fetchone()
-                if eq_row:
-                    eq_data = eq_row['data'] if eq_row.get('data') else {}
-                    eq_data['id'] = eq_row['id']
-                    eq_data['customer_id'] = eq_row['customer_id']
-                    data['equipment'] = eq_data
-
-            cur.execute("SELECT part, quantity, value FROM service_order_parts WHERE service_order_id = %s ORDER BY id ASC", (service_order_id,))
-            data['parts'] = cur.fetchall() or []
-
-            cur.execute("SELECT message, created_at FROM service_order_history WHERE service_order_id = %s ORDER BY created_at ASC", (service_order_id,))
-            data['history'] = cur.fetchall() or []
+def iter_service_orders_for_export(start_date=None, end_date=None, status=None):
+    """Linhas da planilha de OS (mesmos filtros de get_service_orders_for_export), uma a uma.
 
-            return data
+    Sem limite de quantidade: diferente dos PDFs, cada linha é pequena.
+    """
+    if not USE_DATABASE:
+        config = _load_config_file()
+        orders = [o for o in config.get('service_orders', [])
+                  if isinstance(o, dict) and _service_order_in_period(o, start_date, end_date, status)]
+        orders.sort(key=lambda o: o.get('os_number') or 0)
+        for o in orders:
+            customer = o.get('customer') or {}
+            technician = o.get('technician') or {}
+            equipment = o.get('equipment') or {}
+            yield {
+                'os_number': o.get('os_number'),
+                'status': o.get('status'),
+                'opened_at': o.get('opened_at'),
+                'concluded_at': o.get('concluded_at'),
+                'delivered_at': o.get('delivered_at'),
+                'customer_name': customer.get('full_name') or customer.get('name'),
+                'customer_doc': customer.get('doc_number'),
+                'technician_name': technician.get('name'),
+                'equipment': ' '.join(p for p in (equipment.get('type'), equipment.get('brand'), equipment.get('model')) if p),
+                'labor_value': parse_money(o.get('labor_value')),
+                'parts_value': parse_money(o.get('parts_value')),
+                'total_value': parse_money(o.get('total_value')),
+            }
+        return
+
+    where, params = _service_order_export_where(start_date, end_date, status)
+    for row in _stream_rows(f"""
+        SELECT so.os_number, so.status, so.opened_at, so.concluded_at, so.delivered_at,
+               c.data->>'full_name' AS customer_name, c.doc_number AS customer_doc,
+               t.name AS technician_name,
+               concat_ws(' ', e.data->>'type', e.data->>'brand', e.data->>'model') AS equipment,
+               so.labor_value, so.parts_value, so.total_value
+        FROM service_orders so
+        LEFT JOIN customers c ON c.id = so.customer_id
+        LEFT JOIN technicians t ON t.id = so.technician_id
+        LEFT JOIN equipments e ON e.id = so.equipment_id
+        {where}
+        ORDER BY so.os_number ASC
+    """, params):
+        for field in ('labor_value', 'parts_value', 'total_value'):
+            row[field] = float(row[field] or 0)
+        yield row
+
+def get_service_orders_for_export(start_date=None, end_date=None, status=None, limit=None):
+    """OS completas (como get_service_order) abertas no período e/ou com o status, em ordem de número.
+
+    Retorna no máximo `limit` + 1 OS, para que quem chama saiba que o filtro
+    passou do limite sem precisar de um COUNT separado.
+    """
+    limit = (limit or SERVICE_ORDER_EXPORT_MAX) + 1
+    if not USE_DATABASE:
+        config = _load_config_file()
+        orders = [o for o in config.get('service_orders', [])
+                  if isinstance(o, dict) and _service_order_in_period(o, start_date, end_date, status)]
+        orders.sort(key=lambda o: o.get('os_number') or 0)
+        return orders[:limit]
+
+    where, params = _service_order_export_where(start_date, end_date, status)
+    try:
+        return _query_service_orders(where, params + [limit], "ORDER BY so.os_number ASC LIMIT %s")
     except Exception as e:
-        print(f"⚠️  Erro ao obter OS: {e}")
+        print(f"⚠️  Erro ao obter OS para exportação: {e}")
+        return []
+
+# Cache curto da consulta pública de OS (?os= na home). Guarda também os
+# "não encontrado" para que bots tentando números em sequência não cheguem ao banco.
+OS_STATUS_CACHE_TTL = float(os.environ.get('OS_STATUS_CACHE_TTL', '30'))
+OS_STATUS_CACHE_MAX_ENTRIES = 2048
+
+_os_status_cache = {}
+_os_status_lock = threading.Lock()
+
+SERVICE_ORDER_STATUS_SQL = "SELECT os_number, status, opened_at FROM service_orders WHERE os_number = %s"
+
+def invalidate_service_order_status(os_number=None):
+    """Remove uma OS (ou todas) do cache da consulta pública"""
+    with _os_status_lock:
+        if os_number is None:
+            _os_status_cache.clear()
+        else:
+            _os_status_cache.pop(os_number, None)
+
+def _get_cached_service_order_status(os_number):
+    """Retorna (encontrado no cache, resultado)"""
+    with _os_status_lock:
+        cached = _os_status_cache.get(os_number)
+        if cached and cached[0] > time.monotonic():
+            return True, (dict(cached[1]) if cached[1] else None)
+    return False, None
+
+def _store_service_order_status(os_number, result):
+    now = time.monotonic()
+    with _os_status_lock:
+        if len(_os_status_cache) >= OS_STATUS_CACHE_MAX_ENTRIES:
+            expired = [k for k, v in _os_status_cache.items() if v[0] <= now]
+            for k in expired:
+                del _os_status_cache[k]
+            while len(_os_status_cache) >= OS_STATUS_CACHE_MAX_ENTRIES:
+                del _os_status_cache[next(iter(_os_status_cache))]
+        _os_status_cache[os_number] = (now + OS_STATUS_CACHE_TTL, result)
+
+def _find_service_order_status_in_config(os_number):
+    config = _load_config_file()
+    for o in config.get('service_orders', []):
+        if isinstance(o, dict) and o.get('os_number') == os_number:
+            return {'os_number': os_number, 'status': o.get('status'), 'opened_at': o.get('opened_at')}
+    return None
+
+def get_service_order_status_by_number(os_number):
+    """Obtém somente os campos públicos (número, status, abertura) de uma OS pelo número"""
+    try:
+        os_number = int(os_number)
+    except (TypeError, ValueError):
         return None
 
+    hit, cached = _get_cached_service_order_status(os_number)
+    if hit:
+        return cached
+
+    result = None
+    if not USE_DATABASE:
+        result = _find_service_order_status_in_config(os_number)
+    else:
+        try:
+            with get_db_connection() as conn:
+                if not conn:
+                    return None
+                cur = _get_cursor(conn, dict_cursor=True)
+                # Usa o índice único de os_number (sem JOIN, sem JSONB)
+                cur.execute(SERVICE_ORDER_STATUS_SQL, (os_number,))
+                row = cur.fetchone()
+                if row:
+                    result = {'os_number': row['os_number'], 'status': row['status'], 'opened_at': row['opened_at']}
+        except Exception as e:
+            print(f"⚠️  Erro ao consultar status da OS: {e}")
+            return None
+
+    _store_service_order_status(os_number, result)
+    return dict(result) if result else None
+
 def get_service_order_by_public_token(public_token):
     public_token = (public_token or '').strip()
     if not public_token:
@@ -1686,18 +2482,144 @@ def get_service_order_by_public_token(public_token):
                 return o
         return None
 
+    try:
+        orders = _query_service_orders("WHERE so.data->>'public_token' = %s", (public_token,), "LIMIT 1")
+        return orders[0] if orders else None
+    except Exception as e:
+        print(f"⚠️  Erro ao obter OS por token: {e}")
+        return None
+
+# Página pública da OS (link/QR com o token). O cliente recarrega a página
+# enquanto espera, então a projeção pública fica em cache por token; dentro do
+# TTL o ETag já é conhecido e um 304 sai sem consulta ao banco.
+PUBLIC_STATUS_CACHE_TTL = float(os.environ.get('PUBLIC_STATUS_CACHE_TTL', '15'))
+PUBLIC_STATUS_CACHE_MAX_ENTRIES = 2048
+
+_public_status_cache = {}
+_public_status_lock = threading.Lock()
+
+PUBLIC_STATUS_SQL = """
+    SELECT so.os_number, so.status, so.opened_at, so.concluded_at, so.delivered_at, so.updated_at,
+           e.data->>'type' AS equipment_type, e.data->>'brand' AS equipment_brand, e.data->>'model' AS equipment_model,
+           e.updated_at AS equipment_updated_at
+    FROM service_orders so
+    LEFT JOIN equipments e ON e.id = so.equipment_id
+    WHERE so.data->>'public_token' = %s
+    LIMIT 1
+"""
+
+def invalidate_public_status(public_token=None):
+    """Remove um token (ou todos) do cache da página pública"""
+    with _public_status_lock:
+        if public_token is None:
+            _public_status_cache.clear()
+        else:
+            _public_status_cache.pop(public_token, None)
+
+def _public_status_from_order(order):
+    equipment = order.get('equipment') or {}
+    return {
+        'os_number': order.get('os_number'),
+        'status': order.get('status'),
+        'opened_at': order.get('opened_at'),
+        'concluded_at': order.get('concluded_at'),
+        'delivered_at': order.get('delivered_at'),
+        'updated_at': order.get('updated_at'),
+        'equipment_type': equipment.get('type'),
+        'equipment_brand': equipment.get('brand'),
+        'equipment_model': equipment.get('model'),
+        'equipment_updated_at': equipment.get('updated_at'),
+    }
+
+def get_public_service_order_status(public_token):
+    """Projeção pública (sem dados do cliente) da OS do token, ou None.
+
+    Campos: os_number, status, opened_at, concluded_at, delivered_at,
+    updated_at e tipo/marca/modelo/updated_at do equipamento (editar o
+    equipamento não altera o updated_at da OS).
+    """
+    public_token = (public_token or '').strip()
+    if not public_token:
+        return None
+
+    now = time.monotonic()
+    with _public_status_lock:
+        cached = _public_status_cache.get(public_token)
+        if cached and cached[0] > now:
+            return dict(cached[1]) if cached[1] else None
+
+    result = None
+    if not USE_DATABASE:
+        for o in _load_config_file().get('service_orders', []):
+            if isinstance(o, dict) and (o.get('public_token') or '') == public_token:
+                result = _public_status_from_order(o)
+                break
+    else:
+        try:
+            with get_db_connection() as conn:
+                if not conn:
+                    return None
+                cur = _get_cursor(conn, dict_cursor=True)
+                cur.execute(PUBLIC_STATUS_SQL, (public_token,))
+                row = cur.fetchone()
+                if row:
+                    result = dict(row)
+        except Exception as e:
+            print(f"⚠️  Erro ao consultar OS por token: {e}")
+            return None
+
+    with _public_status_lock:
+        if len(_public_status_cache) >= PUBLIC_STATUS_CACHE_MAX_ENTRIES:
+            expired = [k for k, v in _public_status_cache.items() if v[0] <= now]
+            for k in expired:
+                del _public_status_cache[k]
+            while len(_public_status_cache) >= PUBLIC_STATUS_CACHE_MAX_ENTRIES:
+                del _public_status_cache[next(iter(_public_status_cache))]
+        _public_status_cache[public_token] = (now + PUBLIC_STATUS_CACHE_TTL, result)
+    return dict(result) if result else None
+
+# ========== LIMITE DE CONSULTAS PÚBLICAS ==========
+
+# Janela fixa por chave (ex.: IP) na tabela rate_limits, para que todos os
+# workers do gunicorn contem juntos. Sem banco, quem chama usa o contador em
+# memória do próprio processo.
+RATE_LIMIT_PURGE_INTERVAL = 600
+_rate_limit_purged_at = 0.0
+_rate_limit_purge_lock = threading.Lock()
+
+def hit_rate_limit(key, limit, window):
+    """Registra uma tentativa de `key`; True se passou de `limit` na janela de
+    `window` segundos, False se não, None se o banco não estiver disponível"""
+    global _rate_limit_purged_at
+    if not USE_DATABASE:
+        return None
+    window_start = int(time.time()) // window * window
     try:
         with get_db_connection() as conn:
             if not conn:
                 return None
-            cur = _get_cursor(conn, dict_cursor=True)
-            cur.execute("SELECT id FROM service_orders WHERE data->>'public_token' = %s LIMIT 1", (public_token,))
-            row = cur.fetchone()
-            if not row:
-                return None
-            return get_service_order(row['id'])
+            cur = _get_cursor(conn)
+            cur.execute("""
+                INSERT INTO rate_limits (key, window_start, hits)
+                VALUES (%s, %s, 1)
+                ON CONFLICT (key) DO UPDATE SET
+                    hits = CASE WHEN rate_limits.window_start = EXCLUDED.window_start
+                                THEN rate_limits.hits + 1 ELSE 1 END,
+                    window_start = EXCLUDED.window_start
+                RETURNING hits
+            """, (key, window_start))
+            hits = cur.fetchone()[0]
+            now = time.monotonic()
+            with _rate_limit_purge_lock:
+                purge = now - _rate_limit_purged_at >= RATE_LIMIT_PURGE_INTERVAL
+                if purge:
+                    _rate_limit_purged_at = now
+            if purge:
+                # Chaves sem tentativas na janela atual não servem mais
+                cur.execute("DELETE FROM rate_limits WHERE window_start < %s", (window_start - window,))
+        return hits > limit
     except Exception as e:
-        print(f"⚠️  Erro ao obter OS por token: {e}")
+        print(f"⚠️  Erro no limite de consultas: {e}")
         return None
 
 def save_service_order(service_order_id, payload, parts, history_message=None, create_new=False):
@@ -1734,6 +2656,8 @@ def save_service_order(service_order_id, payload, parts, history_message=None, c
             orders.append(payload)
         config['service_orders'] = orders
         _save_config_file(config)
+        invalidate_service_order_status(payload.get('os_number'))
+        invalidate_public_status(payload.get('public_token'))
         return payload.get('os_number')
 
     try:
@@ -1768,6 +2692,8 @@ def save_service_order(service_order_id, payload, parts, history_message=None, c
                     orders.append(payload)
                 config['service_orders'] = orders
                 _save_config_file(config)
+                invalidate_service_order_status(payload.get('os_number'))
+                invalidate_public_status(payload.get('public_token'))
                 return payload.get('os_number')
 
             cur = _get_cursor(conn)
@@ -1835,7 +2761,10 @@ def save_service_order(service_order_id, payload, parts, history_message=None, c
                     (service_order_id, history_message),
                 )
 
-            return os_number
+        public_token = payload.get('public_token')
+        _after_commit(lambda: invalidate_service_order_status(os_number))
+        _after_commit(lambda: invalidate_public_status(public_token))
+        return os_number
     except Exception as e:
         print(f"⚠️  Erro ao salvar OS: {e}")
         raise
@@ -1846,6 +2775,8 @@ def delete_service_order(service_order_id):
         orders = config.get('service_orders', [])
         config['service_orders'] = [o for o in orders if o.get('id') != service_order_id]
         _save_config_file(config)
+        invalidate_service_order_status()
+        invalidate_public_status()
         return
     try:
         with get_db_connection() as conn:
@@ -1859,6 +2790,8 @@ def delete_service_order(service_order_id):
             cur.execute("DELETE FROM service_order_parts WHERE service_order_id = %s", (service_order_id,))
             cur.execute("DELETE FROM service_order_history WHERE service_order_id = %s", (service_order_id,))
             cur.execute("DELETE FROM service_orders WHERE id = %s", (service_order_id,))
+        _after_commit(invalidate_service_order_status)
+        _after_commit(invalidate_public_status)
     except Exception as e:
         print(f"⚠️  Erro ao deletar OS: {e}")
         raise
@@ -1895,6 +2828,8 @@ def get_admin_user_by_username(username):
         print(f"⚠️  Erro ao obter usuário admin por username: {e}")
         return None
 
+ADMIN_USER_LIST_SQL = "SELECT id, username, name, email, phone, permissions, is_active, created_at, updated_at FROM admin_users"
+
 def get_all_admin_users():
     """Obtém todos os usuários admin"""
     if not USE_DATABASE:
@@ -1903,13 +2838,24 @@ def get_all_admin_users():
         with get_db_connection() as conn:
             if not conn: return []
             cur = _get_cursor(conn, dict_cursor=True)
-            cur.execute("SELECT id, username, name, email, phone, permissions, is_active, created_at, updated_at FROM admin_users ORDER BY created_at DESC")
+            cur.execute(f"{ADMIN_USER_LIST_SQL} ORDER BY created_at DESC")
             users = cur.fetchall()
             return users
     except Exception as e:
         print(f"⚠️  Erro ao obter todos os usuários admin: {e}")
         return []
 
+def get_admin_users_page(cursor=None, per_page=None):
+    """Uma página de usuários admin, mais recentes primeiro (ver _keyset_page)"""
+    per_page = _page_size(per_page)
+    if not USE_DATABASE:
+        return _empty_page(per_page)
+    try:
+        return _keyset_page('admin_users', ADMIN_USER_LIST_SQL, cursor, per_page) or _empty_page(per_page)
+    except Exception as e:
+        print(f"⚠️  Erro ao paginar usuários admin: {e}")
+        return _empty_page(per_page)
+
 def save_admin_user(user_id, username, password_hash, name, email, phone, permissions, is_active):
     """Salva ou atualiza um usuário admin"""
     if not USE_DATABASE:
@@ -1962,6 +2908,8 @@ def get_technician(tech_id):
         print(f"⚠️  Erro ao obter técnico: {e}")
         return None
 
+TECHNICIAN_LIST_SQL = "SELECT id, name, cpf, email, phone, address, specialties, is_active, created_at, updated_at FROM technicians"
+
 def get_all_technicians():
     """Obtém todos os técnicos"""
     if not USE_DATABASE:
@@ -1970,13 +2918,24 @@ def get_all_technicians():
         with get_db_connection() as conn:
             if not conn: return []
             cur = _get_cursor(conn, dict_cursor=True)
-            cur.execute("SELECT id, name, cpf, email, phone, address, specialties, is_active, created_at, updated_at FROM technicians ORDER BY created_at DESC")
+            cur.execute(f"{TECHNICIAN_LIST_SQL} ORDER BY created_at DESC")
             techs = cur.fetchall()
             return techs
     except Exception as e:
         print(f"⚠️  Erro ao obter todos os técnicos: {e}")
         return []
 
+def get_technicians_page(cursor=None, per_page=None):
+    """Uma página de técnicos, mais recentes primeiro (ver _keyset_page)"""
+    per_page = _page_size(per_page)
+    if not USE_DATABASE:
+        return _empty_page(per_page)
+    try:
+        return _keyset_page('technicians', TECHNICIAN_LIST_SQL, cursor, per_page) or _empty_page(per_page)
+    except Exception as e:
+        print(f"⚠️  Erro ao paginar técnicos: {e}")
+        return _empty_page(per_page)
+
 def save_technician(tech_id, name, cpf, email, phone, address, specialties, is_active):
     """Salva ou atualiza um técnico"""
     if not USE_DATABASE:
@@ -2014,12 +2973,154 @@ def delete_technician(tech_id):
 
 # ========== FUNÇÕES DE QUALIDADE DE TÉCNICOS ==========
 
-def calculate_technician_quality_score(tech_id):
-    """Calcula o score de qualidade de um técnico baseado em seus reparos"""
-    repairs = get_all_repairs()
-    tech_repairs = [r for r in repairs if r.get('technician_id') == tech_id]
-    
-    if not tech_repairs:
+# Com TECHNICIAN_STATS_TABLE ligado, as contagens por técnico ficam na tabela
+# technician_repair_stats, atualizada a cada save_repair/delete_repair. Sem ela,
+# as contagens saem de uma única query agregada sobre repairs (índice parcial
+# na coluna gerada technician_id).
+#
+# Reparos gravados com a tabela desligada não entram nela. Por isso cada
+# inicialização com a tabela desligada apaga a marca TECHNICIAN_STATS_MARKER
+# em admin_settings, e a primeira inicialização com ela ligada e sem a marca
+# reconstrói a tabela uma vez, sob o advisory lock das migrações (os outros
+# workers esperam e encontram a marca). Para forçar uma reconstrução, apague a
+# marca ou chame rebuild_technician_repair_stats().
+TECHNICIAN_STATS_TABLE = os.environ.get('TECHNICIAN_STATS_TABLE', '').strip().lower() in ('1', 'true', 'yes', 'on')
+TECHNICIAN_STATS_MARKER = 'technician_repair_stats_built'
+
+_REPAIR_COUNTS_SQL = """
+    SELECT technician_id,
+           count(*) AS total_repairs,
+           count(*) FILTER (WHERE status = 'concluido') AS completed_repairs,
+           count(*) FILTER (WHERE repair_type = 'retorno') AS return_repairs
+    FROM repairs
+    WHERE technician_id IS NOT NULL
+"""
+
+def _repair_stats_row(repair):
+    """Contribuição de um reparo para as contagens: (técnico, total, concluídos, retornos)"""
+    if not isinstance(repair, dict) or not repair.get('technician_id'):
+        return None
+    return (
+        repair.get('technician_id'),
+        1,
+        1 if repair.get('status') == 'concluido' else 0,
+        1 if repair.get('repair_type') == 'retorno' else 0,
+    )
+
+def _apply_repair_stats_delta(cur, old_repair, new_repair):
+    """Atualiza technician_repair_stats com a diferença entre a versão antiga e a nova do reparo"""
+    deltas = {}
+    for repair, sign in ((old_repair, -1), (new_repair, 1)):
+        row = _repair_stats_row(repair)
+        if row is None:
+            continue
+        current = deltas.setdefault(row[0], [0, 0, 0])
+        for i in range(3):
+            current[i] += sign * row[i + 1]
+    for tech_id, (total, completed, returns) in deltas.items():
+        if total == 0 and completed == 0 and returns == 0:
+            continue
+        cur.execute("""
+            INSERT INTO technician_repair_stats (technician_id, total_repairs, completed_repairs, return_repairs, updated_at)
+            VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP)
+            ON CONFLICT (technician_id)
+            DO UPDATE SET total_repairs = technician_repair_stats.total_repairs + EXCLUDED.total_repairs,
+                completed_repairs = technician_repair_stats.completed_repairs + EXCLUDED.completed_repairs,
+                return_repairs = technician_repair_stats.return_repairs + EXCLUDED.return_repairs,
+                updated_at = CURRENT_TIMESTAMP
+        """, (tech_id, total, completed, returns))
+
+def _rebuild_technician_repair_stats(cur):
+    """Recalcula toda a tabela technician_repair_stats a partir de repairs"""
+    cur.execute("DELETE FROM technician_repair_stats")
+    cur.execute(f"""
+        INSERT INTO technician_repair_stats (technician_id, total_repairs, completed_repairs, return_repairs)
+        SELECT technician_id, total_repairs, completed_repairs, return_repairs
+        FROM ({_REPAIR_COUNTS_SQL} GROUP BY 1) AS counts
+    """)
+
+def _mark_technician_repair_stats_built(cur):
+    cur.execute("""
+        INSERT INTO admin_settings (key, value, updated_at)
+        VALUES (%s, 'true', CURRENT_TIMESTAMP)
+        ON CONFLICT (key) DO UPDATE SET value = 'true', updated_at = CURRENT_TIMESTAMP
+    """, (TECHNICIAN_STATS_MARKER,))
+
+def _sync_technician_repair_stats():
+    """Chamada no create_tables: reconstrói a tabela só quando ela pode estar defasada"""
+    if not USE_DATABASE:
+        return
+    import migrations
+    with get_db_connection() as conn:
+        if not conn:
+            return
+        cur = _get_cursor(conn)
+        if not TECHNICIAN_STATS_TABLE:
+            cur.execute("DELETE FROM admin_settings WHERE key = %s", (TECHNICIAN_STATS_MARKER,))
+            return
+        # Mesmo lock das migrações: um único worker reconstrói, na mesma transação
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (migrations.MIGRATION_LOCK_KEY,))
+        cur.execute("SELECT 1 FROM admin_settings WHERE key = %s", (TECHNICIAN_STATS_MARKER,))
+        if cur.fetchone():
+            return
+        print("📋 Reconstruindo contagens dos técnicos (technician_repair_stats)...")
+        _rebuild_technician_repair_stats(cur)
+        _mark_technician_repair_stats_built(cur)
+
+def rebuild_technician_repair_stats():
+    """Reconstrói technician_repair_stats agora (comando de manutenção)"""
+    if not USE_DATABASE:
+        return
+    import migrations
+    with get_db_connection() as conn:
+        if not conn:
+            return
+        cur = _get_cursor(conn)
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (migrations.MIGRATION_LOCK_KEY,))
+        _rebuild_technician_repair_stats(cur)
+        _mark_technician_repair_stats_built(cur)
+
+def _count_repairs_in_config(tech_id=None):
+    counts = {}
+    config = _load_config_file()
+    for repair in config.get('repairs', []):
+        row = _repair_stats_row(repair)
+        if row is None or (tech_id is not None and row[0] != tech_id):
+            continue
+        current = counts.setdefault(row[0], [0, 0, 0])
+        for i in range(3):
+            current[i] += row[i + 1]
+    return {k: tuple(v) for k, v in counts.items()}
+
+def _get_repair_counts(tech_id=None):
+    """Retorna {technician_id: (total, concluídos, retornos)}, de um técnico ou de todos"""
+    if not USE_DATABASE:
+        return _count_repairs_in_config(tech_id)
+    try:
+        with get_db_connection() as conn:
+            if not conn:
+                return _count_repairs_in_config(tech_id)
+            cur = _get_cursor(conn, dict_cursor=True)
+            if TECHNICIAN_STATS_TABLE:
+                sql = "SELECT technician_id, total_repairs, completed_repairs, return_repairs FROM technician_repair_stats"
+                if tech_id is not None:
+                    cur.execute(sql + " WHERE technician_id = %s", (tech_id,))
+                else:
+                    cur.execute(sql)
+            elif tech_id is not None:
+                cur.execute(_REPAIR_COUNTS_SQL + " AND technician_id = %s GROUP BY 1", (tech_id,))
+            else:
+                cur.execute(_REPAIR_COUNTS_SQL + " GROUP BY 1")
+            return {
+                row['technician_id']: (row['total_repairs'], row['completed_repairs'], row['return_repairs'])
+                for row in cur.fetchall()
+            }
+    except Exception as e:
+        print(f"⚠️  Erro ao contar reparos por técnico: {e}")
+        return {}
+
+def _quality_score_from_counts(total, completed, returns):
+    if not total:
         return {
             'score': 0,
             'total_repairs': 0,
@@ -2028,14 +3129,10 @@ def calculate_technician_quality_score(tech_id):
             'level': 'Iniciante'
         }
     
-    total = len(tech_repairs)
-    completed = len([r for r in tech_repairs if r.get('status') == 'concluido'])
-    returns = len([r for r in tech_repairs if r.get('repair_type') == 'retorno'])
-    
     # Cálculo simples de score (0-100)
     # 70% peso para conclusão, 30% peso inverso para retornos
-    completion_rate = (completed / total) * 100 if total > 0 else 0
-    return_rate = (returns / total) * 100 if total > 0 else 0
+    completion_rate = (completed / total) * 100
+    return_rate = (returns / total) * 100
     
     score = (completion_rate * 0.7) + ((100 - return_rate) * 0.3)
     
@@ -2052,13 +3149,19 @@ def calculate_technician_quality_score(tech_id):
         'level': level
     }
 
+def calculate_technician_quality_score(tech_id):
+    """Calcula o score de qualidade de um técnico baseado em seus reparos"""
+    counts = _get_repair_counts(tech_id)
+    return _quality_score_from_counts(*counts.get(tech_id, (0, 0, 0)))
+
 def get_all_technician_quality_scores():
     """Obtém os scores de qualidade de todos os técnicos ativos"""
     techs = get_all_technicians()
+    counts = _get_repair_counts()
     scores = []
     for tech in techs:
         if tech.get('is_active'):
-            quality = calculate_technician_quality_score(tech.get('id'))
+            quality = _quality_score_from_counts(*counts.get(tech.get('id'), (0, 0, 0)))
             scores.append({
                 'technician': tech,
                 'quality_score': quality
@@ -2067,6 +3170,8 @@ def get_all_technician_quality_scores():
 
 # ========== FUNÇÕES DE VÍDEOS ==========
 
+SHORT_VIDEOS_SQL = "SELECT data FROM videos WHERE is_short ORDER BY created_at DESC LIMIT %s"
+
 def get_all_videos():
     """Obtém todos os vídeos"""
     if not USE_DATABASE:
@@ -2087,6 +3192,38 @@ def get_all_videos():
         config = _load_config_file()
         return config.get('videos', [])
 
+def get_videos_page(cursor=None, per_page=None):
+    """Uma página de vídeos, mais recentes primeiro (ver _keyset_page)"""
+    per_page = _page_size(per_page)
+    if USE_DATABASE:
+        try:
+            page = _keyset_page('videos', "SELECT id, created_at, data FROM videos", cursor, per_page, row_mapper=_row_data)
+            if page is not None:
+                return page
+        except Exception as e:
+            print(f"⚠️  Erro ao paginar vídeos no banco, usando config.json: {e}")
+    config = _load_config_file()
+    return _paginate_in_memory(config.get('videos', []), cursor, per_page)
+
+def get_short_videos(limit=4):
+    """Últimos vídeos marcados como shorts (índice parcial idx_videos_shorts)"""
+    if not USE_DATABASE:
+        config = _load_config_file()
+        return [v for v in config.get('videos', []) if v.get('is_short')][:limit]
+
+    try:
+        with get_db_connection() as conn:
+            if not conn:
+                config = _load_config_file()
+                return [v for v in config.get('videos', []) if v.get('is_short')][:limit]
+            cur = _get_cursor(conn, dict_cursor=True)
+            cur.execute(SHORT_VIDEOS_SQL, (limit,))
+            return [row['data'] for row in cur.fetchall()]
+    except Exception as e:
+        print(f"⚠️  Erro ao ler vídeos do banco: {e}")
+        config = _load_config_file()
+        return [v for v in config.get('videos', []) if v.get('is_short')][:limit]
+
 def get_video(video_id):
     """Obtém um vídeo específico"""
     if not USE_DATABASE:
@@ -2159,4 +3296,352 @@ def delete_video(video_id):
     except Exception as e:
         print(f"⚠️  Erro ao deletar vídeo do banco: {e}")
 
+# ========== FUNÇÕES DE FORNECEDORES ==========
+
+def get_all_suppliers():
+    """Obtém todos os fornecedores, em ordem de nome"""
+    if not USE_DATABASE:
+        config = _load_config_file()
+        return sorted(config.get('suppliers', []), key=lambda s: (s.get('name') or '').lower())
+
+    try:
+        with get_db_connection() as conn:
+            if not conn:
+                config = _load_config_file()
+                return config.get('suppliers', [])
+            cur = _get_cursor(conn, dict_cursor=True)
+            cur.execute("SELECT data FROM suppliers ORDER BY lower(data->>'name')")
+            return [row['data'] for row in cur.fetchall()]
+    except Exception as e:
+        print(f"⚠️  Erro ao ler fornecedores do banco: {e}")
+        config = _load_config_file()
+        return config.get('suppliers', [])
+
+def get_supplier(supplier_id):
+    """Obtém um fornecedor específico"""
+    if not USE_DATABASE:
+        config = _load_config_file()
+        for supplier in config.get('suppliers', []):
+            if supplier.get('id') == supplier_id:
+                return supplier
+        return None
+
+    try:
+        with get_db_connection() as conn:
+            if not conn:
+                return None
+            cur = _get_cursor(conn, dict_cursor=True)
+            cur.execute("SELECT data FROM suppliers WHERE id = %s", (supplier_id,))
+            row = cur.fetchone()
+            return row['data'] if row else None
+    except Exception as e:
+        print(f"⚠️  Erro ao ler fornecedor do banco: {e}")
+        return None
+
+def save_supplier(supplier_id, supplier_data):
+    """Salva ou atualiza um fornecedor"""
+    if not USE_DATABASE:
+        config = _load_config_file()
+        suppliers = config.get('suppliers', [])
+        for i, s in enumerate(suppliers):
+            if s.get('id') == supplier_id:
+                suppliers[i] = supplier_data
+                break
+        else:
+            suppliers.append(supplier_data)
+        config['suppliers'] = suppliers
+        _save_config_file(config)
+        return
+
+    try:
+        with get_db_connection() as conn:
+            if not conn: return
+            cur = _get_cursor(conn)
+            data_json = json.dumps(supplier_data)
+            cur.execute("""
+                INSERT INTO suppliers (id, data, updated_at)
+                VALUES (%s, %s::jsonb, CURRENT_TIMESTAMP)
+                ON CONFLICT (id)
+                DO UPDATE SET data = %s::jsonb, updated_at = CURRENT_TIMESTAMP
+            """, (supplier_id, data_json, data_json))
+    except Exception as e:
+        print(f"⚠️  Erro ao salvar fornecedor no banco: {e}")
+
+def delete_supplier(supplier_id):
+    """Deleta um fornecedor"""
+    if not USE_DATABASE:
+        config = _load_config_file()
+        config['suppliers'] = [s for s in config.get('suppliers', []) if s.get('id') != supplier_id]
+        _save_config_file(config)
+        return
+
+    try:
+        with get_db_connection() as conn:
+            if not conn: return
+            cur = _get_cursor(conn)
+            cur.execute("DELETE FROM suppliers WHERE id = %s", (supplier_id,))
+    except Exception as e:
+        print(f"⚠️  Erro ao deletar fornecedor do banco: {e}")
+
+# ========== FUNÇÕES DE FOTOS DE PRODUTOS ==========
+
+# As fotos ficam fora do JSON dos produtos: uma linha por arquivo em
+# product_photos (bytes crus em BYTEA) ou, sem banco, um arquivo em
+# static/product_photos. O nome do arquivo inclui o hash do conteúdo, então
+# uma URL nunca muda de conteúdo e pode ser cacheada como imutável.
+PRODUCT_PHOTOS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'product_photos')
+
+_PHOTO_EXTENSIONS = {'image/jpeg': '.jpg', 'image/png': '.png', 'image/webp': '.webp', 'image/gif': '.gif'}
+
+def product_photo_filename(data, mimetype):
+    """Nome endereçado pelo conteúdo: <sha256[:32]><extensão>"""
+    return hashlib.sha256(data).hexdigest()[:32] + _PHOTO_EXTENSIONS.get(mimetype, '.jpg')
+
+def save_product_photo(data, mimetype='image/jpeg'):
+    """Guarda a foto e retorna o nome do arquivo (URL: /static/product_photos/<nome>)"""
+    filename = product_photo_filename(data, mimetype)
+    content_hash = hashlib.sha256(data).hexdigest()
+    if USE_DATABASE:
+        try:
+            with get_db_connection() as conn:
+                if conn:
+                    cur = _get_cursor(conn)
+                    cur.execute("""
+                        INSERT INTO product_photos (filename, content_hash, mimetype, size, data)
+                        VALUES (%s, %s, %s, %s, %s)
+                        ON CONFLICT (filename) DO NOTHING
+                    """, (filename, content_hash, mimetype, len(data), data))
+                    return filename
+        except Exception as e:
+            print(f"⚠️  Erro ao salvar foto no banco, salvando em disco: {e}")
+
+    os.makedirs(PRODUCT_PHOTOS_DIR, exist_ok=True)
+    path = os.path.join(PRODUCT_PHOTOS_DIR, filename)
+    if not os.path.exists(path):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    return filename
+
+def get_product_photo(filename, known_hashes=()):
+    """Obtém a foto do banco: {'content_hash', 'mimetype', 'data'} ou None.
+
+    Se o hash atual estiver em known_hashes (ETags do If-None-Match), os bytes
+    não são lidos e 'data' vem como None.
+    """
+    if not USE_DATABASE:
+        return None
+    try:
+        with get_db_connection() as conn:
+            if not conn:
+                return None
+            cur = _get_cursor(conn, dict_cursor=True)
+            cur.execute("""
+                SELECT content_hash, mimetype,
+                       CASE WHEN content_hash = ANY(%s) THEN NULL ELSE data END AS data
+                FROM product_photos
+                WHERE filename = %s
+            """, (list(known_hashes), filename))
+            row = cur.fetchone()
+            if not row:
+                return None
+            return {
+                'content_hash': row['content_hash'],
+                'mimetype': row['mimetype'],
+                'data': bytes(row['data']) if row['data'] is not None else None,
+            }
+    except Exception as e:
+        print(f"⚠️  Erro ao ler foto do banco: {e}")
+        return None
+
+def delete_product_photo(filename):
+    """Remove a foto do banco e do disco"""
+    if USE_DATABASE:
+        try:
+            with get_db_connection() as conn:
+                if conn:
+                    cur = _get_cursor(conn)
+                    cur.execute("DELETE FROM product_photos WHERE filename = %s", (filename,))
+        except Exception as e:
+            print(f"⚠️  Erro ao deletar foto do banco: {e}")
+    path = os.path.join(PRODUCT_PHOTOS_DIR, os.path.basename(filename))
+    if os.path.exists(path):
+        os.remove(path)
+
+# ========== CACHE DA BUSCA EM FORNECEDORES ==========
+
+# Resultados da busca (kind 'search', chave = consulta normalizada + conjunto de
+# fornecedores) e detalhes de produto por URL (kind 'product') ficam na tabela
+# supplier_cache ou, sem banco, em arquivos JSON em SUPPLIER_CACHE_DIR. O
+# controle de validade (TTL, stale-while-revalidate) fica no supplier_scraper;
+# aqui só se grava, lê com a idade da entrada e contam-se os acertos.
+SUPPLIER_SEARCH_TTL = _env_int('SUPPLIER_SEARCH_TTL', 6 * 3600)  # resultado fresco
+SUPPLIER_SEARCH_MAX_STALE = _env_int('SUPPLIER_SEARCH_MAX_STALE', 7 * 86400)  # serve velho até
+SUPPLIER_PRODUCT_TTL = _env_int('SUPPLIER_PRODUCT_TTL', 24 * 3600)
+SUPPLIER_CACHE_DIR = os.environ.get('SUPPLIER_CACHE_DIR') or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'cache', 'supplier_search')
+
+# Entradas mais velhas que isto já não são servidas e são apagadas (tabela e
+# arquivos) por purge_supplier_cache, chamada nas gravações no máximo a cada
+# SUPPLIER_CACHE_PURGE_INTERVAL segundos por kind. Perfis de busca aprendidos
+# ('search_profile') não expiram.
+SUPPLIER_CACHE_MAX_AGE = {
+    'search': SUPPLIER_SEARCH_MAX_STALE,
+    'product': SUPPLIER_PRODUCT_TTL,
+}
+SUPPLIER_CACHE_PURGE_INTERVAL = _env_int('SUPPLIER_CACHE_PURGE_INTERVAL', 3600)
+_supplier_cache_purged_at = {}
+
+_supplier_cache_stats = {
+    'hits': 0,
+    'stale_hits': 0,
+    'misses': 0,
+    'refreshes': 0,
+    'product_hits': 0,
+    'product_misses': 0,
+}
+_supplier_cache_stats_lock = threading.Lock()
+
+def record_supplier_cache_event(event):
+    with _supplier_cache_stats_lock:
+        _supplier_cache_stats[event] = _supplier_cache_stats.get(event, 0) + 1
+
+def get_supplier_cache_stats():
+    """Acertos e faltas do cache da busca em fornecedores (deste worker)"""
+    with _supplier_cache_stats_lock:
+        stats = dict(_supplier_cache_stats)
+    lookups = stats['hits'] + stats['stale_hits'] + stats['misses']
+    stats['hit_rate'] = round((stats['hits'] + stats['stale_hits']) / lookups * 100, 1) if lookups else 0.0
+    return stats
+
+def _supplier_cache_path(kind, key):
+    digest = hashlib.sha256(f"{kind}:{key}".encode('utf-8')).hexdigest()[:32]
+    return os.path.join(SUPPLIER_CACHE_DIR, kind, digest + '.json')
+
+def get_supplier_cache_entry(kind, key):
+    """Retorna (dados, idade em segundos) ou (None, None) se não houver entrada"""
+    if not USE_DATABASE:
+        path = _supplier_cache_path(kind, key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            return entry['data'], max(time.time() - entry['fetched_at'], 0)
+        except (OSError, ValueError, KeyError):
+            return None, None
+
+    try:
+        with get_db_connection() as conn:
+            if not conn:
+                return None, None
+            cur = _get_cursor(conn, dict_cursor=True)
+            cur.execute("""
+                SELECT data, extract(epoch FROM now() - fetched_at) AS age
+                FROM supplier_cache
+                WHERE kind = %s AND key = %s
+            """, (kind, key))
+            row = cur.fetchone()
+            if not row:
+                return None, None
+            return row['data'], max(float(row['age']), 0)
+    except Exception as e:
+        print(f"⚠️  Erro ao ler cache de fornecedores: {e}")
+        return None, None
+
+def save_supplier_cache_entry(kind, key, data):
+    """Grava (ou substitui) a entrada com fetched_at = agora"""
+    if not USE_DATABASE:
+        path = _supplier_cache_path(kind, key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'key': key, 'fetched_at': time.time(), 'data': data}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠️  Erro ao gravar cache de fornecedores: {e}")
+        return
+
+    try:
+        with get_db_connection() as conn:
+            if not conn:
+                return
+            cur = _get_cursor(conn)
+            cur.execute("""
+                INSERT INTO supplier_cache (kind, key, data, fetched_at)
+                VALUES (%s, %s, %s::jsonb, now())
+                ON CONFLICT (kind, key)
+                DO UPDATE SET data = EXCLUDED.data, fetched_at = EXCLUDED.fetched_at
+            """, (kind, key, json.dumps(data)))
+    except Exception as e:
+        print(f"⚠️  Erro ao gravar cache de fornecedores: {e}")
+    finally:
+        if kind in SUPPLIER_CACHE_MAX_AGE:
+            purge_supplier_cache(kind, SUPPLIER_CACHE_MAX_AGE[kind])
+
+def delete_supplier_cache_entry(kind, key):
+    """Remove a entrada, se existir"""
+    if not USE_DATABASE:
+        try:
+            os.remove(_supplier_cache_path(kind, key))
+        except OSError:
+            pass
+        return
+
+    try:
+        with get_db_connection() as conn:
+            if not conn:
+                return
+            cur = _get_cursor(conn)
+            cur.execute("DELETE FROM supplier_cache WHERE kind = %s AND key = %s", (kind, key))
+    except Exception as e:
+        print(f"⚠️  Erro ao apagar cache de fornecedores: {e}")
+
+def purge_supplier_cache(kind, max_age, force=False):
+    """Apaga as entradas de `kind` com mais de `max_age` segundos.
+
+    Sem `force`, roda no máximo uma vez a cada SUPPLIER_CACHE_PURGE_INTERVAL
+    segundos por kind neste worker. Retorna quantas entradas foram apagadas.
+    """
+    now = time.monotonic()
+    with _supplier_cache_stats_lock:
+        last = _supplier_cache_purged_at.get(kind)
+        if not force and last is not None and now - last < SUPPLIER_CACHE_PURGE_INTERVAL:
+            return 0
+        _supplier_cache_purged_at[kind] = now
+
+    if not USE_DATABASE:
+        directory = os.path.join(SUPPLIER_CACHE_DIR, kind)
+        cutoff = time.time() - max_age
+        removed = 0
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return 0
+        for name in names:
+            path = os.path.join(directory, name)
+            try:
+                # O arquivo é sempre regravado por inteiro (os.replace), então o
+                # mtime é o fetched_at da entrada
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                pass
+        return removed
+
+    try:
+        with get_db_connection() as conn:
+            if not conn:
+                return 0
+            cur = _get_cursor(conn)
+            cur.execute("""
+                DELETE FROM supplier_cache
+                WHERE kind = %s AND fetched_at < now() - %s * interval '1 second'
+            """, (kind, max_age))
+            return cur.rowcount or 0
+    except Exception as e:
+        print(f"⚠️  Erro ao limpar cache de fornecedores: {e}")
+        return 0
+
 # ========== FIM DO ARQUIVO ==========
@@ -0,0 +1,147 @@
+"""
+Planilhas (CSV e XLSX) geradas em streaming a partir dos iteradores de
+exportação do db.py (iter_transactions_for_export, iter_service_orders_for_export,
+iter_customers_for_export).
+
+Cada coluna é (título, chave, tipo) com tipo 'text', 'int', 'money' ou 'date'.
+O CSV segue o padrão do Excel em português: separador ';', vírgula decimal,
+datas dd/mm/aaaa e BOM UTF-8.
+"""
+import codecs
+import csv
+import importlib.util
+import io
+import tempfile
+from datetime import date, datetime
+
+# XlsxWriter só é importado quando um XLSX é de fato gerado
+XLSX_AVAILABLE = importlib.util.find_spec('xlsxwriter') is not None
+
+_STREAM_CHUNK_SIZE = 64 * 1024
+
+TRANSACTION_COLUMNS = [
+    ('Data', 'date', 'date'),
+    ('Tipo', 'type', 'text'),
+    ('Categoria', 'category', 'text'),
+    ('Descrição', 'description', 'text'),
+    ('Forma de pagamento', 'payment_method', 'text'),
+    ('Valor', 'amount', 'money'),
+    ('ID', 'id', 'text'),
+]
+
+SERVICE_ORDER_COLUMNS = [
+    ('OS', 'os_number', 'int'),
+    ('Status', 'status', 'text'),
+    ('Abertura', 'opened_at', 'date'),
+    ('Conclusão', 'concluded_at', 'date'),
+    ('Entrega', 'delivered_at', 'date'),
+    ('Cliente', 'customer_name', 'text'),
+    ('Documento', 'customer_doc', 'text'),
+    ('Técnico', 'technician_name', 'text'),
+    ('Equipamento', 'equipment', 'text'),
+    ('Mão de obra', 'labor_value', 'money'),
+    ('Peças', 'parts_value', 'money'),
+    ('Total', 'total_value', 'money'),
+]
+
+CUSTOMER_COLUMNS = [
+    ('ID', 'id', 'text'),
+    ('Nome', 'full_name', 'text'),
+    ('Tipo de documento', 'doc_type', 'text'),
+    ('Documento', 'doc_number', 'text'),
+    ('Telefone', 'phone', 'text'),
+    ('E-mail', 'email', 'text'),
+    ('Cadastro', 'created_at', 'date'),
+]
+
+def _as_date(value):
+    """date/datetime do banco ou texto ISO do config.json; None se não for data"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if isinstance(value, str) and value.strip():
+        try:
+            return date.fromisoformat(value.strip()[:10])
+        except ValueError:
+            return None
+    return None
+
+def _safe_text(value):
+    """Texto livre não pode virar fórmula ao abrir a planilha"""
+    text = '' if value is None else str(value)
+    if text[:1] in ('=', '+', '-', '@', '\t', '\r'):
+        return "'" + text
+    return text
+
+def _csv_value(value, kind):
+    if kind == 'money':
+        return f"{float(value or 0):.2f}".replace('.', ',')
+    if kind == 'int':
+        return '' if value in (None, '') else str(value)
+    if kind == 'date':
+        parsed = _as_date(value)
+        return parsed.strftime('%d/%m/%Y') if parsed else _safe_text(value)
+    return _safe_text(value)
+
+def stream_csv(rows, columns):
+    """Gera o CSV em blocos de ~64 KB à medida que `rows` é consumido"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=';', lineterminator='\r\n')
+    writer.writerow([title for title, _, _ in columns])
+    yield codecs.BOM_UTF8 + buffer.getvalue().encode('utf-8')
+    buffer.seek(0)
+    buffer.truncate()
+
+    for row in rows:
+        writer.writerow([_csv_value(row.get(key), kind) for _, key, kind in columns])
+        if buffer.tell() >= _STREAM_CHUNK_SIZE:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+def stream_xlsx(rows, columns, sheet_name='Planilha'):
+    """Gera o XLSX com XlsxWriter em modo constant_memory.
+
+    As linhas vão direto para arquivos temporários (uma linha em memória por
+    vez); o .xlsx é montado em disco ao final e enviado em blocos.
+    """
+    if not XLSX_AVAILABLE:
+        raise RuntimeError("XlsxWriter não está instalado no ambiente")
+    import xlsxwriter
+
+    with tempfile.TemporaryFile() as output:
+        workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+        header = workbook.add_format({'bold': True})
+        money = workbook.add_format({'num_format': '#,##0.00'})
+        day = workbook.add_format({'num_format': 'dd/mm/yyyy'})
+        sheet = workbook.add_worksheet(sheet_name[:31])
+
+        for col, (title, _, kind) in enumerate(columns):
+            sheet.write_string(0, col, title, header)
+            sheet.set_column(col, col, 14 if kind in ('money', 'date', 'int') else 24)
+        sheet.freeze_panes(1, 0)
+
+        for line, row in enumerate(rows, start=1):
+            for col, (_, key, kind) in enumerate(columns):
+                value = row.get(key)
+                if value is None or value == '':
+                    continue
+                if kind == 'money':
+                    sheet.write_number(line, col, float(value or 0), money)
+                elif kind == 'int' and isinstance(value, int):
+                    sheet.write_number(line, col, value)
+                elif kind == 'date' and _as_date(value):
+                    sheet.write_datetime(line, col, datetime.combine(_as_date(value), datetime.min.time()), day)
+                else:
+                    sheet.write_string(line, col, str(value))
+        workbook.close()
+
+        output.seek(0)
+        while True:
+            chunk = output.read(_STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
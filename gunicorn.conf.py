@@ -1,8 +1,42 @@
 # Configuração do Gunicorn para evitar timeouts
 import multiprocessing
+import os
 
-# Número de workers
-workers = 1  # Render usa 1 worker por padrão
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+# Número de workers (WEB_CONCURRENCY é a variável padrão do Render). Um por
+# núcleo, até 4. Estado que precisa valer entre workers (limite de consultas
+# de OS, jobs de busca, cache de fornecedores) fica no banco.
+workers = max(1, _env_int('WEB_CONCURRENCY', min(multiprocessing.cpu_count(), 4)))
+
+# Worker class: gthread atende várias requisições por worker; enquanto uma
+# thread espera o Postgres ou um fornecedor, as outras continuam respondendo.
+# GUNICORN_WORKER_CLASS=gevent também funciona (requer o pacote gevent).
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = max(1, _env_int('GUNICORN_THREADS', 4))
+if worker_class == 'gevent':
+    worker_connections = _env_int('GUNICORN_WORKER_CONNECTIONS', 100)
+
+# Pool do banco dimensionado por workers × threads: cada worker abre o seu, com
+# uma conexão por thread (a requisição fica com ela até o fim) mais
+# DB_POOL_BACKGROUND_SLOTS para as threads em segundo plano (fornecedores da
+# busca, atualização do cache, cancelamento), que pegam conexões curtas. O
+# total fica limitado a DB_MAX_CONNECTIONS. Um DB_POOL_MAX_SIZE explícito no
+# ambiente tem prioridade.
+_concurrency = threads if worker_class != 'gevent' else worker_connections
+_background_slots = max(0, _env_int('DB_POOL_BACKGROUND_SLOTS', 4))
+_db_budget = max(2, _env_int('DB_MAX_CONNECTIONS', 40) // workers)
+os.environ.setdefault('DB_POOL_MAX_SIZE', str(max(1, min(_concurrency + _background_slots, _db_budget))))
+os.environ.setdefault('DB_POOL_MAX_WAITING', str(_concurrency * 2))
+
+# O master importa o app (preload) sem abrir conexões; cada worker cria o
+# próprio pool no post_fork. Sockets abertos antes do fork seriam
+# compartilhados entre processos e corromperiam as conexões.
+os.environ.setdefault('DB_STARTUP_MODE', 'lazy')
 
 # Timeout aumentado para servir vídeos grandes
 timeout = 120  # 2 minutos (aumentado de 30s padrão)
@@ -10,9 +44,6 @@ timeout = 120  # 2 minutos (aumentado de 30s padrão)
 # Keep-alive
 keepalive = 5
 
-# Worker class
-worker_class = "sync"
-
 # Logging
 accesslog = "-"
 errorlog = "-"
@@ -24,3 +55,11 @@ graceful_timeout = 30
 # Preload app para melhor performance
 preload_app = True
 
+def post_fork(server, worker):
+    """Abre o pool do banco dentro do worker recém-criado"""
+    import db
+    db.reset_after_fork()
+    try:
+        db.ensure_db_ready()
+    except Exception as e:
+        server.log.warning(f"Worker {worker.pid}: erro ao inicializar banco de dados: {e}")
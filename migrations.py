@@ -0,0 +1,353 @@
+"""
+Migrações versionadas do schema do PostgreSQL.
+
+Cada migração é uma função numerada que recebe (conn, cur) e roda dentro da
+transação do runner. A tabela schema_migrations guarda as versões aplicadas.
+
+Na inicialização (db.create_tables) o custo normal é uma única consulta:
+SELECT max(version) FROM schema_migrations. Só quando há migração pendente o
+runner abre uma transação, pega um advisory lock (outros processos esperam em
+vez de aplicar a mesma migração em paralelo), relê as versões aplicadas e
+aplica as que faltam. Se qualquer uma falhar, nada é gravado.
+
+As migrações usam IF NOT EXISTS para poderem rodar sobre bancos criados pelo
+create_tables antigo (sem schema_migrations). Para uma mudança nova de schema,
+acrescente uma função ao final de MIGRATIONS; nunca altere uma já publicada.
+"""
+import db
+
+try:
+    from psycopg import errors as pg_errors
+except ImportError:
+    pg_errors = None
+
+# Chave do pg_advisory_xact_lock (qualquer bigint fixo, único na aplicação)
+MIGRATION_LOCK_KEY = 7165343210
+
+def _m0001_base_schema(conn, cur):
+    """Tabelas e índices existentes antes do controle de versão"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS site_content (
+            id SERIAL PRIMARY KEY,
+            section VARCHAR(50) UNIQUE NOT NULL,
+            data JSONB NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS admin_settings (
+            key VARCHAR(100) PRIMARY KEY,
+            value TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS repairs (
+            id VARCHAR(50) PRIMARY KEY,
+            data JSONB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS transactions (
+            id VARCHAR(50) PRIMARY KEY,
+            data JSONB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS customers (
+            id VARCHAR(50) PRIMARY KEY,
+            doc_type VARCHAR(10) NOT NULL,
+            doc_number VARCHAR(14) UNIQUE NOT NULL,
+            data JSONB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS equipments (
+            id VARCHAR(50) PRIMARY KEY,
+            customer_id VARCHAR(50) NOT NULL,
+            data JSONB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS service_orders (
+            id VARCHAR(50) PRIMARY KEY,
+            os_number SERIAL UNIQUE,
+            customer_id VARCHAR(50) NOT NULL,
+            technician_id VARCHAR(50),
+            equipment_id VARCHAR(50),
+            status VARCHAR(30) NOT NULL,
+            labor_value NUMERIC(12,2) DEFAULT 0,
+            parts_value NUMERIC(12,2) DEFAULT 0,
+            total_value NUMERIC(12,2) DEFAULT 0,
+            budget_date DATE,
+            authorized BOOLEAN DEFAULT FALSE,
+            opened_at DATE,
+            concluded_at DATE,
+            delivered_at DATE,
+            data JSONB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS service_order_parts (
+            id SERIAL PRIMARY KEY,
+            service_order_id VARCHAR(50) NOT NULL,
+            part VARCHAR(300) NOT NULL,
+            quantity INTEGER NOT NULL,
+            value NUMERIC(12,2) NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS service_order_history (
+            id SERIAL PRIMARY KEY,
+            service_order_id VARCHAR(50) NOT NULL,
+            message TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS videos (
+            id VARCHAR(50) PRIMARY KEY,
+            data JSONB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS admin_users (
+            id VARCHAR(50) PRIMARY KEY,
+            username VARCHAR(100) UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            name VARCHAR(200) NOT NULL,
+            email VARCHAR(200),
+            phone VARCHAR(20),
+            permissions JSONB DEFAULT '{}',
+            is_active BOOLEAN DEFAULT TRUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS technicians (
+            id VARCHAR(50) PRIMARY KEY,
+            name VARCHAR(200) NOT NULL,
+            cpf VARCHAR(11) UNIQUE,
+            email VARCHAR(200),
+            phone VARCHAR(20),
+            address TEXT,
+            specialties JSONB DEFAULT '[]',
+            is_active BOOLEAN DEFAULT TRUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_repairs_repair_id ON repairs(id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_customers_doc_number ON customers(doc_number)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_customers_created_at ON customers(created_at)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_equipments_customer_id ON equipments(customer_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_service_orders_customer_id ON service_orders(customer_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_service_orders_status ON service_orders(status)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_service_orders_public_token ON service_orders ((data->>'public_token'))")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_service_order_parts_os_id ON service_order_parts(service_order_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_service_order_history_os_id ON service_order_history(service_order_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_admin_users_username ON admin_users(username)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_admin_users_active ON admin_users(is_active)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_technicians_cpf ON technicians(cpf)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_technicians_active ON technicians(is_active)")
+
+def _m0002_transaction_columns(conn, cur):
+    """Colunas tipadas do financeiro (filtros e totais) e busca trigram"""
+    cur.execute("""
+        ALTER TABLE transactions
+            ADD COLUMN IF NOT EXISTS type VARCHAR(10),
+            ADD COLUMN IF NOT EXISTS category VARCHAR(100),
+            ADD COLUMN IF NOT EXISTS description TEXT,
+            ADD COLUMN IF NOT EXISTS payment_method VARCHAR(50),
+            ADD COLUMN IF NOT EXISTS amount NUMERIC(12,2),
+            ADD COLUMN IF NOT EXISTS date DATE
+    """)
+    db._backfill_transaction_columns(cur)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions(date)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_transactions_type_date ON transactions(type, date)")
+    try:
+        # Savepoint: sem permissão para a extensão, o resto da migração segue
+        with conn.transaction():
+            cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            cur.execute(f"CREATE INDEX IF NOT EXISTS idx_transactions_search_trgm ON transactions USING gin (({db._TRANSACTION_SEARCH_EXPR}) gin_trgm_ops)")
+    except Exception as e:
+        print(f"⚠️  pg_trgm indisponível, busca do financeiro sem índice: {e}")
+
+def _m0003_technician_repair_stats(conn, cur):
+    """Contagens por técnico (usadas quando TECHNICIAN_STATS_TABLE está ligado)"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS technician_repair_stats (
+            technician_id VARCHAR(50) PRIMARY KEY,
+            total_repairs INTEGER NOT NULL DEFAULT 0,
+            completed_repairs INTEGER NOT NULL DEFAULT 0,
+            return_repairs INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+def _m0004_product_photos(conn, cur):
+    """Fotos de produtos (bytes crus, nome endereçado pelo hash do conteúdo)"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS product_photos (
+            filename VARCHAR(255) PRIMARY KEY,
+            content_hash CHAR(64) NOT NULL,
+            mimetype VARCHAR(50) NOT NULL,
+            size INTEGER NOT NULL,
+            data BYTEA NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+def _m0005_service_order_opened_at(conn, cur):
+    """Filtro por período da exportação de OS"""
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_service_orders_opened_at ON service_orders(opened_at)")
+
+def _m0006_keyset_pagination(conn, cur):
+    """Chaves da paginação keyset: (created_at, id) percorrido de trás para frente"""
+    for table in ('repairs', 'transactions', 'customers', 'videos', 'admin_users', 'technicians'):
+        cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_created_at_id ON {table}(created_at, id)")
+
+def _m0007_generated_filter_columns(conn, cur):
+    """Campos do JSON usados em filtros viram colunas geradas (STORED) indexáveis"""
+    cur.execute("""
+        ALTER TABLE repairs
+            ADD COLUMN IF NOT EXISTS technician_id TEXT
+                GENERATED ALWAYS AS (nullif(data->>'technician_id', '')) STORED,
+            ADD COLUMN IF NOT EXISTS status TEXT
+                GENERATED ALWAYS AS (data->>'status') STORED,
+            ADD COLUMN IF NOT EXISTS repair_type TEXT
+                GENERATED ALWAYS AS (data->>'repair_type') STORED
+    """)
+    cur.execute("""
+        ALTER TABLE videos
+            ADD COLUMN IF NOT EXISTS is_short BOOLEAN
+                GENERATED ALWAYS AS (coalesce(data->'is_short' = 'true'::jsonb, false)) STORED
+    """)
+    # Substituído pelo índice na coluna gerada
+    cur.execute("DROP INDEX IF EXISTS idx_repairs_technician_id")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_repairs_technician_status ON repairs(technician_id, status) WHERE technician_id IS NOT NULL")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_repairs_status ON repairs(status)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_videos_shorts ON videos(created_at DESC) WHERE is_short")
+
+def _m0008_supplier_cache(conn, cur):
+    """Cache da busca em fornecedores (consultas e detalhes de produto)"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS supplier_cache (
+            kind VARCHAR(20) NOT NULL,
+            key TEXT NOT NULL,
+            data JSONB NOT NULL,
+            fetched_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (kind, key)
+        )
+    """)
+
+def _m0009_supplier_cache_fetched_at(conn, cur):
+    """Limpeza do cache de fornecedores por idade (purge_supplier_cache)"""
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_supplier_cache_kind_fetched_at ON supplier_cache(kind, fetched_at)")
+
+def _m0010_rate_limits(conn, cur):
+    """Contadores do limite de consultas públicas, compartilhados entre workers"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS rate_limits (
+            key TEXT PRIMARY KEY,
+            window_start BIGINT NOT NULL,
+            hits INTEGER NOT NULL
+        )
+    """)
+
+def _m0011_suppliers(conn, cur):
+    """Cadastro de fornecedores (usado pela busca em fornecedores)"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS suppliers (
+            id VARCHAR(50) PRIMARY KEY,
+            data JSONB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+MIGRATIONS = [
+    (1, 'base_schema', _m0001_base_schema),
+    (2, 'transaction_columns', _m0002_transaction_columns),
+    (3, 'technician_repair_stats', _m0003_technician_repair_stats),
+    (4, 'product_photos', _m0004_product_photos),
+    (5, 'service_order_opened_at', _m0005_service_order_opened_at),
+    (6, 'keyset_pagination', _m0006_keyset_pagination),
+    (7, 'generated_filter_columns', _m0007_generated_filter_columns),
+    (8, 'supplier_cache', _m0008_supplier_cache),
+    (9, 'supplier_cache_fetched_at', _m0009_supplier_cache_fetched_at),
+    (10, 'rate_limits', _m0010_rate_limits),
+    (11, 'suppliers', _m0011_suppliers),
+]
+
+HEAD_VERSION = MIGRATIONS[-1][0]
+
+def current_version(conn):
+    """Versão aplicada mais alta (0 se schema_migrations ainda não existe)"""
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT max(version) FROM schema_migrations")
+        row = cur.fetchone()
+        return (row[0] if row else None) or 0
+    except Exception as e:
+        if pg_errors is not None and isinstance(e, pg_errors.UndefinedTable):
+            return 0
+        raise
+    finally:
+        # Encerra a transação implícita da consulta (ou a abortada pelo erro)
+        conn.rollback()
+
+def _apply_pending(conn):
+    cur = conn.cursor()
+    applied_now = []
+    with conn.transaction():
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_KEY,))
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name VARCHAR(100) NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        # Outro processo pode ter aplicado enquanto esperávamos o lock
+        cur.execute("SELECT version FROM schema_migrations")
+        applied = {row[0] for row in cur.fetchall()}
+        for version, name, migration in MIGRATIONS:
+            if version in applied:
+                continue
+            print(f"📋 Aplicando migração {version:04d}_{name}...")
+            migration(conn, cur)
+            cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+            applied_now.append(version)
+    return applied_now
+
+def migrate():
+    """Leva o schema à versão HEAD_VERSION. Retorna a versão final (None sem banco)"""
+    with db.get_db_connection() as conn:
+        if not conn:
+            return None
+        version = current_version(conn)
+        if version >= HEAD_VERSION:
+            print(f"✅ Schema do banco atualizado (versão {version})")
+            return version
+        applied = _apply_pending(conn)
+        if applied:
+            print(f"✅ Migrações aplicadas: {', '.join(str(v) for v in applied)} (versão {HEAD_VERSION})")
+        else:
+            print(f"✅ Schema do banco atualizado (versão {HEAD_VERSION})")
+        return HEAD_VERSION
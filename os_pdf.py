@@ -1,16 +1,241 @@
-def build_os_pdf(order, company, logo_path, public_url=None):
-    from io import BytesIO
-    import os
-    from xml.sax.saxutils import escape
+from io import BytesIO, RawIOBase
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import zipfile
+from xml.sax.saxutils import escape
+
+try:
+    from reportlab.graphics import renderPDF
+    from reportlab.graphics.barcode.qr import QrCodeWidget
+    from reportlab.graphics.shapes import Drawing
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+    from reportlab.lib.units import mm
+    from reportlab.lib.utils import ImageReader
+    from reportlab.platypus import Flowable, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+    REPORTLAB_AVAILABLE = True
+except Exception:
+    REPORTLAB_AVAILABLE = False
+
+# PDFs prontos, por worker. A chave inclui id e updated_at da OS e um hash de
+# tudo o que aparece no documento (cliente, equipamento, empresa, link do QR,
+# logo), então uma OS alterada gera outra chave e a versão antiga é descartada.
+OS_PDF_CACHE_MAX_ENTRIES = int(os.environ.get('OS_PDF_CACHE_MAX_ENTRIES', '64'))
+OS_PDF_CACHE_MAX_BYTES = int(os.environ.get('OS_PDF_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+
+_pdf_cache = OrderedDict()
+_pdf_cache_keys = {}
+_pdf_cache_bytes = 0
+_pdf_cache_lock = threading.Lock()
+
+_resources = None
+_resources_lock = threading.Lock()
+_logo_cache = {}
+_logo_lock = threading.Lock()
+
+def _require_reportlab():
+    if not REPORTLAB_AVAILABLE:
+        raise RuntimeError("ReportLab não está instalado no ambiente")
+
+def _get_resources():
+    """Estilos de parágrafo e de tabela, montados uma única vez por processo"""
+    global _resources
+    if _resources is not None:
+        return _resources
+    with _resources_lock:
+        if _resources is not None:
+            return _resources
+        styles = getSampleStyleSheet()
+        grid = ("GRID", (0, 0), (-1, -1), 0.5, colors.HexColor("#CCCCCC"))
+        _resources = {
+            'title': ParagraphStyle(
+                "os_title",
+                parent=styles["Heading1"],
+                fontName="Helvetica-Bold",
+                fontSize=16,
+                leading=20,
+                spaceAfter=6,
+                textColor=colors.HexColor("#111111"),
+            ),
+            'section': ParagraphStyle(
+                "os_section",
+                parent=styles["Heading3"],
+                fontName="Helvetica-Bold",
+                fontSize=11,
+                leading=14,
+                spaceBefore=10,
+                spaceAfter=6,
+                textColor=colors.HexColor("#111111"),
+            ),
+            'small': ParagraphStyle(
+                "os_small",
+                parent=styles["Normal"],
+                fontName="Helvetica",
+                fontSize=9,
+                leading=12,
+                textColor=colors.HexColor("#333333"),
+            ),
+            'value': ParagraphStyle(
+                "os_value",
+                parent=styles["Normal"],
+                fontName="Helvetica",
+                fontSize=10,
+                leading=13,
+                textColor=colors.HexColor("#111111"),
+            ),
+            'block': ParagraphStyle(
+                "os_block",
+                parent=styles["Normal"],
+                fontName="Helvetica",
+                fontSize=9.5,
+                leading=13,
+                textColor=colors.HexColor("#111111"),
+            ),
+            'separator_table': TableStyle([("LINEBELOW", (0, 0), (-1, -1), 1, colors.HexColor("#111111"))]),
+            'kv_table': TableStyle(
+                [
+                    ("VALIGN", (0, 0), (-1, -1), "TOP"),
+                    grid,
+                    ("BACKGROUND", (0, 0), (0, -1), colors.HexColor("#F3F3F3")),
+                    ("LEFTPADDING", (0, 0), (-1, -1), 6),
+                    ("RIGHTPADDING", (0, 0), (-1, -1), 6),
+                    ("TOPPADDING", (0, 0), (-1, -1), 4),
+                    ("BOTTOMPADDING", (0, 0), (-1, -1), 4),
+                ]
+            ),
+            'block_table': TableStyle(
+                [
+                    grid,
+                    ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#F3F3F3")),
+                    ("LEFTPADDING", (0, 0), (-1, -1), 8),
+                    ("RIGHTPADDING", (0, 0), (-1, -1), 8),
+                    ("TOPPADDING", (0, 0), (-1, -1), 6),
+                    ("BOTTOMPADDING", (0, 0), (-1, -1), 6),
+                ]
+            ),
+            'header_table': TableStyle(
+                [
+                    ("VALIGN", (0, 0), (-1, -1), "TOP"),
+                    ("LEFTPADDING", (0, 0), (-1, -1), 0),
+                    ("RIGHTPADDING", (0, 0), (-1, -1), 0),
+                    ("BOTTOMPADDING", (0, 0), (-1, -1), 0),
+                ]
+            ),
+            'values_table': TableStyle(
+                [
+                    ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#111111")),
+                    ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
+                    ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+                    grid,
+                    ("FONTNAME", (0, 1), (-1, -1), "Helvetica"),
+                    ("ALIGN", (1, 1), (1, -1), "RIGHT"),
+                    ("LEFTPADDING", (0, 0), (-1, -1), 6),
+                    ("RIGHTPADDING", (0, 0), (-1, -1), 6),
+                    ("TOPPADDING", (0, 0), (-1, -1), 5),
+                    ("BOTTOMPADDING", (0, 0), (-1, -1), 5),
+                    ("BACKGROUND", (0, 3), (-1, 3), colors.HexColor("#F3F3F3")),
+                    ("FONTNAME", (0, 3), (-1, 3), "Helvetica-Bold"),
+                ]
+            ),
+            'sign_table': TableStyle(
+                [
+                    ("LINEABOVE", (0, 2), (0, 2), 1, colors.HexColor("#111111")),
+                    ("LINEABOVE", (1, 2), (1, 2), 1, colors.HexColor("#111111")),
+                    ("TOPPADDING", (0, 1), (-1, 2), 18),
+                    ("BOTTOMPADDING", (0, 1), (-1, 2), 0),
+                    ("LEFTPADDING", (0, 0), (-1, -1), 0),
+                    ("RIGHTPADDING", (0, 0), (-1, -1), 0),
+                ]
+            ),
+        }
+    return _resources
 
+def _logo_stamp(logo_path):
     try:
-        from reportlab.lib import colors
-        from reportlab.lib.pagesizes import A4
-        from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
-        from reportlab.lib.units import mm
-        from reportlab.platypus import Image, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
-    except Exception as e:
-        raise RuntimeError("ReportLab não está instalado no ambiente") from e
+        stat = os.stat(logo_path)
+        return (logo_path, stat.st_mtime_ns, stat.st_size)
+    except (OSError, TypeError):
+        return None
+
+def _get_logo(logo_path):
+    """Logo achatado sobre fundo branco, como ImageReader pronto (refeito só se o arquivo mudar)"""
+    stamp = _logo_stamp(logo_path) if logo_path else None
+    if stamp is None:
+        return None
+    with _logo_lock:
+        cached = _logo_cache.get(logo_path)
+        if cached and cached[0] == stamp:
+            return cached[1]
+    try:
+        from PIL import Image as _PILImage
+
+        img = _PILImage.open(logo_path).convert("RGBA")
+        bg = _PILImage.new("RGBA", img.size, (255, 255, 255, 255))
+        bg.alpha_composite(img)
+        rgb = bg.convert("RGB")
+        rgb.load()
+        logo = ImageReader(rgb)
+        logo.getRGBData()
+    except Exception:
+        logo = None
+    with _logo_lock:
+        _logo_cache[logo_path] = (stamp, logo)
+    return logo
+
+if REPORTLAB_AVAILABLE:
+    class _DrawingFlowable(Flowable):
+        def __init__(self, drawing, width, height):
+            super().__init__()
+            self.drawing = drawing
+            self.width = width
+            self.height = height
+
+        def wrap(self, availWidth, availHeight):
+            return self.width, self.height
+
+        def draw(self):
+            renderPDF.draw(self.drawing, self.canv, 0, 0)
+
+    class _ImageFlowable(Flowable):
+        def __init__(self, reader, width, height):
+            super().__init__()
+            self.reader = reader
+            self.width = width
+            self.height = height
+
+        def wrap(self, availWidth, availHeight):
+            return self.width, self.height
+
+        def draw(self):
+            self.canv.drawImage(self.reader, 0, 0, self.width, self.height)
+
+def _logo_flowable(logo_path):
+    logo = _get_logo(logo_path)
+    if logo is None:
+        return ""
+    max_w = 30 * mm
+    max_h = 18 * mm
+    iw, ih = logo.getSize()
+    if iw > 0 and ih > 0:
+        scale = min(max_w / iw, max_h / ih)
+        return _ImageFlowable(logo, iw * scale, ih * scale)
+    return _ImageFlowable(logo, max_w, max_h)
+
+def build_os_pdf(order, company, logo_path, public_url=None):
+    _require_reportlab()
+    res = _get_resources()
+    style_title = res['title']
+    style_section = res['section']
+    style_small = res['small']
+    style_value = res['value']
+    style_block = res['block']
 
     buffer = BytesIO()
 
@@ -43,51 +268,6 @@ def build_os_pdf(order, company, logo_path, public_url=None):
         title="Ordem de Serviço",
     )
 
-    styles = getSampleStyleSheet()
-    style_title = ParagraphStyle(
-        "os_title",
-        parent=styles["Heading1"],
-        fontName="Helvetica-Bold",
-        fontSize=16,
-        leading=20,
-        spaceAfter=6,
-        textColor=colors.HexColor("#111111"),
-    )
-    style_section = ParagraphStyle(
-        "os_section",
-        parent=styles["Heading3"],
-        fontName="Helvetica-Bold",
-        fontSize=11,
-        leading=14,
-        spaceBefore=10,
-        spaceAfter=6,
-        textColor=colors.HexColor("#111111"),
-    )
-    style_small = ParagraphStyle(
-        "os_small",
-        parent=styles["Normal"],
-        fontName="Helvetica",
-        fontSize=9,
-        leading=12,
-        textColor=colors.HexColor("#333333"),
-    )
-    style_value = ParagraphStyle(
-        "os_value",
-        parent=styles["Normal"],
-        fontName="Helvetica",
-        fontSize=10,
-        leading=13,
-        textColor=colors.HexColor("#111111"),
-    )
-    style_block = ParagraphStyle(
-        "os_block",
-        parent=styles["Normal"],
-        fontName="Helvetica",
-        fontSize=9.5,
-        leading=13,
-        textColor=colors.HexColor("#111111"),
-    )
-
     company_name = (company.get("name") or "").strip() or "Clínica CELL"
     company_cnpj = (company.get("cnpj") or "").strip()
     company_phone = (company.get("phone") or "").strip()
@@ -106,116 +286,29 @@ def build_os_pdf(order, company, logo_path, public_url=None):
 
     header_right = Paragraph("<br/>".join(header_right_lines), style_small)
 
-    logo_cell = ""
-    try:
-        if logo_path and os.path.exists(logo_path):
-            from PIL import Image as _PILImage
-
-            img = _PILImage.open(logo_path).convert("RGBA")
-            bg = _PILImage.new("RGBA", img.size, (255, 255, 255, 255))
-            bg.alpha_composite(img)
-            rgb = bg.convert("RGB")
-
-            img_buffer = BytesIO()
-            rgb.save(img_buffer, format="PNG")
-            img_buffer.seek(0)
-
-            logo = Image(img_buffer)
-            max_w = 30 * mm
-            max_h = 18 * mm
-            iw = float(getattr(logo, "imageWidth", 0) or 0)
-            ih = float(getattr(logo, "imageHeight", 0) or 0)
-            if iw > 0 and ih > 0:
-                scale = min(max_w / iw, max_h / ih)
-                logo.drawWidth = iw * scale
-                logo.drawHeight = ih * scale
-            else:
-                logo.drawWidth = max_w
-                logo.drawHeight = max_h
-
-            logo_cell = logo
-    except Exception:
-        logo_cell = ""
+    logo_cell = _logo_flowable(logo_path)
 
     def _separator():
-        return Table(
-            [[""]],
-            colWidths=[doc.width],
-            style=TableStyle([("LINEBELOW", (0, 0), (-1, -1), 1, colors.HexColor("#111111"))]),
-        )
+        return Table([[""]], colWidths=[doc.width], style=res['separator_table'])
 
     def _kv_table(pairs):
         rows = []
         for k, v in pairs:
             rows.append([Paragraph(f"<b>{escape(_text(k))}</b>", style_small), _multiline_paragraph(v, style_value)])
-        return Table(
-            rows,
-            colWidths=[48 * mm, doc.width - 48 * mm],
-            style=TableStyle(
-                [
-                    ("VALIGN", (0, 0), (-1, -1), "TOP"),
-                    ("GRID", (0, 0), (-1, -1), 0.5, colors.HexColor("#CCCCCC")),
-                    ("BACKGROUND", (0, 0), (0, -1), colors.HexColor("#F3F3F3")),
-                    ("LEFTPADDING", (0, 0), (-1, -1), 6),
-                    ("RIGHTPADDING", (0, 0), (-1, -1), 6),
-                    ("TOPPADDING", (0, 0), (-1, -1), 4),
-                    ("BOTTOMPADDING", (0, 0), (-1, -1), 4),
-                ]
-            ),
-        )
+        return Table(rows, colWidths=[48 * mm, doc.width - 48 * mm], style=res['kv_table'])
 
     def _block_box(title, body):
-        table = Table(
+        return Table(
             [
                 [Paragraph(f"<b>{escape(_text(title))}</b>", style_small)],
                 [_multiline_paragraph(body, style_block)],
             ],
             colWidths=[doc.width],
-            style=TableStyle(
-                [
-                    ("GRID", (0, 0), (-1, -1), 0.5, colors.HexColor("#CCCCCC")),
-                    ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#F3F3F3")),
-                    ("LEFTPADDING", (0, 0), (-1, -1), 8),
-                    ("RIGHTPADDING", (0, 0), (-1, -1), 8),
-                    ("TOPPADDING", (0, 0), (-1, -1), 6),
-                    ("BOTTOMPADDING", (0, 0), (-1, -1), 6),
-                ]
-            ),
+            style=res['block_table'],
         )
-        return table
-
-    header_table = Table(
-        [[logo_cell, header_right, ""]],
-        colWidths=[32 * mm, doc.width - 32 * mm - 28 * mm, 28 * mm],
-        style=TableStyle(
-            [
-                ("VALIGN", (0, 0), (-1, -1), "TOP"),
-                ("LEFTPADDING", (0, 0), (-1, -1), 0),
-                ("RIGHTPADDING", (0, 0), (-1, -1), 0),
-                ("BOTTOMPADDING", (0, 0), (-1, -1), 0),
-            ]
-        ),
-    )
 
+    header_right_cell = ""
     if public_url:
-        from reportlab.graphics.barcode.qr import QrCodeWidget
-        from reportlab.graphics.shapes import Drawing
-        from reportlab.graphics import renderPDF
-        from reportlab.platypus import Flowable
-
-        class _DrawingFlowable(Flowable):
-            def __init__(self, drawing, width, height):
-                super().__init__()
-                self.drawing = drawing
-                self.width = width
-                self.height = height
-
-            def wrap(self, availWidth, availHeight):
-                return self.width, self.height
-
-            def draw(self):
-                renderPDF.draw(self.drawing, self.canv, 0, 0)
-
         qr_size = 24 * mm
         qr_widget = QrCodeWidget(public_url)
         bounds = qr_widget.getBounds()
@@ -226,7 +319,13 @@ def build_os_pdf(order, company, logo_path, public_url=None):
 
         qr_flow = _DrawingFlowable(drawing, qr_size, qr_size)
         qr_caption = Paragraph("Status da OS", style_small)
-        header_table._cellvalues[0][2] = [qr_flow, Spacer(1, 2 * mm), qr_caption]
+        header_right_cell = [qr_flow, Spacer(1, 2 * mm), qr_caption]
+
+    header_table = Table(
+        [[logo_cell, header_right, header_right_cell]],
+        colWidths=[32 * mm, doc.width - 32 * mm - 28 * mm, 28 * mm],
+        style=res['header_table'],
+    )
 
     elements = [header_table, Spacer(1, 6 * mm)]
 
@@ -320,22 +419,7 @@ def build_os_pdf(order, company, logo_path, public_url=None):
             ["Total", _money(total_value)],
         ],
         colWidths=[doc.width - 40 * mm, 40 * mm],
-        style=TableStyle(
-            [
-                ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#111111")),
-                ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
-                ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
-                ("GRID", (0, 0), (-1, -1), 0.5, colors.HexColor("#CCCCCC")),
-                ("FONTNAME", (0, 1), (-1, -1), "Helvetica"),
-                ("ALIGN", (1, 1), (1, -1), "RIGHT"),
-                ("LEFTPADDING", (0, 0), (-1, -1), 6),
-                ("RIGHTPADDING", (0, 0), (-1, -1), 6),
-                ("TOPPADDING", (0, 0), (-1, -1), 5),
-                ("BOTTOMPADDING", (0, 0), (-1, -1), 5),
-                ("BACKGROUND", (0, 3), (-1, 3), colors.HexColor("#F3F3F3")),
-                ("FONTNAME", (0, 3), (-1, 3), "Helvetica-Bold"),
-            ]
-        ),
+        style=res['values_table'],
     )
     elements.append(values_table)
 
@@ -359,18 +443,196 @@ def build_os_pdf(order, company, logo_path, public_url=None):
             ["", ""],
         ],
         colWidths=[doc.width / 2, doc.width / 2],
-        style=TableStyle(
-            [
-                ("LINEABOVE", (0, 2), (0, 2), 1, colors.HexColor("#111111")),
-                ("LINEABOVE", (1, 2), (1, 2), 1, colors.HexColor("#111111")),
-                ("TOPPADDING", (0, 1), (-1, 2), 18),
-                ("BOTTOMPADDING", (0, 1), (-1, 2), 0),
-                ("LEFTPADDING", (0, 0), (-1, -1), 0),
-                ("RIGHTPADDING", (0, 0), (-1, -1), 0),
-            ]
-        ),
+        style=res['sign_table'],
     )
     elements.append(sign_table)
 
     doc.build(elements)
     return buffer.getvalue()
+
+def os_pdf_etag(order, company, logo_path, public_url=None):
+    """Hash de tudo o que entra no PDF; muda sempre que o documento mudaria"""
+    payload = json.dumps(
+        [order, company, public_url, _logo_stamp(logo_path) if logo_path else None],
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def _pdf_cache_key(order, company, logo_path, public_url):
+    etag = os_pdf_etag(order, company, logo_path, public_url)
+    return (order.get('id'), str(order.get('updated_at')), etag), etag
+
+def _cached_pdf(key):
+    with _pdf_cache_lock:
+        pdf = _pdf_cache.get(key)
+        if pdf is not None:
+            _pdf_cache.move_to_end(key)
+        return pdf
+
+def get_os_pdf(order, company, logo_path, public_url=None):
+    """Retorna (bytes do PDF, etag), reaproveitando o PDF já gerado para a mesma versão da OS"""
+    global _pdf_cache_bytes
+    key, etag = _pdf_cache_key(order, company, logo_path, public_url)
+    pdf = _cached_pdf(key)
+    if pdf is not None:
+        return pdf, etag
+
+    pdf = build_os_pdf(order, company, logo_path, public_url)
+
+    with _pdf_cache_lock:
+        # Uma versão por OS: a anterior deixa de ser servida assim que a OS muda
+        old_key = _pdf_cache_keys.pop(key[0], None)
+        if old_key is not None and old_key in _pdf_cache:
+            _pdf_cache_bytes -= len(_pdf_cache.pop(old_key))
+        if len(pdf) <= OS_PDF_CACHE_MAX_BYTES:
+            _pdf_cache[key] = pdf
+            _pdf_cache_keys[key[0]] = key
+            _pdf_cache_bytes += len(pdf)
+            while _pdf_cache and (len(_pdf_cache) > OS_PDF_CACHE_MAX_ENTRIES or _pdf_cache_bytes > OS_PDF_CACHE_MAX_BYTES):
+                evicted_key, evicted = _pdf_cache.popitem(last=False)
+                if _pdf_cache_keys.get(evicted_key[0]) == evicted_key:
+                    del _pdf_cache_keys[evicted_key[0]]
+                _pdf_cache_bytes -= len(evicted)
+    return pdf, etag
+
+# ========== EXPORTAÇÃO EM LOTE ==========
+
+# A geração é CPU pura (e segura o GIL), então o lote roda em processos
+# separados. O pool é criado na primeira exportação, com "spawn" para não
+# herdar threads e conexões do worker.
+#
+# OS_PDF_PROCESSES: processos de renderização POR WORKER do Gunicorn (cada um
+# é um interpretador inteiro, ~40 MB). O padrão é 2, ou 1 em máquinas de um
+# núcleo (gera no próprio worker, sem pool). Com vários workers, o total é
+# workers × OS_PDF_PROCESSES: em instâncias pequenas mantenha 1.
+OS_PDF_PROCESSES = int(os.environ.get('OS_PDF_PROCESSES', str(min(2, os.cpu_count() or 1))))
+_STREAM_CHUNK_SIZE = 64 * 1024
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+def _get_process_pool():
+    global _process_pool
+    if OS_PDF_PROCESSES <= 1:
+        return None
+    with _process_pool_lock:
+        if _process_pool is None:
+            try:
+                _process_pool = ProcessPoolExecutor(
+                    max_workers=OS_PDF_PROCESSES,
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+            except Exception as e:
+                print(f"⚠️  Pool de processos indisponível, gerando PDFs no próprio worker: {e}")
+                return None
+        return _process_pool
+
+def _render_job(job):
+    order, company, logo_path, public_url = job
+    return build_os_pdf(order, company, logo_path, public_url)
+
+def os_pdf_filename(order):
+    os_number = order.get('os_number')
+    if os_number not in [None, '']:
+        return f"OS-{int(os_number):06d}.pdf"
+    return f"OS-{order.get('id')}.pdf"
+
+def iter_os_pdfs(orders, company, logo_path, public_url_for=None):
+    """Gera (ordem, bytes do PDF) na ordem recebida, renderizando em paralelo.
+
+    PDFs já no cache do worker são reaproveitados; os demais vão para o pool de
+    processos. No máximo 2x OS_PDF_PROCESSES PDFs ficam em memória ao mesmo tempo.
+    """
+    _require_reportlab()
+    pool = _get_process_pool()
+    window = max(OS_PDF_PROCESSES, 1) * 2
+    pending = []
+    orders = iter(orders)
+
+    def _submit(order):
+        job = (order, company, logo_path, public_url_for(order) if public_url_for else None)
+        key, _ = _pdf_cache_key(*job)
+        cached = _cached_pdf(key)
+        if cached is not None or pool is None:
+            return order, cached, job
+        return order, pool.submit(_render_job, job), job
+
+    for order in orders:
+        pending.append(_submit(order))
+        if len(pending) >= window:
+            break
+
+    while pending:
+        order, result, job = pending.pop(0)
+        if result is None:
+            pdf = _render_job(job)
+        elif isinstance(result, bytes):
+            pdf = result
+        else:
+            pdf = result.result()
+        next_order = next(orders, None)
+        if next_order is not None:
+            pending.append(_submit(next_order))
+        yield order, pdf
+
+class _StreamBuffer(RawIOBase):
+    """Destino de escrita sem seek: acumula bytes até o gerador drená-los"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+def stream_os_pdfs_zip(orders, company, logo_path, public_url_for=None):
+    """ZIP com um PDF por OS, produzido em blocos à medida que os PDFs ficam prontos"""
+    sink = _StreamBuffer()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for order, pdf in iter_os_pdfs(orders, company, logo_path, public_url_for):
+            zf.writestr(os_pdf_filename(order), pdf)
+            data = sink.drain()
+            if data:
+                yield data
+    data = sink.drain()
+    if data:
+        yield data
+
+def can_merge_pdfs():
+    try:
+        import pypdf  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def stream_os_pdfs_merged(orders, company, logo_path, public_url_for=None):
+    """Um único PDF com todas as OS. As páginas são juntadas em um arquivo temporário
+    (spool em disco acima de 8 MB) e enviadas em blocos.
+
+    O PdfWriter mantém todas as páginas em memória até o fim: quem chama limita
+    o lote (SERVICE_ORDER_MERGED_PDF_MAX); lotes grandes vão pelo ZIP.
+    """
+    from pypdf import PdfWriter
+
+    writer = PdfWriter()
+    for _, pdf in iter_os_pdfs(orders, company, logo_path, public_url_for):
+        writer.append(BytesIO(pdf))
+    with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as spool:
+        writer.write(spool)
+        writer.close()
+        spool.seek(0)
+        while True:
+            chunk = spool.read(_STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
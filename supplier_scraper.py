@@ -1,19 +1,233 @@
 
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 import re
+import importlib.util
 import concurrent.futures
 from urllib.parse import urljoin, quote, urlparse
 import json
+import os
 import random
+import threading
+import time
+import uuid
+import hashlib
+import unicodedata
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-def search_product_in_suppliers(suppliers, query):
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+# ========== SESSÕES HTTP POR HOST ==========
+# Cada host de fornecedor (e o DuckDuckGo) tem uma requests.Session própria,
+# compartilhada entre buscas: as conexões ficam abertas (keep-alive) e as
+# próximas requisições ao mesmo host reaproveitam o TCP+TLS já negociado.
+# Um semáforo por host limita quantas requisições simultâneas cada site recebe.
+HOST_MAX_CONCURRENCY = max(1, _env_int('SCRAPER_HOST_CONCURRENCY', 2))
+HTTP_RETRIES = max(0, _env_int('SCRAPER_HTTP_RETRIES', 2))
+
+# Prazo total de cada fornecedor dentro de uma busca (a busca não espera mais
+# que isso pelo site mais lento)
+SUPPLIER_DEADLINE = max(1, _env_int('SCRAPER_SUPPLIER_DEADLINE', 25))
+
+_sessions = {}
+_host_slots = {}
+_request_limits = threading.local()
+_sessions_lock = threading.Lock()
+_http_stats = {'requests': 0, 'errors': 0}
+_http_stats_lock = threading.Lock()
+
+def _new_session():
+    # 429/5xx: nova tentativa com backoff exponencial (0,5s, 1s...). O
+    # Retry-After é ignorado para a busca não ficar presa esperando o site.
+    retry = Retry(
+        total=HTTP_RETRIES,
+        connect=1,
+        read=0,
+        status=HTTP_RETRIES,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(['GET']),
+        respect_retry_after_header=False,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HOST_MAX_CONCURRENCY, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def _session_for(host):
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = _sessions[host] = _new_session()
+            _host_slots[host] = threading.BoundedSemaphore(HOST_MAX_CONCURRENCY)
+        return session, _host_slots[host]
+
+class SearchInterrupted(Exception):
+    """Prazo do fornecedor esgotado ou busca cancelada"""
+
+def is_http_url(url):
+    """Só links http(s) vão para os resultados (e para o href no admin)"""
+    try:
+        return isinstance(url, str) and urlparse(url.strip()).scheme in ('http', 'https')
+    except ValueError:
+        return False
+
+def http_get(url, headers=None, timeout=8):
+    """GET pela sessão do host, respeitando o limite de concorrência por host.
+
+    Dentro de uma busca, o timeout nunca passa do prazo restante do
+    fornecedor, e um prazo esgotado ou uma busca cancelada interrompem a
+    próxima requisição com SearchInterrupted.
+    """
+    cancel = getattr(_request_limits, 'cancel', None)
+    if cancel is not None and cancel.is_set():
+        raise SearchInterrupted("busca cancelada")
+    deadline = getattr(_request_limits, 'deadline', None)
+    if deadline is not None:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise SearchInterrupted("prazo do fornecedor esgotado")
+        timeout = min(timeout, remaining)
+    session, slots = _session_for(urlparse(url).netloc.lower())
+    with slots:
+        try:
+            response = session.get(url, headers=headers, timeout=timeout)
+        except Exception:
+            with _http_stats_lock:
+                _http_stats['requests'] += 1
+                _http_stats['errors'] += 1
+            raise
+    with _http_stats_lock:
+        _http_stats['requests'] += 1
+    return response
+
+def get_http_stats():
+    """Requisições feitas e conexões abertas pelas sessões deste worker.
+
+    `connections` conta handshakes TCP(+TLS) e `reused` as requisições que
+    aproveitaram uma conexão já aberta (keep-alive).
+    """
+    with _http_stats_lock:
+        stats = dict(_http_stats)
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+    connections = 0
+    pool_requests = 0
+    for session in sessions:
+        adapters = {id(a): a for a in session.adapters.values()}
+        for adapter in adapters.values():
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                conn_pool = pools.get(key)
+                if conn_pool is None:
+                    continue
+                connections += conn_pool.num_connections
+                pool_requests += conn_pool.num_requests
+    stats['hosts'] = len(sessions)
+    stats['connections'] = connections
+    stats['reused'] = max(pool_requests - connections, 0)
+    return stats
+
+# ========== LEITURA DO HTML ==========
+# O JSON-LD é lido direto do texto (sem árvore) depois de um pré-filtro por
+# substring. Quando a árvore é necessária (heurística visual), scripts,
+# estilos e SVGs saem antes do parse, e o parser é o lxml se estiver instalado
+# (várias vezes mais rápido que o html.parser). bench_scraper.py mede a
+# diferença por página.
+HTML_PARSER = 'lxml' if importlib.util.find_spec('lxml') else 'html.parser'
+
+_JSON_LD_RE = re.compile(
+    r'<script\b[^>]*\btype\s*=\s*["\']?application/ld\+json["\']?[^>]*>(.*?)</script\s*>',
+    re.I | re.S,
+)
+_NON_CONTENT_RE = re.compile(r'<(script|style|noscript|svg|template)\b[^>]*>.*?</\1\s*>', re.I | re.S)
+
+def json_ld_items(html):
+    """Objetos JSON-LD da página (listas e @graph achatados), sem montar a árvore"""
+    if 'ld+json' not in html and 'LD+JSON' not in html:
+        return []
+    items = []
+    for raw in _JSON_LD_RE.findall(html):
+        try:
+            data = json.loads(raw.strip())
+        except ValueError:
+            continue
+        for item in data if isinstance(data, list) else [data]:
+            if not isinstance(item, dict):
+                continue
+            if isinstance(item.get('@graph'), list):
+                items.extend(i for i in item['@graph'] if isinstance(i, dict))
+            else:
+                items.append(item)
+    return items
+
+def parse_html(html, parse_only=None):
+    """Árvore do conteúdo visível da página (sem scripts/estilos) com o parser mais rápido"""
+    return BeautifulSoup(_NON_CONTENT_RE.sub('', html), HTML_PARSER, parse_only=parse_only)
+
+# ========== PERFIL DE BUSCA POR FORNECEDOR ==========
+# Para cada site o scraper lembra qual URL de busca interna trouxe links (ou
+# 'ddg' se só o DuckDuckGo funcionou) e qual extração achou o produto nas
+# páginas de detalhe. A próxima busca começa pelo que funcionou e só volta a
+# sondar os outros padrões quando ele falha. O perfil fica no cache de
+# fornecedores (db.save_supplier_cache_entry, kind 'search_profile') com uma
+# cópia em memória por worker.
+SEARCH_PATTERNS = [
+    '/?s={q}&post_type=product',
+    '/search?q={q}',
+    '/busca?q={q}',
+    '/buscar?q={q}',
+    '/loja/busca?q={q}',
+]
+DETAIL_STRATEGIES = ['json_ld', 'heuristic']
+
+_profiles = {}
+_profiles_lock = threading.Lock()
+
+def get_search_profile(website):
+    """{'search_pattern': ..., 'detail_strategy': ...} aprendido para o site ({} se nenhum)"""
+    key = website.strip().rstrip('/').lower()
+    with _profiles_lock:
+        if key in _profiles:
+            return dict(_profiles[key])
+    import db
+    profile, _ = db.get_supplier_cache_entry('search_profile', key)
+    profile = profile if isinstance(profile, dict) else {}
+    with _profiles_lock:
+        _profiles[key] = profile
+    return dict(profile)
+
+def save_search_profile(website, profile):
+    key = website.strip().rstrip('/').lower()
+    with _profiles_lock:
+        _profiles[key] = dict(profile)
+    import db
+    db.save_supplier_cache_entry('search_profile', key, profile)
+
+def search_product_in_suppliers(suppliers, query, use_cache=False, on_supplier_done=None, cancel_event=None):
     """
     Busca um produto em todos os sites dos fornecedores cadastrados.
     Utiliza múltiplas estratégias com validação ESTRITA:
     1. Busca interna do site -> Filtra Links por Relevância -> Deep Scraping
     2. Busca externa via DuckDuckGo -> Filtra Links -> Deep Scraping
     
+    Com use_cache, os detalhes de cada página de produto já visitada vêm do
+    cache (db.get_supplier_cache_entry) enquanto tiverem menos de
+    SUPPLIER_PRODUCT_TTL segundos.
+
+    Cada fornecedor tem SUPPLIER_DEADLINE segundos; passado o prazo a busca
+    segue sem ele. on_supplier_done(supplier, status, resultados) é chamado
+    assim que cada fornecedor termina, com status 'ok', 'error', 'timeout'
+    ou 'cancelled'. cancel_event (qualquer objeto com is_set()) interrompe a
+    busca e devolve o que já foi encontrado.
+
     Retorna uma lista de resultados ordenados por preço.
     """
     results = []
@@ -59,26 +273,21 @@ def search_product_in_suppliers(suppliers, query):
             return relevance >= 0.4  # Reduzido para 40% para ser menos estrito
         return True
 
-    def extract_from_json_ld(soup, supplier_name, website):
+    def extract_from_json_ld(html, supplier_name, website):
         """Extrai produtos de dados estruturados JSON-LD"""
         products = []
         try:
-            scripts = soup.find_all('script', type='application/ld+json')
-            for script in scripts:
+            for item in json_ld_items(html):
                 try:
-                    data = json.loads(script.string)
-                    items = data if isinstance(data, list) else [data]
-                    
-                    for item in items:
-                        item_type = item.get('@type', '')
-                        if item_type == 'Product':
-                            process_json_product(item, products, supplier_name, website)
-                        elif item_type == 'ItemList' and 'itemListElement' in item:
-                            for sub_item in item['itemListElement']:
-                                if isinstance(sub_item, dict) and sub_item.get('item'):
-                                    process_json_product(sub_item['item'], products, supplier_name, website)
-                                else:
-                                    process_json_product(sub_item, products, supplier_name, website)
+                    item_type = item.get('@type', '')
+                    if item_type == 'Product':
+                        process_json_product(item, products, supplier_name, website)
+                    elif item_type == 'ItemList' and 'itemListElement' in item:
+                        for sub_item in item['itemListElement']:
+                            if isinstance(sub_item, dict) and sub_item.get('item'):
+                                process_json_product(sub_item['item'], products, supplier_name, website)
+                            else:
+                                process_json_product(sub_item, products, supplier_name, website)
                 except:
                     continue
         except:
@@ -110,6 +319,8 @@ def search_product_in_suppliers(suppliers, query):
             if price and price > 0 and url:
                 if not url.startswith('http'):
                     url = urljoin(website, url)
+                # urljoin devolve 'javascript:...' e afins sem alterar
+                if not is_http_url(url): return
                 
                 products.append({
                     'supplier_name': supplier_name,
@@ -215,6 +426,7 @@ def search_product_in_suppliers(suppliers, query):
                 if not found_link: continue
                     
                 link = urljoin(website, found_link['href'])
+                if not is_http_url(link): continue
                 title = found_link.get_text(strip=True)
                 
                 # Tentar melhorar o título
@@ -280,9 +492,9 @@ def search_product_in_suppliers(suppliers, query):
             url = f"https://lite.duckduckgo.com/lite/?q={quote(ddg_query)}"
             headers = get_headers()
             headers['Referer'] = 'https://lite.duckduckgo.com/'
-            resp = requests.get(url, headers=headers, timeout=10)
+            resp = http_get(url, headers=headers, timeout=10)
             if resp.status_code != 200: return []
-            soup = BeautifulSoup(resp.text, 'html.parser')
+            soup = BeautifulSoup(resp.text, HTML_PARSER, parse_only=SoupStrainer('a', class_='result-link'))
             links = []
             anchors = soup.find_all('a', class_='result-link')
             for a in anchors:
@@ -294,86 +506,444 @@ def search_product_in_suppliers(suppliers, query):
         except:
             return []
 
-    def fetch_product_details(url, supplier_name):
+    def fetch_product_details(url, supplier_name, strategies):
+        """Retorna (produto ou None, estratégia que extraiu o produto)"""
+        if not use_cache:
+            details, strategy, _ = scrape_product_details(url, supplier_name, strategies)
+            return details, strategy
+        import db
+        cached, age = db.get_supplier_cache_entry('product', url)
+        if cached is not None and age < db.SUPPLIER_PRODUCT_TTL:
+            db.record_supplier_cache_event('product_hits')
+            return cached.get('product'), None
+        db.record_supplier_cache_event('product_misses')
+        details, strategy, fetched = scrape_product_details(url, supplier_name, strategies)
+        # Páginas lidas (200) sem produto também ficam no cache (product = None);
+        # timeout, erro, prazo esgotado ou cancelamento não: tenta de novo na próxima
+        if fetched:
+            db.save_supplier_cache_entry('product', url, {'product': details})
+        return details, strategy
+
+    def extract_detail(html, parsed, supplier_name, url, strategy):
+        if strategy == 'json_ld':
+            json_products = extract_from_json_ld(html, supplier_name, url)
+            return json_products[0] if json_products else None
+        # A árvore só é montada se a heurística for de fato usada
+        if 'soup' not in parsed:
+            parsed['soup'] = parse_html(html)
+        heuristic_products = extract_via_heuristic(parsed['soup'], supplier_name, url)
+        heuristic_products.sort(key=lambda x: len(x['title']), reverse=True)
+        valid_products = [p for p in heuristic_products if p['price'] > 5]
+        return valid_products[0] if valid_products else None
+
+    def scrape_product_details(url, supplier_name, strategies):
+        """Retorna (produto ou None, estratégia, página lida?)"""
         try:
-            resp = requests.get(url, headers=get_headers(), timeout=8)
-            if resp.status_code != 200: return None
-            soup = BeautifulSoup(resp.text, 'html.parser')
+            resp = http_get(url, headers=get_headers(), timeout=8)
+            if resp.status_code != 200: return None, None, False
+            html = resp.text
+            parsed = {}
             
-            # Tenta JSON-LD primeiro
-            json_products = extract_from_json_ld(soup, supplier_name, url)
-            if json_products:
-                return json_products[0]
-            
-            # Tenta heurística
-            heuristic_products = extract_via_heuristic(soup, supplier_name, url)
-            if heuristic_products:
-                heuristic_products.sort(key=lambda x: len(x['title']), reverse=True)
-                valid_products = [p for p in heuristic_products if p['price'] > 5]
-                if valid_products:
-                    return valid_products[0]
-            return None
+            # Estratégia que funcionou da última vez primeiro (padrão: JSON-LD)
+            for strategy in strategies:
+                details = extract_detail(html, parsed, supplier_name, url, strategy)
+                if details:
+                    return details, strategy, True
+            return None, None, True
+        except:
+            return None, None, False
+
+    def search_links(url, supplier_name, website):
+        """Links de produto na página de busca interna ([] se a página não serviu)"""
+        try:
+            response = http_get(url, headers=get_headers(), timeout=8)
+            if response.status_code != 200:
+                return []
+            soup = parse_html(response.text)
+            # Extrair APENAS links relevantes
+            return [cand['link'] for cand in extract_via_heuristic(soup, supplier_name, website)]
         except:
-            return None
+            return []
 
     def process_supplier(supplier):
         supplier_results = []
         website = supplier['website'].strip().rstrip('/')
         supplier_name = supplier.get('name', 'Fornecedor')
+        profile = get_search_profile(website)
+        learned = profile.get('search_pattern')
         
-        # 1. Busca Interna -> Extrair Links
-        search_urls = [
-            f"{website}/?s={quote(query)}&post_type=product", 
-            f"{website}/search?q={quote(query)}", 
-            f"{website}/busca?q={quote(query)}",
-            f"{website}/buscar?q={quote(query)}",
-            f"{website}/loja/busca?q={quote(query)}"
-        ]
+        # 1. Busca Interna -> Extrair Links. O padrão aprendido vai primeiro e
+        # os demais só são tentados (redescoberta) se ele não trouxer links.
+        patterns = list(SEARCH_PATTERNS)
+        if learned in patterns:
+            patterns.remove(learned)
+            patterns.insert(0, learned)
+        elif learned == 'ddg':
+            patterns = []
         
         found_internal_links = []
-        for url in search_urls:
-            try:
-                response = requests.get(url, headers=get_headers(), timeout=8)
-                if response.status_code == 200:
-                    soup = BeautifulSoup(response.text, 'html.parser')
-                    # Extrair APENAS links relevantes
-                    candidates = extract_via_heuristic(soup, supplier_name, website)
-                    for cand in candidates:
-                        found_internal_links.append(cand['link'])
-                    if found_internal_links: break
-            except:
-                continue
+        used_pattern = None
+        for pattern in patterns:
+            found_internal_links = search_links(website + pattern.format(q=quote(query)), supplier_name, website)
+            if found_internal_links:
+                used_pattern = pattern
+                break
         
         # 2. Busca Externa (DDG) -> Extrair Links
         if not found_internal_links:
             ddg_links = search_duckduckgo_lite(query, website)
             for item in ddg_links:
                 found_internal_links.append(item['link'])
+            if found_internal_links:
+                used_pattern = 'ddg'
+            elif learned == 'ddg':
+                # DDG também falhou: volta a sondar a busca interna
+                for pattern in SEARCH_PATTERNS:
+                    found_internal_links = search_links(website + pattern.format(q=quote(query)), supplier_name, website)
+                    if found_internal_links:
+                        used_pattern = pattern
+                        break
 
         # 3. Deep Scraping (Visitar Links Relevantes)
+        strategies = list(DETAIL_STRATEGIES)
+        if profile.get('detail_strategy') in strategies:
+            strategies.remove(profile['detail_strategy'])
+            strategies.insert(0, profile['detail_strategy'])
+        strategy_hits = {}
         unique_links = list(set(found_internal_links))[:6] # Limitar a 6 visitas para aumentar chance de sucesso
         for link in unique_links:
-            details = fetch_product_details(link, supplier_name)
+            details, strategy = fetch_product_details(link, supplier_name, strategies)
+            if strategy:
+                strategy_hits[strategy] = strategy_hits.get(strategy, 0) + 1
             if details and is_relevant_title(details['title'], query_terms):
                 supplier_results.append(details)
+
+        # Só grava o que mudou. Se nenhum caminho trouxe links (produto que o
+        # fornecedor não tem), o padrão aprendido continua valendo.
+        updated = dict(profile)
+        if used_pattern:
+            updated['search_pattern'] = used_pattern
+        if strategy_hits:
+            updated['detail_strategy'] = max(strategy_hits, key=strategy_hits.get)
+        if updated != profile:
+            save_search_profile(website, updated)
                     
         return supplier_results
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
-        future_to_supplier = {executor.submit(process_supplier, s): s for s in valid_suppliers}
-        for future in concurrent.futures.as_completed(future_to_supplier):
-            try:
-                data = future.result()
-                if data: results.extend(data)
-            except Exception: pass
+    started = {}
 
-    # Deduplicar e Ordenar
+    def run_supplier(index, supplier):
+        started[index] = time.monotonic()
+        _request_limits.deadline = started[index] + SUPPLIER_DEADLINE
+        _request_limits.cancel = cancel_event
+        try:
+            return process_supplier(supplier)
+        finally:
+            _request_limits.deadline = None
+            _request_limits.cancel = None
+
+    def notify(supplier, status, data):
+        if on_supplier_done is None:
+            return
+        try:
+            on_supplier_done(supplier, status, data)
+        except Exception as e:
+            print(f"⚠️  Erro ao publicar resultado de {supplier.get('name')}: {e}")
+
+    stats_before = get_http_stats()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=8)
+    pending = {executor.submit(run_supplier, i, s): (i, s) for i, s in enumerate(valid_suppliers)}
+    try:
+        while pending:
+            done, _ = concurrent.futures.wait(pending, timeout=0.5, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                index, supplier = pending.pop(future)
+                try:
+                    data = future.result() or []
+                    status = 'ok'
+                except Exception:
+                    data = []
+                    status = 'error'
+                # As interrupções caem nos except das etapas; o que foi achado
+                # antes delas vale, mas o status mostra que a busca ficou parcial
+                if status == 'ok' and cancel_event is not None and cancel_event.is_set():
+                    status = 'cancelled'
+                elif status == 'ok' and time.monotonic() - started[index] >= SUPPLIER_DEADLINE:
+                    status = 'timeout'
+                results.extend(data)
+                notify(supplier, status, data)
+
+            # Uma requisição já em andamento pode passar um pouco do prazo;
+            # depois dessa folga o fornecedor é dado como esgotado
+            now = time.monotonic()
+            for future, (index, supplier) in list(pending.items()):
+                if index in started and now - started[index] > SUPPLIER_DEADLINE + 2:
+                    del pending[future]
+                    notify(supplier, 'timeout', [])
+
+            if cancel_event is not None and cancel_event.is_set():
+                for future, (_, supplier) in pending.items():
+                    future.cancel()
+                    notify(supplier, 'cancelled', [])
+                pending.clear()
+    finally:
+        # Não espera threads presas em sites lentos: elas param no próximo http_get
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    stats_after = get_http_stats()
+    print(f"📋 Busca em fornecedores: {stats_after['requests'] - stats_before['requests']} requisições, "
+          f"{stats_after['connections'] - stats_before['connections']} conexões novas")
+
+    return _unique_by_price(results)
+
+def _unique_by_price(results):
+    """Deduplica por link, descarta links que não são http(s) e ordena por preço"""
     unique_results = []
     seen_links = set()
     for r in results:
+        if not is_http_url(r.get('link')):
+            continue
         if r['link'] not in seen_links:
             unique_results.append(r)
             seen_links.add(r['link'])
     unique_results.sort(key=lambda x: x['price'])
-    
     return unique_results
+
+# ========== CACHE DE RESULTADOS (STALE-WHILE-REVALIDATE) ==========
+
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+def normalize_query(query):
+    """'  Tela iPhone  11 ' e 'tela iphone 11' viram a mesma chave (sem acentos)"""
+    text = unicodedata.normalize('NFKD', query or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(text.lower().split())
+
+def _search_cache_key(suppliers, query):
+    # Os resultados dependem dos fornecedores cadastrados: mudou a lista, muda a chave
+    websites = sorted(s['website'].strip().rstrip('/').lower() for s in suppliers
+                      if s.get('website') and s['website'].strip().startswith('http'))
+    digest = hashlib.sha1('\n'.join(websites).encode('utf-8')).hexdigest()[:12]
+    return f"{normalize_query(query)}|{digest}"
+
+def _refresh_search(key, suppliers, query):
+    import db
+    try:
+        results = search_product_in_suppliers(suppliers, query, use_cache=True)
+        db.save_supplier_cache_entry('search', key, {'query': query, 'results': results})
+        db.record_supplier_cache_event('refreshes')
+    except Exception as e:
+        print(f"⚠️  Erro ao atualizar cache da busca '{query}': {e}")
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(key)
+
+def _start_refresh(key, suppliers, query):
+    """Atualiza a entrada em segundo plano (uma atualização por chave por vez)"""
+    with _refreshing_lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+    thread = threading.Thread(target=_refresh_search, args=(key, suppliers, query),
+                              name='supplier-search-refresh', daemon=True)
+    thread.start()
+
+def cached_search(suppliers, query):
+    """Busca com cache: retorna (resultados, info).
+
+    - fresco (idade < SUPPLIER_SEARCH_TTL): devolve o cache;
+    - velho (até SUPPLIER_SEARCH_MAX_STALE): devolve o cache na hora e dispara
+      a atualização em segundo plano;
+    - ausente ou velho demais: faz a busca agora e grava o resultado.
+
+    info = {'status': 'hit' | 'stale' | 'miss', 'age': segundos desde a busca}
+    """
+    import db
+    key = _search_cache_key(suppliers, query)
+    cached, age = db.get_supplier_cache_entry('search', key)
+    if cached is not None and age < db.SUPPLIER_SEARCH_TTL:
+        db.record_supplier_cache_event('hits')
+        return cached.get('results', []), {'status': 'hit', 'age': age}
+    if cached is not None and age < db.SUPPLIER_SEARCH_MAX_STALE:
+        db.record_supplier_cache_event('stale_hits')
+        _start_refresh(key, suppliers, query)
+        return cached.get('results', []), {'status': 'stale', 'age': age}
+
+    db.record_supplier_cache_event('misses')
+    results = search_product_in_suppliers(suppliers, query, use_cache=True)
+    db.save_supplier_cache_entry('search', key, {'query': query, 'results': results})
+    return results, {'status': 'miss', 'age': 0}
+
+# ========== BUSCAS EM SEGUNDO PLANO ==========
+# start_search_job() devolve um id na hora e a busca roda em uma thread. O
+# estado do job (fornecedores concluídos, resultados parciais) fica em memória
+# e é gravado no cache de fornecedores a cada fornecedor concluído, para que
+# os endpoints de acompanhamento funcionem mesmo se a requisição cair em outro
+# worker do gunicorn. O cancelamento pedido por outro worker também passa pelo
+# cache (kind 'search_job_cancel'). As linhas dos jobs são apagadas depois de
+# SEARCH_JOB_TTL (e o pedido de cancelamento, assim que o job termina).
+SEARCH_JOB_TTL = _env_int('SCRAPER_SEARCH_JOB_TTL', 1800)
+SEARCH_JOB_MAX = 100
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+class _JobCancel:
+    """Cancelamento local (set) ou pedido por outro worker (conferido a cada 1s)"""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self._event = threading.Event()
+        self._checked_at = time.monotonic()
+
+    def set(self):
+        self._event.set()
+
+    def is_set(self):
+        if self._event.is_set():
+            return True
+        now = time.monotonic()
+        if now - self._checked_at >= 1:
+            self._checked_at = now
+            import db
+            requested, _ = db.get_supplier_cache_entry('search_job_cancel', self.job_id)
+            if requested:
+                self._event.set()
+        return self._event.is_set()
+
+def _job_snapshot(job):
+    return {
+        'id': job['id'],
+        'query': job['query'],
+        'status': job['status'],
+        'total': job['total'],
+        'suppliers': [dict(entry) for entry in job['suppliers']],
+        'results': list(job['results']),
+        'cache': dict(job['cache']) if job['cache'] else None,
+    }
+
+def _publish_job(job):
+    """Grava o estado atual no cache (chamar sem job['lock'])
+
+    A gravação no banco fica fora do lock do estado para não travar quem lê o
+    job; write_lock só serializa as gravações, e cada uma tira o snapshot na
+    hora, então a última gravada é sempre a mais nova.
+    """
+    import db
+    with job['write_lock']:
+        with job['lock']:
+            snapshot = _job_snapshot(job)
+        db.save_supplier_cache_entry('search_job', job['id'], snapshot)
+
+def _register_job(job):
+    import db
+    with _jobs_lock:
+        now = time.monotonic()
+        for job_id in [j for j, entry in _jobs.items() if now - entry['created'] > SEARCH_JOB_TTL]:
+            del _jobs[job_id]
+        while len(_jobs) >= SEARCH_JOB_MAX:
+            del _jobs[next(iter(_jobs))]
+        _jobs[job['id']] = job
+    db.purge_supplier_cache('search_job', SEARCH_JOB_TTL)
+    db.purge_supplier_cache('search_job_cancel', SEARCH_JOB_TTL)
+
+def _run_search_job(job, suppliers, key):
+    import db
+
+    def on_supplier_done(supplier, status, data):
+        with job['lock']:
+            job['suppliers'].append({
+                'name': supplier.get('name', 'Fornecedor'),
+                'status': status,
+                'results': _unique_by_price(data),
+            })
+            job['results'] = _unique_by_price(job['results'] + data)
+        _publish_job(job)
+
+    try:
+        search_product_in_suppliers(suppliers, job['query'], use_cache=True,
+                                    on_supplier_done=on_supplier_done, cancel_event=job['cancel'])
+    except Exception as e:
+        print(f"⚠️  Erro na busca em segundo plano '{job['query']}': {e}")
+    cancelled = job['cancel'].is_set()
+    with job['lock']:
+        job['status'] = 'cancelled' if cancelled else 'done'
+    _publish_job(job)
+    if cancelled:
+        db.delete_supplier_cache_entry('search_job_cancel', job['id'])
+    else:
+        db.save_supplier_cache_entry('search', key, {'query': job['query'], 'results': job['results']})
+
+def start_search_job(suppliers, query):
+    """Inicia a busca em segundo plano e retorna o estado inicial do job.
+
+    Com resultado no cache (fresco ou velho, ver cached_search) o job já nasce
+    concluído; o cache velho dispara a atualização em segundo plano.
+    """
+    import db
+    valid = [s for s in suppliers if s.get('website') and s['website'].strip().startswith('http')]
+    job = {
+        'id': uuid.uuid4().hex,
+        'query': query,
+        'status': 'running',
+        'total': len(valid),
+        'suppliers': [],
+        'results': [],
+        'cache': None,
+        'created': time.monotonic(),
+        'lock': threading.Lock(),
+        'write_lock': threading.Lock(),
+    }
+    job['cancel'] = _JobCancel(job['id'])
+
+    key = _search_cache_key(suppliers, query)
+    cached, age = db.get_supplier_cache_entry('search', key)
+    if cached is not None and age < db.SUPPLIER_SEARCH_MAX_STALE:
+        fresh = age < db.SUPPLIER_SEARCH_TTL
+        db.record_supplier_cache_event('hits' if fresh else 'stale_hits')
+        if not fresh:
+            _start_refresh(key, suppliers, query)
+        job['status'] = 'done'
+        job['results'] = cached.get('results', [])
+        job['cache'] = {'status': 'hit' if fresh else 'stale', 'age': age}
+    elif not valid:
+        job['status'] = 'done'
+    else:
+        db.record_supplier_cache_event('misses')
+
+    _register_job(job)
+    _publish_job(job)
+    if job['status'] == 'running':
+        thread = threading.Thread(target=_run_search_job, args=(job, suppliers, key),
+                                  name='supplier-search-job', daemon=True)
+        thread.start()
+    return _job_snapshot(job)
+
+def get_search_job(job_id):
+    """Estado do job (None se não existir). Não espera: a página consulta a cada 1s"""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if job is not None:
+        with job['lock']:
+            return _job_snapshot(job)
+
+    # Job de outro worker: lê o último estado gravado
+    import db
+    snapshot, age = db.get_supplier_cache_entry('search_job', job_id)
+    if snapshot is None or age > SEARCH_JOB_TTL:
+        return None
+    return snapshot
+
+def cancel_search_job(job_id):
+    """Pede o cancelamento; retorna False se o job não existir"""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if job is not None:
+        job['cancel'].set()
+        return True
+    if get_search_job(job_id) is None:
+        return False
+    import db
+    db.save_supplier_cache_entry('search_job_cancel', job_id, True)
+    return True